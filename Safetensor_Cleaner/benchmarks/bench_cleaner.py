@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""Time the safetensor_cleaner phases on synthetic libraries of growing size and compare with a JSON baseline."""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "safetensor_cleaner.py"
+SPEC = importlib.util.spec_from_file_location("safetensor_cleaner", MODULE_PATH)
+assert SPEC and SPEC.loader
+CLEANER = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = CLEANER
+SPEC.loader.exec_module(CLEANER)
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from generate_library import DEFAULT_IGNORED_FOLDERS, generate_library, models_for_files  # noqa: E402
+
+PHASES = ("scan", "group", "detect_versions", "categorize", "report")
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+
+def dry_run_args() -> argparse.Namespace:
+    """Command line of a plain dry run (no --move / --delete_*)."""
+    return argparse.Namespace(
+        delete_orphan=False, delete_duplicates=False, move=False, confirm_each=False,
+        verbose=False, show_unknown=False, plan_out=None,
+    )
+
+
+def run_once(root: Path, config, workers: int) -> dict[str, float]:
+    """Scans, groups, detects versions and runs a dry-run cleanup; returns seconds per phase."""
+    profiler = CLEANER.Profiler()
+    CLEANER.set_profiler(profiler)
+    try:
+        cleaner = CLEANER.Cleaner(root, config=config, scan_workers=workers)
+        cleaner.scan()
+        cleaner.versions()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            CLEANER.handle_cleanup_mode(cleaner.groups(), dry_run_args())
+    finally:
+        CLEANER.set_profiler(None)
+    return {phase["name"]: phase["seconds"] for phase in profiler.phases}
+
+
+def bench_size(files: int, workers: int, repeat: int, directory: Path | None) -> dict:
+    """Generates a library of about `files` files and returns its best time per phase over `repeat` runs."""
+    with tempfile.TemporaryDirectory(dir=directory) as temporary:
+        root = Path(temporary) / "models"
+        models = models_for_files(files)
+        started = time.perf_counter()
+        manifest = generate_library(root, models=models, orphans=models // 20, duplicates=models // 50,
+                                    misplaced=models // 50)
+        print(f"\n{manifest['files']:,} files generated in {time.perf_counter() - started:.1f}s")
+        config = CLEANER.CleanerConfig(ignore_folders=DEFAULT_IGNORED_FOLDERS)
+        best: dict[str, float] = {}
+        for _ in range(repeat):
+            for name, seconds in run_once(root, config, workers).items():
+                best[name] = min(seconds, best.get(name, seconds))
+    best["total"] = sum(best.get(name, 0.0) for name in PHASES)
+    return {"files": manifest["files"], "seconds": best}
+
+
+def load_baseline(path: Path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def print_results(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Prints one table per size (with the change against the baseline), returns the regressions."""
+    regressions = []
+    for size, result in results.items():
+        reference = baseline.get("results", {}).get(size, {}).get("seconds", {})
+        print(f"\n{int(size):,} files (actual {result['files']:,})")
+        print(f"  {'phase':<16} {'seconds':>9} {'files/s':>12} {'baseline':>9} {'change':>8}")
+        for name in (*PHASES, "total"):
+            seconds = result["seconds"].get(name)
+            if seconds is None:
+                continue
+            rate = f"{result['files'] / seconds:,.0f}" if seconds > 0 else ""
+            previous = reference.get(name)
+            change = ""
+            if previous:
+                ratio = seconds / previous
+                change = f"{ratio:.2f}x"
+                # Phases shorter than a few milliseconds are too noisy to flag
+                if ratio > tolerance and seconds - previous > 0.005:
+                    regressions.append(f"{int(size):,} files, {name}: {previous:.3f}s -> {seconds:.3f}s")
+            base = f"{previous:.3f}" if previous else ""
+            print(f"  {name:<16} {seconds:>9.3f} {rate:>12} {base:>9} {change:>8}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Library sizes in files (default: 1000 10000 100000; add 1000000 for the full suite)")
+    parser.add_argument("--workers", type=int, default=1, help="Scan workers (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size, the best time of each phase is kept (default: 3)")
+    parser.add_argument("--dir", type=Path, help="Where to generate the libraries (default: system temp folder)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline JSON file (default: benchmarks/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Slowdown ratio reported as a regression (default: 1.25)")
+    args = parser.parse_args()
+
+    results = {str(size): bench_size(size, args.workers, args.repeat, args.dir) for size in args.sizes}
+    baseline = load_baseline(args.baseline)
+    if baseline and baseline.get("machine") != platform.node():
+        print(f"\nNote: the baseline was recorded on {baseline.get('machine')}, timings may not be comparable.")
+    regressions = print_results(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        stored = baseline.get("results", {}) if baseline else {}
+        stored.update(results)
+        document = {
+            "machine": platform.node(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": args.workers,
+            "recorded": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": stored,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=1)
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""Compare the safetensor_cleaner directory walkers (speed and grouping memory) on a synthetic model tree."""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "safetensor_cleaner.py"
+SPEC = importlib.util.spec_from_file_location("safetensor_cleaner", MODULE_PATH)
+assert SPEC and SPEC.loader
+CLEANER = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = CLEANER
+SPEC.loader.exec_module(CLEANER)
+
+SIDECARS = (".preview.png", ".civitai.info", ".metadata.json", ".sha256")
+
+
+def build_tree(root: Path, total_files: int, files_per_dir: int) -> int:
+    """Creates empty model + sidecar files spread over nested folders, returns the file count."""
+    created = 0
+    folder = 0
+    while created < total_files:
+        directory = root / f"family{folder // 20:04d}" / f"folder{folder:05d}"
+        directory.mkdir(parents=True, exist_ok=True)
+        for n in range(files_per_dir // (len(SIDECARS) + 1)):
+            stem = f"model{folder:05d}_{n:03d}_v{n % 3}"
+            for ext in (".safetensors",) + SIDECARS:
+                (directory / f"{stem}{ext}").touch()
+                created += 1
+        folder += 1
+    (root / "VAE").mkdir(exist_ok=True)
+    (root / "VAE" / "ignored.safetensors").touch()
+    return created
+
+
+def add_latency(latency_ms: float) -> None:
+    """Simulates a network filesystem by delaying every directory listing."""
+    real_scandir = os.scandir
+
+    def slow_scandir(path="."):
+        time.sleep(latency_ms / 1000)
+        return real_scandir(path)
+
+    CLEANER.os.scandir = slow_scandir
+    CLEANER.os.walk.__globals__["scandir"] = slow_scandir
+
+
+def timed(label: str, func) -> set[str]:
+    """Runs one walker and returns its file set as strings (so earlier results do not slow the GC)."""
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<32} {elapsed:8.3f}s  {len(result):>8} files  {len(result) / elapsed:>12,.0f} files/s")
+    return {str(path) for path in result}
+
+
+def peak_memory(label: str, func) -> None:
+    """Runs one scan + grouping pipeline and prints the peak memory it allocated."""
+    tracemalloc.start()
+    groups = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<32} {peak / 2**20:8.1f} MB peak  {sum(map(len, groups.values())):>8} files grouped")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=100_000, help="Number of synthetic files (default: 100000)")
+    parser.add_argument("--files-per-dir", type=int, default=50, help="Files per leaf folder (default: 50)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[4, 16, 32], help="Worker counts to compare")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Artificial delay per directory listing")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary:
+        root = Path(temporary) / "models"
+        count = build_tree(root, args.files, args.files_per_dir)
+        print(f"Synthetic tree: {count} files in {root}")
+        if args.latency_ms:
+            add_latency(args.latency_ms)
+
+        expected = timed("os.walk (sequential)", lambda: CLEANER.get_files_recursively(root))
+        for workers in args.workers:
+            result = timed(f"scandir, {workers} workers", lambda: CLEANER.walk_tree(root, workers=workers))
+            if result != expected:
+                print(f"  MISMATCH with {workers} workers")
+                return 1
+
+        index = CLEANER.ScanIndex(Path(temporary) / "index.db")
+        timed("index, first run", lambda: CLEANER.walk_tree(root, index=index))
+        # Age the directories so their mtimes are outside the racy window
+        for directory, _, _ in os.walk(root):
+            os.utime(directory, ns=(0, 10**18))
+        timed("index, refresh", lambda: CLEANER.walk_tree(root, index=index))
+        result = timed("index, no change", lambda: CLEANER.walk_tree(root, index=index))
+        index.close()
+        if result != expected:
+            print("  MISMATCH with the scan index")
+            return 1
+
+        peak_memory("group Path list", lambda: CLEANER.group_files_by_stem(CLEANER.walk_tree(root)))
+        peak_memory("group streamed records", lambda: CLEANER.group_files_by_stem(CLEANER.iter_tree(root)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
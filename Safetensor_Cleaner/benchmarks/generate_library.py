@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""Build a synthetic model library (sparse models, sidecars, orphans, duplicates, version families)."""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import sys
+from pathlib import Path
+
+
+SIDECARS = (".preview.png", ".civitai.info", ".metadata.json", ".sha256", ".cm-info.json")
+CATEGORIES = ("Loras", "Checkpoints", "Embeddings", "ControlNet")
+DEFAULT_IGNORED_FOLDERS = (".git", "venv")
+
+
+def _touch(path: Path, size: int = 0) -> None:
+    """Creates a file of `size` bytes without writing them (sparse where the filesystem allows it)."""
+    with open(path, "wb") as f:
+        if size:
+            f.truncate(size)
+
+
+def model_name(n: int, family_size: int) -> str:
+    """Stem of the n-th model: family_size consecutive models are versions of one family."""
+    return f"model{n // family_size:06d}_v{n % family_size + 1}"
+
+
+def generate_library(
+    root: Path,
+    models: int = 1000,
+    sidecars: int = 3,
+    family_size: int = 3,
+    orphans: int = 50,
+    duplicates: int = 20,
+    misplaced: int = 20,
+    ignored_folders: tuple[str, ...] = DEFAULT_IGNORED_FOLDERS,
+    ignored_files: int = 10,
+    files_per_dir: int = 50,
+    model_size: int = 64 * 1024 * 1024,
+    seed: int = 0,
+) -> dict:
+    """
+    Creates the library under root and returns its manifest (counts of what was created).
+    - models are named model<family>_v<k> (see model_name), `family_size` versions per family, each with
+      its first `sidecars` sidecars (SIDECARS) in the same folder;
+    - orphans are a .preview.png + .civitai.info pair whose model is gone;
+    - duplicates are an extra copy of a model's first sidecar in another folder;
+    - misplaced sidecars (one of the SIDECARS the model did not get) live in another folder;
+    - every ignored folder holds `ignored_files` models that must never be reported.
+    Model files are sparse: `model_size` bytes are reported by stat() but not written.
+    """
+    if not 0 <= sidecars <= len(SIDECARS):
+        raise ValueError(f"sidecars must be between 0 and {len(SIDECARS)}")
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    per_model = 1 + sidecars
+    models_per_dir = max(1, files_per_dir // per_model)
+    folders: list[Path] = []
+
+    created_models = 0
+    for n in range(models):
+        if n % models_per_dir == 0:
+            category = CATEGORIES[len(folders) % len(CATEGORIES)]
+            folder = root / category / f"folder{len(folders):05d}"
+            folder.mkdir(parents=True, exist_ok=True)
+            folders.append(folder)
+        stem = model_name(n, family_size)
+        _touch(folder / f"{stem}.safetensors", model_size)
+        for ext in SIDECARS[:sidecars]:
+            _touch(folder / f"{stem}{ext}")
+        created_models += 1
+    if not folders:
+        folders.append(root)
+
+    def model_stem(n: int) -> tuple[Path, str]:
+        return folders[n // models_per_dir], model_name(n, family_size)
+
+    for n in range(orphans):
+        folder = rng.choice(folders)
+        for ext in (".preview.png", ".civitai.info"):
+            _touch(folder / f"deleted{n:06d}{ext}")
+
+    created_duplicates = 0
+    if sidecars and models and len(folders) > 1:
+        for n in rng.sample(range(models), min(duplicates, models)):
+            home, stem = model_stem(n)
+            other = rng.choice([f for f in folders if f != home])
+            _touch(other / f"{stem}{SIDECARS[0]}")
+            created_duplicates += 1
+
+    created_misplaced = 0
+    if sidecars < len(SIDECARS) and models and len(folders) > 1:
+        for n in rng.sample(range(models), min(misplaced, models)):
+            home, stem = model_stem(n)
+            other = rng.choice([f for f in folders if f != home])
+            _touch(other / f"{stem}{SIDECARS[sidecars]}")
+            created_misplaced += 1
+
+    for name in ignored_folders:
+        folder = root / name
+        folder.mkdir(exist_ok=True)
+        for n in range(ignored_files):
+            _touch(folder / f"ignored{n:04d}.safetensors")
+
+    files = (created_models * per_model + orphans * 2 + created_duplicates + created_misplaced
+             + len(ignored_folders) * ignored_files)
+    return {
+        "files": files,
+        "models": created_models,
+        "families": (created_models + family_size - 1) // family_size if family_size > 1 else 0,
+        "orphans": orphans,
+        "duplicates": created_duplicates,
+        "misplaced": created_misplaced,
+        "ignored_folders": list(ignored_folders),
+        "folders": len(folders),
+    }
+
+
+def models_for_files(total_files: int, sidecars: int = 3) -> int:
+    """Number of models giving about total_files files with the default orphan/duplicate ratios."""
+    # Orphans (2 files each) are 5% of the models, duplicates and misplaced sidecars 2% each
+    return max(1, round(total_files / (1 + sidecars + 0.1 + 0.04)))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("root", type=Path, help="Folder to create the library in")
+    parser.add_argument("--files", type=int, help="Approximate total number of files (sets --models and the ratios below)")
+    parser.add_argument("--models", type=int, default=1000, help="Number of models (default: 1000)")
+    parser.add_argument("--sidecars", type=int, default=3, help=f"Sidecars per model, 0-{len(SIDECARS)} (default: 3)")
+    parser.add_argument("--family-size", type=int, default=3, help="Versions per family, _v1.._vN (default: 3)")
+    parser.add_argument("--orphans", type=int, help="Orphan sidecar pairs (default: 5%% of the models)")
+    parser.add_argument("--duplicates", type=int, help="Scattered duplicate sidecars (default: 2%% of the models)")
+    parser.add_argument("--misplaced", type=int, help="Sidecars in the wrong folder (default: 2%% of the models)")
+    parser.add_argument("--ignored-folders", nargs="*", default=list(DEFAULT_IGNORED_FOLDERS), help="Folders the cleaner should skip")
+    parser.add_argument("--files-per-dir", type=int, default=50, help="Files per leaf folder (default: 50)")
+    parser.add_argument("--model-size", type=int, default=64 * 1024 * 1024, help="Apparent size of each (sparse) model in bytes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the placement of orphans and duplicates")
+    args = parser.parse_args()
+
+    models = models_for_files(args.files, args.sidecars) if args.files else args.models
+    manifest = generate_library(
+        args.root, models=models, sidecars=args.sidecars, family_size=args.family_size,
+        orphans=args.orphans if args.orphans is not None else models // 20,
+        duplicates=args.duplicates if args.duplicates is not None else models // 50,
+        misplaced=args.misplaced if args.misplaced is not None else models // 50,
+        ignored_folders=tuple(args.ignored_folders), files_per_dir=args.files_per_dir,
+        model_size=args.model_size, seed=args.seed,
+    )
+    json.dump(manifest, sys.stdout, indent=1)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
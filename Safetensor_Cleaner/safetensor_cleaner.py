@@ -2,18 +2,30 @@ import os
 import signal
 import json
 import argparse
+import contextlib
+import datetime
+import errno
+import hashlib
+import re
+import select
+import queue
+import sqlite3
+import struct
 import sys
+import threading
+import time
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 import shutil
 
 # Configuration
 MODEL_EXTENSIONS = {'.safetensors', '.pth', '.bin', '.ckpt', '.gguf', '.pt', '.sft'}
 # Designed to work with both Stability Matric and LoRA Manager for sidecar files
-SIDECAR_EXTENSIONS = {'.preview.jpg', '.preview.png', '.civitai.info', '.cm-info.json', '.metadata.json', '.preview.jpeg', '.json', '.sha256', '.info', '.png', '.jpg', '.jpeg', '.yaml', '.txt', '.xml', '.webp', '.mp4'}
+SIDECAR_EXTENSIONS = {'.preview.jpg', '.preview.png', '.civitai.info', '.cm-info.json', '.metadata.json', '.preview.jpeg', '.preview.webp', '.json', '.sha256', '.info', '.png', '.jpg', '.jpeg', '.yaml', '.txt', '.xml', '.webp', '.mp4'}
 
 # Pre-computed sorted list for matching longest extensions first
-ALL_EXTENSIONS = []
+ALL_EXTENSIONS = sorted(MODEL_EXTENSIONS | SIDECAR_EXTENSIONS, key=len, reverse=True)
 
 # The rest of the configuration is loaded from safetensor_cleaner.json
 # basic structure of safetensor_cleaner.json is:
@@ -42,85 +54,243 @@ class Colors:
     EXT_UNKNOWN = '\033[93m' # Yellow
     OK_ORPHAN = '\033[94m' # Blue
 
+# Built-in defaults, extended by safetensor_cleaner.json (see CleanerConfig)
 # Ignore this script and any .py files
-IGNORE_EXTENSIONS = set()
+IGNORE_EXTENSIONS = frozenset()
 # Ignore folders
-IGNORE_FOLDERS = set()
+IGNORE_FOLDERS = frozenset()
 # Ignore groups
-IGNORE_GROUPS = set()
+IGNORE_GROUPS = frozenset()
 # Ignore specific files
-IGNORE_FILES = {'safetensor_cleaner.py', 'safetensor_cleaner.json'}
+IGNORE_FILES = frozenset({'safetensor_cleaner.py', 'safetensor_cleaner.json', 'safetensor_cleaner.plan.json', 'safetensor_cleaner.db', 'safetensor_cleaner.db-journal', 'safetensor_cleaner.verify.jsonl'})
+# Undo journals are named per run (safetensor_cleaner.undo-<time>.jsonl), ignored by prefix
+UNDO_JOURNAL_PREFIX = 'safetensor_cleaner.undo-'
 
-def load_config():
-    """Loads configuration from safetensor_cleaner.json if it exists."""
-    config_path = Path(__file__).parent / 'safetensor_cleaner.json'
-    global ALL_EXTENSIONS
-    
-    if config_path.exists():
-        try:
-            with open(config_path, 'r') as f:
-                config = json.load(f)
-                
-            global IGNORE_EXTENSIONS, IGNORE_FOLDERS, IGNORE_GROUPS
-            
-            if 'ignore_extensions' in config:
-                IGNORE_EXTENSIONS.update(config['ignore_extensions'])
-            if 'ignore_folders' in config:
-                IGNORE_FOLDERS.update(config['ignore_folders'])
-            if 'ignore_groups' in config:
-                IGNORE_GROUPS.update(config['ignore_groups'])
-            if 'ignore_files' in config:
-                IGNORE_FILES.update(config['ignore_files'])
-                
-            print(f"{Colors.OKBLUE}Loaded configuration from {config_path.name}{Colors.ENDC}")
-        except Exception as e:
-            print(f"{Colors.FAIL}Error loading config: {e}{Colors.ENDC}")
+DEFAULT_CONFIG_PATH = Path(__file__).parent / 'safetensor_cleaner.json'
+
+# Persistent scan index (directory listings keyed by directory mtime)
+DEFAULT_INDEX_PATH = Path(__file__).parent / 'safetensor_cleaner.db'
+# Directories modified this close to the scan start are re-listed on the next run
+# (protects against coarse mtime granularity on network filesystems)
+RACY_MTIME_WINDOW_NS = 2_000_000_000
+
+# Parallel walk: directory listings read ahead of the consumer per listing thread, and
+# record batches buffered per root when several roots are walked at once
+LISTINGS_PER_WORKER = 64
+ROOT_BATCH_SIZE = 1024
+ROOT_QUEUE_BATCHES = 16
+# File names whose classification is kept (the cache is emptied when full)
+CLASSIFY_CACHE_SIZE = 50_000
+
+# Content hashing (duplicate models)
+HASH_CHUNK_SIZE = 8 * 1024 * 1024      # streaming read size for full SHA-256
+PARTIAL_HASH_BLOCK = 1024 * 1024       # head and tail block size for the partial hash
+SHA256_PATTERN = re.compile(r'\b([0-9a-fA-F]{64})\b')
+HASH_SIDECAR_EXTENSIONS = ('.sha256', '.civitai.info')
+
+# Apply engine: plan file format version and journal flush interval
+PLAN_VERSION = 1
+APPLY_BATCH_SIZE = 500
+DEFAULT_COPY_WORKERS = 4
+
+# Watch mode: seconds without events before a group is analyzed, polling fallback interval
+DEFAULT_WATCH_DEBOUNCE = 10.0
+DEFAULT_POLL_INTERVAL = 30.0
+# Temporary names of models being downloaded ('x.safetensors.part'): they hold their stem
+DOWNLOAD_SUFFIXES = ('.part', '.partial', '.tmp', '.crdownload', '.download', '.aria2')
+
+# Machine-readable reports (--format json / ndjson)
+REPORT_SCHEMA_VERSION = 1
+
+# Verify mode: progress journal, removed once a run completes
+DEFAULT_VERIFY_JOURNAL = Path(__file__).parent / 'safetensor_cleaner.verify.jsonl'
+
+# Sidecar repair (--fill-sidecars): previews larger than PREVIEW_SIZE pixels are downscaled to .preview.webp
+PREVIEW_SOURCE_EXTENSIONS = ('.preview.png', '.preview.jpg', '.preview.jpeg', '.png', '.jpg', '.jpeg')
+PREVIEW_SIZE = 512
+PREVIEW_QUALITY = 85
+DEFAULT_PREVIEW_WORKERS = 4
+
+# Safetensors header inspection
+SAFETENSORS_EXTENSIONS = ('.safetensors', '.sft')
+MAX_HEADER_SIZE = 100 * 1024 * 1024    # larger length prefixes are treated as corrupt
+# (substring of a tensor name, architecture) - first match wins
+ARCHITECTURE_KEYS = [
+    ('double_blocks.', 'Flux'), ('double_blocks_', 'Flux'), ('single_transformer_blocks', 'Flux'),
+    ('joint_blocks', 'SD3'),
+    ('conditioner.embedders.1', 'SDXL'), ('lora_te2_', 'SDXL'), ('add_embedding.linear', 'SDXL'),
+    ('cond_stage_model.model.', 'SD2'),
+    ('cond_stage_model.transformer', 'SD1'), ('lora_te_text_model', 'SD1'), ('lora_unet_down_blocks', 'SD1'),
+]
+# (substring of the base model metadata, architecture)
+ARCHITECTURE_METADATA = [
+    ('flux', 'Flux'), ('sd3', 'SD3'), ('stable-diffusion-v3', 'SD3'),
+    ('sdxl', 'SDXL'), ('stable-diffusion-xl', 'SDXL'), ('pony', 'SDXL'), ('illustrious', 'SDXL'),
+    ('sd_v2', 'SD2'), ('stable-diffusion-v2', 'SD2'), ('sd_v1', 'SD1'), ('stable-diffusion-v1', 'SD1'),
+]
+
+class CleanerConfig:
+    """
+    Extension sets and ignore lists used to scan and group a model library.
+    The ignore lists extend the built-in IGNORE_* defaults; the classifier is built on first use.
+    """
+
+    def __init__(self, ignore_extensions=(), ignore_folders=(), ignore_groups=(), ignore_files=(),
+                 model_extensions=MODEL_EXTENSIONS, sidecar_extensions=SIDECAR_EXTENSIONS):
+        self.ignore_extensions = frozenset(IGNORE_EXTENSIONS | set(ignore_extensions))
+        self.ignore_folders = frozenset(IGNORE_FOLDERS | set(ignore_folders))
+        self.ignore_groups = frozenset(IGNORE_GROUPS | set(ignore_groups))
+        self.ignore_files = frozenset(IGNORE_FILES | set(ignore_files))
+        self.model_extensions = frozenset(model_extensions)
+        self.sidecar_extensions = frozenset(sidecar_extensions)
+        self.source = None      # file the configuration was read from
+        self.load_error = None  # why that file could not be read, defaults are used then
+        self._classifier = None
+
+    @classmethod
+    def from_file(cls, config_path):
+        """Reads a safetensor_cleaner.json file; raises OSError or ValueError."""
+        with open(config_path, 'r') as f:
+            data = json.load(f)
+        config = cls(
+            ignore_extensions=data.get('ignore_extensions', ()),
+            ignore_folders=data.get('ignore_folders', ()),
+            ignore_groups=data.get('ignore_groups', ()),
+            ignore_files=data.get('ignore_files', ()),
+        )
+        config.source = Path(config_path)
+        return config
+
+    @property
+    def classifier(self):
+        if self._classifier is None:
+            self._classifier = ExtensionClassifier(self.model_extensions, self.sidecar_extensions, self.ignore_extensions, self.ignore_files)
+        return self._classifier
+
+
+def load_config(config_path=DEFAULT_CONFIG_PATH):
+    """
+    Loads configuration from safetensor_cleaner.json if it exists.
+    Never raises: on error the defaults are returned with load_error set.
+    """
+    config_path = Path(config_path)
+    if not config_path.exists():
+        return CleanerConfig()
+    try:
+        return CleanerConfig.from_file(config_path)
+    except Exception as e:
+        config = CleanerConfig()
+        config.load_error = f"{config_path.name}: {e}"
+        return config
 
-    # Initialize ALL_EXTENSIONS after config might have modified things (though currently it doesn't modify the sets)
-    ALL_EXTENSIONS[:] = sorted(list(MODEL_EXTENSIONS | SIDECAR_EXTENSIONS), key=len, reverse=True)
 
-# Load config immediately
-load_config()
+_default_config = None
 
-def get_file_stem(filename):
+def get_config(config=None):
+    """Returns config, or the default configuration (loaded on first use)."""
+    global _default_config
+    if config is not None:
+        return config
+    if _default_config is None:
+        _default_config = load_config()
+    return _default_config
+
+
+def set_default_config(config):
+    """Replaces the configuration used when functions are called without one."""
+    global _default_config
+    _default_config = config
+
+
+# Result of ExtensionClassifier.classify():
+#   stem: base name without the longest known extension (None if no known extension)
+#   ext: the matched extension (None if no known extension)
+#   ftype: 'model', 'sidecar' or 'other'
+#   ignored: True if the file name or its extension is in the ignore lists
+FileClass = namedtuple('FileClass', ['stem', 'ext', 'ftype', 'ignored'])
+
+
+class ExtensionClassifier:
+    """
+    Classifies file names against the model, sidecar and ignore extension sets in one pass.
+    Every known extension starts with a '.', so the candidates of a name are its dotted
+    suffixes ('a.preview.png' -> '.preview.png', '.png'): walking them from the left finds
+    the longest known extension with one dict lookup per dot. Results are cached per name
+    (up to CLASSIFY_CACHE_SIZE names).
+    """
+
+    def __init__(self, model_extensions, sidecar_extensions, ignore_extensions=(), ignore_files=()):
+        self.suffixes = {}  # dotted suffix -> set of kinds ('model', 'sidecar', 'ignore')
+        for kind, extensions in (('model', model_extensions), ('sidecar', sidecar_extensions)):
+            for ext in extensions:
+                self.suffixes.setdefault(ext, set()).add(kind)
+        # Ignore patterns from the config do not have to start with a '.'; keep those for endswith()
+        undotted = []
+        for ext in ignore_extensions:
+            if ext.startswith('.'):
+                self.suffixes.setdefault(ext, set()).add('ignore')
+            else:
+                undotted.append(ext)
+        self.undotted_ignores = tuple(undotted)
+        self.ignore_files = frozenset(ignore_files)
+        self.cache = {}
+
+    def classify(self, filename):
+        """Returns the FileClass of a file name."""
+        result = self.cache.get(filename)
+        if result is not None:
+            return result
+
+        stem = ext = None
+        is_model = is_sidecar = False
+        ignored = (filename in self.ignore_files or filename.startswith(UNDO_JOURNAL_PREFIX)
+                   or (bool(self.undotted_ignores) and filename.endswith(self.undotted_ignores)))
+        suffixes = self.suffixes
+        dot = filename.find('.')
+        while dot != -1:
+            kinds = suffixes.get(filename[dot:])
+            if kinds:
+                if 'ignore' in kinds:
+                    ignored = True
+                if ext is None and ('model' in kinds or 'sidecar' in kinds):
+                    stem, ext = filename[:dot], filename[dot:]
+                is_model = is_model or 'model' in kinds
+                is_sidecar = is_sidecar or 'sidecar' in kinds
+            dot = filename.find('.', dot + 1)
+
+        ftype = 'model' if is_model else 'sidecar' if is_sidecar else 'other'
+        result = FileClass(stem, ext, ftype, ignored)
+        if len(self.cache) >= CLASSIFY_CACHE_SIZE:
+            # Bounded memory on huge libraries: most names are only classified a few times in a row
+            self.cache.clear()
+        self.cache[filename] = result
+        return result
+
+
+def get_file_stem(filename, config=None):
     """Returns the base name (stem) by stripping the longest known extension."""
-    for ext in ALL_EXTENSIONS:
-        if filename.endswith(ext):
-            return filename[:-len(ext)], ext
-    return None, None
+    result = get_config(config).classifier.classify(filename)
+    return result.stem, result.ext
 
-def get_file_type(filename):
+def get_file_type(filename, config=None):
     """Returns 'model', 'sidecar', or 'other'."""
-    for ext in MODEL_EXTENSIONS:
-        if filename.endswith(ext):
-            return 'model'
-    for ext in SIDECAR_EXTENSIONS:
-        if filename.endswith(ext):
-            return 'sidecar'
-    return 'other'
+    return get_config(config).classifier.classify(filename).ftype
 
 
 
-def group_files_by_stem(file_list):
+def group_files_by_stem(file_list, config=None):
     """Groups files by their base name (stem) by stripping known extensions."""
+    config = get_config(config)
     groups = defaultdict(list)
 
+    classify = config.classifier.classify
     for file_path in file_list:
-        # Check for ignored files
-        if file_path.name in IGNORE_FILES:
-            continue
-            
-        # Check for ignored extensions
-        should_skip = False
-        for ext in IGNORE_EXTENSIONS:
-            if file_path.name.endswith(ext):
-                should_skip = True
-                break
-        if should_skip:
+        # Ignored files and extensions, and the base name, come from a single lookup
+        result = classify(file_path.name)
+        if result.ignored:
             continue
 
-        # Try to strip all extensions to find the base name
-        base_name, _ = get_file_stem(file_path.name)
+        base_name = result.stem
         
         if base_name:
             groups[base_name].append(file_path)
@@ -128,137 +298,1814 @@ def group_files_by_stem(file_list):
             groups['unknown'].append(file_path)
 
     # Remove ignored groups
-    for ignored in IGNORE_GROUPS:
+    for ignored in config.ignore_groups:
         if ignored in groups:
             del groups[ignored]
 
     return groups
 
-def detect_versions(groups):
+class _VersionNode:
+    """Node of the '_'-token trie used by detect_versions (one node per candidate base)."""
+    __slots__ = ('base', 'parent', 'children', 'count', 'has_model', 'best_descendant', 'stems')
+
+    def __init__(self, base, parent):
+        self.base = base
+        self.parent = parent
+        self.children = {}
+        self.count = 0              # number of stems having this base as a '_'-prefix
+        self.has_model = False      # one of those stems has a model file
+        self.best_descendant = 0    # largest count of a kept descendant base
+        self.stems = None
+
+
+def detect_versions(groups, config=None):
     """
     Decomposes group stems by '_' to find common bases (versions of same model).
     Returns a dict: base_name -> list of original_stems
     Only includes bases that match multiple stems where at least one stem has a model.
+
+    Stems are inserted in a trie of '_'-separated tokens; each node is a candidate base and
+    counts the stems below it. The stems of a descendant base are a subset of its ancestor's,
+    so two bases on one path have the same stem set exactly when their counts are equal:
+    redundant shorter bases are found in one bottom-up pass, without comparing sets.
+    """
+    config = get_config(config)
+    root = _VersionNode(None, None)
+    nodes = []   # creation order, parents always before their children
+    leaves = []  # (stem, node of the full stem)
+
+    for stem, files in groups.items():
+        if stem == 'unknown': continue
+
+        has_model = any(get_file_type(f.name, config) == 'model' for f in files)
+        node = root
+        # Generate candidates: "A_B_C" -> "A", "A_B", "A_B_C"
+        for part in stem.split('_'):
+            child = node.children.get(part)
+            if child is None:
+                base = part if node is root else node.base + '_' + part
+                child = node.children[part] = _VersionNode(base, node)
+                nodes.append(child)
+            child.count += 1
+            child.has_model = child.has_model or has_model
+            node = child
+        leaves.append((stem, node))
+
+    # Filter useful versions
+    # Rule 1: Must have > 1 variant for this base
+    # Rule 2: At least one of the variants must actually contain a model file. 
+    #         (Otherwise we just grouping random orphan sidecars)
+    def is_candidate(node):
+        return node.count > 1 and node.has_model and node.base not in config.ignore_groups
+
+    # Filter redundant bases (e.g. 'Urd' if 'Urd_from' has exact same stems)
+    # Children are visited before their parent
+    for node in reversed(nodes):
+        parent = node.parent
+        if parent is root:
+            continue
+        best = node.count if is_candidate(node) else node.best_descendant
+        if best > parent.best_descendant:
+            parent.best_descendant = best
+
+    kept = [node for node in nodes if is_candidate(node) and node.best_descendant != node.count]
+    for node in kept:
+        node.stems = []
+    for stem, node in leaves:
+        while node is not root:
+            if node.stems is not None:
+                node.stems.append(stem)
+            node = node.parent
+
+    return {node.base: sorted(node.stems) for node in kept}
+
+class FamilyIndex:
+    """
+    Prefix index over version family bases.
+    Only the distinct base lengths are probed, so finding every base that prefixes a stem costs
+    one dict lookup per distinct length instead of a startswith() per base.
+    """
+
+    def __init__(self, bases):
+        self.bases = set(bases)
+        self.lengths = sorted({len(base) for base in self.bases}, reverse=True)
+
+    def matches(self, stem):
+        """Returns every base that is a prefix of stem, longest first."""
+        bases = self.bases
+        return [stem[:n] for n in self.lengths if n <= len(stem) and stem[:n] in bases]
+
+    def longest(self, stem):
+        """Returns the longest base that is a prefix of stem, or None."""
+        bases = self.bases
+        for n in self.lengths:
+            if n <= len(stem) and stem[:n] in bases:
+                return stem[:n]
+        return None
+
+
+def check_orphans_against_versions(groups, version_map, all_candidates=False, config=None):
+    """
+    Checks if orphan groups might belong to a detected version family.
+    Returns orphan_stem -> longest matching base, or with all_candidates,
+    orphan_stem -> list of matching bases ranked by match length (longest first).
     """
-    version_map = defaultdict(list)
+    potential_matches = {} # orphan_stem -> matched_base(s)
     
-    # helper: check if a group has a model file
-    def group_has_model(stem):
-        files = groups.get(stem, [])
-        for f in files:
-            if get_file_type(f.name) == 'model':
+    # Identify orphan groups
+    orphan_groups = []
+    for stem, files in groups.items():
+        if stem == 'unknown': continue
+        
+        has_model = any(get_file_type(f.name, config) == 'model' for f in files)
+        if not has_model:
+            orphan_groups.append(stem)
+            
+    # Check each orphan
+    # An orphan that IS a base (e.g. Model.json vs Model_v1.safetensors) is its own longest match
+    index = FamilyIndex(version_map)
+    for orphan in orphan_groups:
+        if all_candidates:
+            bases = index.matches(orphan)
+            if bases:
+                potential_matches[orphan] = bases
+        else:
+            base = index.longest(orphan)
+            if base is not None:
+                potential_matches[orphan] = base
+                
+    return potential_matches
+
+def highlight_extension(filename, config=None):
+    """Returns the filename with the extension colorized."""
+    base, ext, ftype, _ = get_config(config).classifier.classify(filename)
+    if base and ext:
+        if ftype == 'model':
+            color = Colors.EXT_MODEL
+        elif ftype == 'sidecar':
+            color = Colors.EXT_SIDECAR
+        else:
+            color = Colors.EXT_UNKNOWN # Should not happen if get_file_stem worked with ALL_EXTENSIONS
+            
+        return f"{base}{color}{ext}{Colors.ENDC}"
+    return filename
+
+class ScanIndex:
+    """
+    SQLite cache of directory listings.
+    Each directory row stores its mtime, its sub-directories and its files; a directory whose
+    mtime did not change since the last run is not listed again. File sizes are not cached:
+    rewriting a file does not change its directory's mtime.
+    """
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        # Shared by the walker, hashing and header threads: every use of conn holds self.lock
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        # Several roots are walked at once, each loading and saving its listings
+        self.lock = threading.Lock()
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS dirs")
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " subdirs TEXT NOT NULL,"
+            " files TEXT NOT NULL)"
+        )
+        # Content hashes, valid as long as the file keeps its inode, size and mtime
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " dev INTEGER NOT NULL,"
+            " ino INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " partial TEXT,"
+            " sha256 TEXT,"
+            " PRIMARY KEY (dev, ino))"
+        )
+        # Safetensors header summaries (JSON), same validity rule as the hashes
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS headers ("
+            " dev INTEGER NOT NULL,"
+            " ino INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " info TEXT NOT NULL,"
+            " PRIMARY KEY (dev, ino))"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def _range(root):
+        """Returns the (lower, upper) key bounds of the directories below root."""
+        root = str(root).rstrip(os.sep)
+        return root + os.sep, root + chr(ord(os.sep) + 1)
+
+    def load(self, root):
+        """Returns {dir_path: (mtime_ns, subdirs, files)} for root and everything below it."""
+        lower, upper = self._range(root)
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, mtime_ns, subdirs, files FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                (str(root), lower, upper),
+            ).fetchall()
+        return {
+            path: (mtime_ns, _split_names(subdirs), _split_names(files))
+            for path, mtime_ns, subdirs, files in rows
+        }
+
+    def save(self, root, changed, seen):
+        """Stores re-listed directories and drops the rows of directories that are gone."""
+        lower, upper = self._range(root)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs, files) VALUES (?, ?, ?, ?)",
+                [(path, mtime_ns, '\0'.join(subdirs), '\0'.join(files))
+                 for path, (mtime_ns, subdirs, files) in changed.items()],
+            )
+            stale = [
+                (path,) for (path,) in self.conn.execute(
+                    "SELECT path FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                    (str(root), lower, upper),
+                )
+                if path not in seen
+            ]
+            self.conn.executemany("DELETE FROM dirs WHERE path = ?", stale)
+
+    def get_hashes(self, st):
+        """Returns the cached (partial, sha256) of a file from its os.stat() result, or (None, None)."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT partial, sha256 FROM hashes WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        return row if row else (None, None)
+
+    def put_hashes(self, st, partial=None, sha256=None):
+        """Caches the partial and/or full hash of a file, keeping the values already known."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO hashes (dev, ino, size, mtime_ns, partial, sha256) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (dev, ino) DO UPDATE SET"
+                "  partial = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns"
+                "            THEN COALESCE(excluded.partial, partial) ELSE excluded.partial END,"
+                "  sha256 = CASE WHEN size = excluded.size AND mtime_ns = excluded.mtime_ns"
+                "           THEN COALESCE(excluded.sha256, sha256) ELSE excluded.sha256 END,"
+                "  size = excluded.size, mtime_ns = excluded.mtime_ns",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, partial, sha256),
+            )
+
+    def get_header(self, st):
+        """Returns the cached header summary of a file from its os.stat() result, or None."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT info FROM headers WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_header(self, st, info):
+        """Caches the header summary of a file."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO headers (dev, ino, size, mtime_ns, info) VALUES (?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, json.dumps(info)),
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def _split_names(joined):
+    """Splits a NUL-joined name list as stored in the scan index."""
+    return joined.split('\0') if joined else []
+
+
+class FileRecord:
+    """
+    Compact stand-in for the Path of a scanned file: the directory Path is shared by every
+    file of the directory, so a record costs one small object plus its name.
+    Offers what the cleaner uses of a Path (name, parent, suffix, os.fspath/str, ordering and
+    equality between records); .path builds the real Path when an action needs it.
+    """
+    __slots__ = ('parent', 'name', 'size')
+
+    def __init__(self, parent, name, size=None):
+        self.parent = parent
+        self.name = name
+        self.size = size  # bytes, when the walk collected sizes
+
+    @property
+    def path(self):
+        return self.parent / self.name
+
+    @property
+    def suffix(self):
+        dot = self.name.rfind('.')
+        return self.name[dot:] if 0 < dot < len(self.name) - 1 else ''
+
+    def __fspath__(self):
+        return os.path.join(str(self.parent), self.name)
+
+    __str__ = __fspath__
+
+    def __repr__(self):
+        return f"FileRecord({os.fspath(self)!r})"
+
+    def __eq__(self, other):
+        if not isinstance(other, FileRecord):
+            return NotImplemented
+        return self.name == other.name and self.parent == other.parent
+
+    def __hash__(self):
+        return hash((self.parent, self.name))
+
+    def __lt__(self, other):
+        return (self.parent, self.name) < (other.parent, other.name)
+
+
+def list_directory(dir_path, sizes=None):
+    """
+    Lists a directory with os.scandir.
+    Returns (subdirs, files) where subdirs only holds real (non symlinked) directories,
+    mirroring what os.walk descends into.
+    With a `sizes` list, the size of each file is appended to it, from the entry's stat()
+    (free on Windows, one stat per file elsewhere; unreadable files count as 0 bytes).
+    """
+    subdirs = []
+    files = []
+    with os.scandir(dir_path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+            else:
+                files.append(entry.name)
+                if sizes is not None:
+                    try:
+                        sizes.append(entry.stat().st_size)
+                    except OSError:
+                        sizes.append(0)
+    return subdirs, files
+
+
+def _file_sizes(dir_path, files):
+    """Sizes of the files of a cached listing, stat'ed now (unreadable or vanished files count as 0 bytes)."""
+    sizes = []
+    for name in files:
+        try:
+            sizes.append(os.stat(os.path.join(dir_path, name)).st_size)
+        except OSError:
+            sizes.append(0)
+    return sizes
+
+
+def _read_directory(dir_path, cached, scan_started_ns, use_mtime, with_sizes=False, errors=None):
+    """
+    Returns (subdirs, files, sizes, changed) for one directory, or None if it cannot be read
+    (a stat or listing error is appended to `errors` as (dir_path, message)).
+    The listing comes from the cached index entry when the directory mtime still matches;
+    otherwise the directory is listed and `changed` holds the entry to store in the index.
+    sizes is None unless with_sizes, and always comes from this scan's stat results.
+    """
+    mtime_ns = 0
+    if use_mtime:
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError as e:
+            if errors is not None:
+                errors.append((dir_path, str(e)))
+            return None
+        entry = cached.get(dir_path)
+        if entry is not None and entry[0] == mtime_ns:
+            return entry[1], entry[2], _file_sizes(dir_path, entry[2]) if with_sizes else None, None
+    sizes = [] if with_sizes else None
+    try:
+        subdirs, files = list_directory(dir_path, sizes)
+    except OSError as e:
+        if errors is not None:
+            errors.append((dir_path, str(e)))
+        return None
+    stored_mtime = 0 if mtime_ns >= scan_started_ns - RACY_MTIME_WINDOW_NS else mtime_ns
+    return subdirs, files, sizes, (stored_mtime, subdirs, files)
+
+
+def _walk_children(dir_path, subdirs, ignore_folders):
+    """Returns the sub-directories of dir_path that must be walked."""
+    return [os.path.join(dir_path, d) for d in subdirs if d not in ignore_folders]
+
+
+def iter_tree(root_dir, index=None, rescan=False, workers=1, config=None, stats=None, with_sizes=False):
+    """
+    Walks root_dir with os.scandir, optionally through the scan index and optionally
+    fanning the directory listings out over a thread pool of `workers` threads.
+    Yields a FileRecord per file, in the same pre-order whatever the number of workers
+    (with its size when with_sizes); each directory's records are yielded as soon as its
+    listing and those of the directories before it are done. At most about
+    workers * LISTINGS_PER_WORKER listings are read ahead of the consumer.
+    The index is updated and `stats` receives the number of directories walked and re-listed,
+    and the (dir_path, message) of the directories that could not be listed, once the
+    generator is exhausted.
+    """
+    ignore_folders = get_config(config).ignore_folders
+    use_index = index is not None
+    cached = index.load(root_dir) if use_index and not rescan else {}
+    scan_started_ns = time.time_ns()
+    seen = set()
+    changed = {}
+    errors = []
+
+    def read(dir_path):
+        return _read_directory(dir_path, cached, scan_started_ns, use_index, with_sizes, errors)
+
+    def records(dir_path, result):
+        subdirs, files, file_sizes, entry = result
+        seen.add(dir_path)
+        if entry is not None and use_index:
+            changed[dir_path] = entry
+        parent = Path(dir_path)  # one Path per directory, shared by its records
+        if file_sizes is None:
+            for name in files:
+                yield FileRecord(parent, name)
+        else:
+            for name, size in zip(files, file_sizes):
+                yield FileRecord(parent, name, size)
+
+    # Pre-order: the next directory to emit is on top of the stack; sub-directories are
+    # pushed in reverse so they are visited in listing order
+    root = str(root_dir)
+    stack = [root]
+    if workers <= 1:
+        while stack:
+            dir_path = stack.pop()
+            result = read(dir_path)
+            if result is None:
+                continue
+            yield from records(dir_path, result)
+            stack.extend(reversed(_walk_children(dir_path, result[0], ignore_folders)))
+    else:
+        read_ahead = workers * LISTINGS_PER_WORKER
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}             # dir_path -> listing submitted but not emitted yet
+            discovered = deque()     # directories to submit, in discovery order
+            done = set()             # directories already taken off the stack
+            while stack:
+                while discovered and len(futures) < read_ahead:
+                    dir_path = discovered.popleft()
+                    if dir_path not in futures and dir_path not in done:
+                        futures[dir_path] = pool.submit(read, dir_path)
+                dir_path = stack.pop()
+                done.add(dir_path)
+                # The next directory in order is always read, even when the read-ahead is full
+                future = futures.pop(dir_path, None) or pool.submit(read, dir_path)
+                result = future.result()
+                if result is None:
+                    continue
+                children = _walk_children(dir_path, result[0], ignore_folders)
+                discovered.extend(children)
+                yield from records(dir_path, result)
+                stack.extend(reversed(children))
+    del cached
+
+    if use_index:
+        index.save(root_dir, changed, seen)
+    if stats is not None:
+        stats.update(directories=len(seen), relisted=len(changed), errors=errors)
+
+
+def walk_tree(root_dir, index=None, rescan=False, workers=1, config=None, stats=None, sizes=None):
+    """
+    Returns the files found by iter_tree() as a list of Path objects.
+    `sizes`, when given, is filled with {path: size in bytes} during the same walk.
+    """
+    file_list = []
+    for file in iter_tree(root_dir, index=index, rescan=rescan, workers=workers, config=config,
+                          stats=stats, with_sizes=sizes is not None):
+        path = file.path
+        file_list.append(path)
+        if sizes is not None:
+            sizes[path] = file.size
+    return file_list
+
+
+def as_root_list(roots):
+    """
+    Returns roots (one path or several) as a list of resolved Paths, in the given order,
+    without repeated roots or roots nested inside another one (their files would be seen twice).
+    """
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    paths = [Path(root).resolve() for root in roots]
+    result = []
+    for path in paths:
+        if path not in result and not any(other in path.parents for other in paths):
+            result.append(path)
+    return result
+
+
+def _walk_root(batches, stop, walk_args):
+    """Thread body of iter_roots(): puts the records of one root on its queue in batches, then None."""
+
+    def put(item):
+        # Gives up once the consumer has stopped reading (stop is set)
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
                 return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        batch = []
+        for record in iter_tree(*walk_args):
+            batch.append(record)
+            if len(batch) >= ROOT_BATCH_SIZE:
+                if not put(batch):
+                    return
+                batch = []
+        if batch and not put(batch):
+            return
+        put(None)
+    except BaseException as e:
+        put(e)
+
+
+def iter_roots(roots, index=None, rescan=False, workers=1, config=None, stats=None, with_sizes=False):
+    """
+    Walks several roots with iter_tree(), concurrently: one thread per root, each listing its
+    directories with its own `workers` threads (a slow NAS does not hold back a local SSD).
+    Yields the FileRecords of every root, in root order, as they are found: each root feeds
+    a bounded queue (ROOT_QUEUE_BATCHES batches of ROOT_BATCH_SIZE records), so a root
+    further down the list reads ahead that far and then waits for the consumer.
+    stats are summed (error lists joined).
+    """
+    roots = as_root_list(roots)
+    if len(roots) == 1:
+        yield from iter_tree(roots[0], index=index, rescan=rescan, workers=workers, config=config,
+                             stats=stats, with_sizes=with_sizes)
+        return
+    per_root = [{} for _ in roots]
+    queues = [queue.Queue(maxsize=ROOT_QUEUE_BATCHES) for _ in roots]
+    stop = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(roots)) as pool:
+        for root, root_stats, batches in zip(roots, per_root, queues):
+            pool.submit(_walk_root, batches, stop, (root, index, rescan, workers, config, root_stats, with_sizes))
+        try:
+            for batches in queues:
+                while True:
+                    batch = batches.get()
+                    if batch is None:
+                        break
+                    if isinstance(batch, BaseException):
+                        raise batch
+                    yield from batch
+        finally:
+            # Lets the other walks end if the consumer stops early or a walk failed
+            stop.set()
+    if stats is not None:
+        for root_stats in per_root:
+            for key, value in root_stats.items():
+                stats[key] = stats[key] + value if key in stats else value
+
+
+def walk_roots(roots, index=None, rescan=False, workers=1, config=None, stats=None):
+    """Returns the files found by iter_roots() as a list of Path objects."""
+    return [file.path for file in iter_roots(roots, index=index, rescan=rescan, workers=workers, config=config, stats=stats)]
+
+
+def get_files_recursively(root_dir, index=None, rescan=False, workers=1, config=None):
+    """Scans the directory recursively and returns a list of Path objects."""
+    file_list = []
+    print(f"Scanning {root_dir}...")
+    if index is not None or workers > 1:
+        stats = {}
+        try:
+            file_list = walk_tree(root_dir, index=index, rescan=rescan, workers=workers, config=config, stats=stats)
+        except sqlite3.Error as e:
+            print(f"{Colors.WARNING}Scan index unavailable ({e}), falling back to a full scan.{Colors.ENDC}")
+            return walk_tree(root_dir, workers=workers, config=config)
+        for dir_path, error in stats['errors']:
+            print(f"Error scanning directory {dir_path}: {error}")
+        if index is not None:
+            print(f"Index: {stats['directories']} directories, {stats['relisted']} re-listed.")
+        return file_list
+    ignore_folders = get_config(config).ignore_folders
+    try:
+        for root, dirs, files in os.walk(root_dir):
+            # Modify dirs in-place to skip ignored directories
+            dirs[:] = [d for d in dirs if d not in ignore_folders]
+            
+            for file in files:
+                file_list.append(Path(root) / file)
+    except Exception as e:
+        print(f"Error scanning directory: {e}")
+    return file_list
+
+
+def file_sha256(path, chunk_size=HASH_CHUNK_SIZE):
+    """Streams a file through SHA-256 with large unbuffered reads and returns the hex digest."""
+    digest = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def partial_hash(path, size, block=PARTIAL_HASH_BLOCK):
+    """Hashes the first and last blocks of a file (the whole file when it is small)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if size <= 2 * block:
+            digest.update(f.read())
+        else:
+            digest.update(f.read(block))
+            f.seek(size - block)
+            digest.update(f.read(block))
+    return digest.hexdigest()
+
+
+def read_sha256_sidecar(path):
+    """Returns the lowercase SHA-256 recorded in a .sha256 sidecar, or None."""
+    try:
+        with open(path, 'r', errors='replace') as f:
+            match = SHA256_PATTERN.search(f.read(4096))
+    except OSError:
+        return None
+    return match.group(1).lower() if match else None
+
+
+def read_civitai_info_hash(path, model_name):
+    """
+    Returns the lowercase SHA-256 recorded for model_name in a .civitai.info sidecar, or None.
+    The file entry with the same name is preferred, then the primary file, then a lone file.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    files = [entry for entry in info.get('files', []) if isinstance(entry, dict)] if isinstance(info, dict) else []
+    chosen = next((e for e in files if e.get('name') == model_name), None)
+    if chosen is None:
+        chosen = next((e for e in files if e.get('primary')), None)
+    if chosen is None and len(files) == 1:
+        chosen = files[0]
+    sha = ((chosen or {}).get('hashes') or {}).get('SHA256')
+    return sha.lower() if isinstance(sha, str) and SHA256_PATTERN.fullmatch(sha) else None
+
+
+def read_sidecar_hash(sidecar, model_name):
+    """Returns the SHA-256 recorded in a hash sidecar (.sha256 or .civitai.info), or None."""
+    if sidecar.name.endswith('.civitai.info'):
+        return read_civitai_info_hash(sidecar, model_name)
+    return read_sha256_sidecar(sidecar)
+
+
+def sidecar_hash_paths(groups, extensions=HASH_SIDECAR_EXTENSIONS, config=None):
+    """
+    Returns {model_path: [sidecar_path, ...]} for models with '<stem><ext>' hash sidecars next
+    to them, in the order of extensions. Nothing is read here.
+    Folders holding several models of the same stem are skipped (the sidecar would be ambiguous).
+    """
+    pairs = {}
+    for stem, files in groups.items():
+        if stem == 'unknown': continue
+        models, sidecars, _ = categorize_group(files, config)
+        hash_files = defaultdict(list)
+        for ext in extensions:
+            for s in sidecars:
+                if s.name == stem + ext:
+                    hash_files[s.parent].append(s)
+        if not hash_files:
+            continue
+        models_per_dir = defaultdict(list)
+        for m in models:
+            models_per_dir[m.parent].append(m)
+        for parent, dir_models in models_per_dir.items():
+            if len(dir_models) == 1 and parent in hash_files:
+                pairs[dir_models[0]] = hash_files[parent]
+    return pairs
+
+
+def find_duplicate_models(groups, index=None, use_sidecars=True, progress=None, errors=None, config=None):
+    """
+    Finds model files with identical content, narrowing candidates step by step:
+    1. same size, 2. same partial hash (head and tail blocks), 3. same full SHA-256.
+    Hashes are reused from the scan index cache and from hash sidecars when available;
+    hard links to the same inode are counted once.
+    Returns a list of (sha256, size, [paths]) sorted by wasted bytes (largest first); files that
+    cannot be read are left out and appended to `errors` as (path, message).
+    """
+    sidecars = sidecar_hash_paths(groups, config=config) if use_sidecars else {}
+
+    by_size = defaultdict(list)
+    seen_inodes = set()
+    for files in groups.values():
+        for f in files:
+            if get_file_type(f.name, config) != 'model':
+                continue
+            try:
+                st = os.stat(f)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in seen_inodes:
+                continue
+            seen_inodes.add((st.st_dev, st.st_ino))
+            by_size[st.st_size].append((f, st))
+
+    duplicates = []
+    for size, candidates in by_size.items():
+        if len(candidates) < 2 or size == 0:
+            continue
+
+        full = {}       # path -> sha256
+        unknown = []    # (path, st, partial)
+        for f, st in candidates:
+            cached_partial, cached_sha = index.get_hashes(st) if index is not None else (None, None)
+            sha = cached_sha
+            for sidecar in sidecars.get(f, ()) if sha is None else ():
+                sha = read_sidecar_hash(sidecar, f.name)
+                if sha:
+                    break
+            if sha:
+                full[f] = sha
+            else:
+                unknown.append((f, st, cached_partial))
+
+        # Partial hashes only rule files out when no full hash is known in this size bucket
+        by_partial = defaultdict(list)
+        for f, st, partial in unknown:
+            if partial is None:
+                try:
+                    partial = partial_hash(f, size)
+                except OSError as e:
+                    if errors is not None:
+                        errors.append((f, str(e)))
+                    continue
+                if index is not None:
+                    index.put_hashes(st, partial=partial)
+            by_partial[partial].append((f, st))
+
+        for same_partial in by_partial.values():
+            if len(same_partial) < 2 and not full:
+                continue
+            for f, st in same_partial:
+                if progress:
+                    progress(f, size)
+                try:
+                    sha = file_sha256(f)
+                except OSError as e:
+                    if errors is not None:
+                        errors.append((f, str(e)))
+                    continue
+                if index is not None:
+                    index.put_hashes(st, sha256=sha)
+                full[f] = sha
+
+        by_sha = defaultdict(list)
+        for f, sha in full.items():
+            by_sha[sha].append(f)
+        for sha, paths in by_sha.items():
+            if len(paths) > 1:
+                duplicates.append((sha, size, sorted(paths)))
+
+    duplicates.sort(key=lambda d: (-(d[1] * (len(d[2]) - 1)), d[0]))
+    return duplicates
+
+
+def _read_at(f, size, offset):
+    """Reads size bytes at offset, with os.pread when the platform has it."""
+    if hasattr(os, 'pread'):
+        return os.pread(f.fileno(), size, offset)
+    f.seek(offset)
+    return f.read(size)
+
+
+def guess_architecture(tensor_names, metadata):
+    """Guesses the model family and kind (e.g. 'SDXL LoRA') from tensor names and metadata."""
+    arch = None
+    base_model = ' '.join(str(metadata.get(k, '')) for k in ('modelspec.architecture', 'ss_base_model_version', 'ss_sd_model_name')).lower()
+    for needle, name in ARCHITECTURE_METADATA:
+        if needle in base_model:
+            arch = name
+            break
+    if arch is None:
+        for tensor in tensor_names:
+            for needle, name in ARCHITECTURE_KEYS:
+                if needle in tensor:
+                    arch = name
+                    break
+            if arch:
+                break
+
+    is_lora = any('lora_' in t or '.lora' in t or 'lokr_' in t or '.hada_' in t for t in tensor_names)
+    kind = 'LoRA' if is_lora else 'model'
+    return f"{arch or 'unknown'} {kind}"
+
+
+def read_safetensors_header(path, file_size=None):
+    """
+    Reads only the 8-byte length prefix and the JSON header of a .safetensors file.
+    Returns a JSON-serialisable summary: tensor count, parameter count, dtypes,
+    __metadata__, architecture guess, and 'error' when the file is truncated or corrupt.
+    """
+    info = {'tensors': 0, 'parameters': 0, 'dtypes': {}, 'metadata': {}, 'architecture': None, 'error': None}
+    try:
+        with open(path, 'rb') as f:
+            if file_size is None:
+                file_size = os.fstat(f.fileno()).st_size
+            prefix = _read_at(f, 8, 0)
+            if len(prefix) < 8:
+                info['error'] = 'truncated: no header'
+                return info
+            header_size = struct.unpack('<Q', prefix)[0]
+            if header_size > MAX_HEADER_SIZE or 8 + header_size > file_size:
+                info['error'] = f'truncated or corrupt header (length {header_size}, file {file_size} bytes)'
+                return info
+            raw = _read_at(f, header_size, 8)
+    except OSError as e:
+        info['error'] = f'unreadable: {e}'
+        return info
+
+    try:
+        header = json.loads(raw)
+    except ValueError as e:
+        info['error'] = f'corrupt header: {e}'
+        return info
+    if not isinstance(header, dict):
+        info['error'] = 'corrupt header: not an object'
+        return info
+
+    metadata = header.pop('__metadata__', None) or {}
+    data_end = 0
+    for name, tensor in header.items():
+        if not isinstance(tensor, dict):
+            continue
+        count = 1
+        for dim in tensor.get('shape', ()):
+            count *= dim
+        info['parameters'] += count
+        dtype = tensor.get('dtype', '?')
+        info['dtypes'][dtype] = info['dtypes'].get(dtype, 0) + 1
+        offsets = tensor.get('data_offsets') or (0, 0)
+        data_end = max(data_end, offsets[1])
+    info['tensors'] = len(header)
+    info['metadata'] = metadata if isinstance(metadata, dict) else {}
+    info['architecture'] = guess_architecture(header.keys(), info['metadata'])
+
+    expected = 8 + header_size + data_end
+    if expected > file_size:
+        info['error'] = f'truncated: {file_size} of {expected} bytes'
+    return info
+
+
+def inspect_model(path, index=None):
+    """Returns the safetensors header summary of a model (cached in the scan index), or None for other formats."""
+    if not path.name.endswith(SAFETENSORS_EXTENSIONS):
+        return None
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        return {'error': f'unreadable: {e}'}
+    if index is not None:
+        cached = index.get_header(st)
+        if cached is not None:
+            return cached
+    info = read_safetensors_header(path, st.st_size)
+    # Read errors may be transient, only cache what was actually parsed
+    if index is not None and not (info['error'] or '').startswith('unreadable'):
+        index.put_header(st, info)
+    return info
+
+
+def describe_header(info):
+    """Short display form of a header summary: 'SDXL LoRA, F16, 22.6M params'."""
+    if info.get('error'):
+        return f"{Colors.FAIL}[BROKEN: {info['error']}]{Colors.ENDC}"
+    dtype = max(info['dtypes'], key=info['dtypes'].get) if info['dtypes'] else '?'
+    params = info['parameters']
+    if params >= 1e9:
+        count = f"{params / 1e9:.2f}B"
+    elif params >= 1e6:
+        count = f"{params / 1e6:.1f}M"
+    else:
+        count = f"{params / 1e3:.1f}K"
+    return f"{Colors.OKCYAN}{info['architecture']}, {dtype}, {count} params{Colors.ENDC}"
+
+
+def _hash_job(path):
+    """Process pool job: returns (sha256, error)."""
+    try:
+        return file_sha256(path), None
+    except OSError as e:
+        return None, str(e)
+
+
+def load_verify_journal(journal_path):
+    """Returns {path: record} from a verify progress journal (JSON lines), ignoring a torn last line."""
+    records = {}
+    try:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records[record['path']] = record
+    except OSError:
+        pass
+    return records
+
+
+def verify_models(groups, workers=2, journal_path=None, index=None, progress=None, config=None):
+    """
+    Hashes every model that has a hash sidecar (.sha256 / .civitai.info) with a pool of
+    `workers` processes and compares the result with each sidecar.
+    `workers` is also the I/O concurrency limit: at most that many files are read at once.
+    Each result is appended to the journal as soon as it is known; models already verified
+    ('ok' or 'mismatch') in the journal with the same size and mtime are not hashed again
+    (resume). Errors, which may be transient (a NAS read), are retried.
+    Returns (records, stats) where each record has path, size, mtime_ns, sha256, status
+    ('ok', 'mismatch' or 'error'), mismatched sidecars and error.
+    """
+    done = load_verify_journal(journal_path) if journal_path else {}
+    records = []
+    tasks = []
+    skipped = 0
+    resumed = 0
+    for model, sidecars in sorted(sidecar_hash_paths(groups, config=config).items()):
+        expected = [(sc, read_sidecar_hash(sc, model.name)) for sc in sidecars]
+        expected = [(sc, sha) for sc, sha in expected if sha]
+        if not expected:
+            skipped += 1
+            continue
+        try:
+            st = os.stat(model)
+        except OSError as e:
+            records.append({'path': str(model), 'size': 0, 'mtime_ns': 0, 'sha256': None,
+                            'status': 'error', 'mismatched': [], 'error': str(e)})
+            continue
+        previous = done.get(str(model))
+        if (previous and previous.get('status') in ('ok', 'mismatch')
+                and previous.get('size') == st.st_size and previous.get('mtime_ns') == st.st_mtime_ns):
+            records.append(previous)
+            resumed += 1
+            continue
+        tasks.append((model, st, expected))
+
+    stats = {'files': 0, 'bytes': 0, 'seconds': 0.0, 'resumed': resumed, 'no_reference': skipped}
+    journal = open(journal_path, 'a', encoding='utf-8') if journal_path else None
+
+    def finish(model, st, expected, sha, error):
+        if error:
+            status, mismatched = 'error', []
+        else:
+            mismatched = [sc.name for sc, recorded in expected if recorded != sha]
+            status = 'mismatch' if mismatched else 'ok'
+            if index is not None:
+                index.put_hashes(st, sha256=sha)
+        record = {'path': str(model), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': sha,
+                  'status': status, 'mismatched': mismatched, 'error': error}
+        records.append(record)
+        stats['files'] += 1
+        stats['bytes'] += st.st_size
+        if journal:
+            journal.write(json.dumps(record) + '\n')
+            journal.flush()
+        if progress:
+            progress(record, stats)
+
+    started = time.perf_counter()
+    try:
+        if workers <= 1:
+            for model, st, expected in tasks:
+                finish(model, st, expected, *_hash_job(model))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_hash_job, os.fspath(model)): (model, st, expected) for model, st, expected in tasks}
+                try:
+                    for future in as_completed(futures):
+                        finish(*futures[future], *future.result())
+                except BaseException:
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    raise
+    finally:
+        stats['seconds'] = time.perf_counter() - started
+        if journal:
+            journal.close()
+
+    # A complete run does not need its journal anymore
+    if journal_path:
+        try:
+            os.remove(journal_path)
+        except OSError:
+            pass
+    return records, stats
+
+
+def missing_sidecars(groups, previews=False, config=None):
+    """
+    Returns [(model, sha256_path, preview_source, preview_path), ...] for models whose folder
+    lacks a '<stem>.sha256' sidecar (sha256_path is then where to write it, else None), or,
+    with previews, a '<stem>.preview.webp' while another preview image of the model exists.
+    Nothing is read here. Folders holding several models of the same stem are skipped
+    (the sidecar would be ambiguous).
+    """
+    missing = []
+    for stem, files in groups.items():
+        if stem == 'unknown': continue
+        models, sidecars, _ = categorize_group(files, config)
+        names_per_dir = defaultdict(set)
+        for s in sidecars:
+            names_per_dir[s.parent].add(s.name)
+        models_per_dir = defaultdict(list)
+        for m in models:
+            models_per_dir[m.parent].append(m)
+        for parent, dir_models in models_per_dir.items():
+            if len(dir_models) != 1:
+                continue
+            names = names_per_dir[parent]
+            sha256_path = None if stem + '.sha256' in names else parent / (stem + '.sha256')
+            source = preview_path = None
+            if previews and stem + '.preview.webp' not in names:
+                source = next((parent / (stem + ext) for ext in PREVIEW_SOURCE_EXTENSIONS if stem + ext in names), None)
+                preview_path = parent / (stem + '.preview.webp') if source else None
+            if sha256_path or source:
+                missing.append((dir_models[0], sha256_path, source, preview_path))
+    missing.sort(key=lambda item: os.fspath(item[0]))
+    return missing
+
+
+def write_file_atomic(path, text):
+    """Writes text to a temporary file next to path, syncs it and renames it into place."""
+    partial = f"{path}.partial"
+    try:
+        with open(partial, 'w', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+
+def import_pillow():
+    """Returns PIL.Image when Pillow is installed with WebP support, else None."""
+    # Imported here: Pillow is optional and only --fill-sidecars --previews needs it
+    try:
+        from PIL import Image, features
+    except ImportError:
+        return None
+    return Image if features.check('webp') else None
+
+
+def _preview_job(image_module, source, dest, size=PREVIEW_SIZE):
+    """Thread pool job: downscales source into a WebP at dest; returns (status, error)."""
+    partial = f"{dest}.partial"
+    try:
+        with image_module.open(source) as image:
+            if max(image.size) <= size:
+                return 'small', None
+            # JPEG decoders can skip most of the work when only a thumbnail is needed
+            image.draft('RGB', (size, size))
+            image.thumbnail((size, size))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+            image.save(partial, format='WEBP', quality=PREVIEW_QUALITY)
+        os.replace(partial, dest)
+    except Exception as e:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        return 'error', str(e)
+    return 'written', None
+
+
+def fill_sidecars(groups, workers=2, previews=False, preview_workers=DEFAULT_PREVIEW_WORKERS,
+                  preview_size=PREVIEW_SIZE, index=None, progress=None, config=None):
+    """
+    Writes the missing '<stem>.sha256' sidecars and, with previews, downscales existing previews
+    larger than preview_size pixels into '<stem>.preview.webp' (see missing_sidecars).
+    - Hashes cached in the scan index (same size and mtime) are reused; the others are computed
+      by a pool of `workers` processes, as in verify_models, and stored in the index.
+    - Previews are converted by `preview_workers` threads while the models are hashed. They need
+      Pillow: without it, they are skipped and stats['previews_unavailable'] is set.
+    - Every sidecar is written to a temporary name and renamed into place.
+    Returns (records, stats) where each record has kind ('sha256' or 'preview'), path (the sidecar),
+    source, status ('written', 'cached' (hash from the index), 'small' or 'error') and error.
+    """
+    missing = missing_sidecars(groups, previews=previews, config=config)
+    records = []
+    stats = {'hashed': 0, 'cached': 0, 'bytes': 0, 'previews': 0, 'errors': 0, 'seconds': 0.0,
+             'previews_unavailable': False}
+
+    def finish(kind, path, source, status, error=None):
+        record = {'kind': kind, 'path': str(path), 'source': str(source), 'status': status, 'error': error}
+        records.append(record)
+        if status == 'error':
+            stats['errors'] += 1
+        elif kind == 'preview' and status == 'written':
+            stats['previews'] += 1
+        if progress:
+            progress(record, stats)
+
+    def write_sha256(model, path, sha, status):
+        try:
+            write_file_atomic(path, sha + '\n')
+        except OSError as e:
+            status, error = 'error', str(e)
+        else:
+            error = None
+        finish('sha256', path, model, status, error)
+
+    tasks = []
+    for model, sha256_path, _, _ in missing:
+        if sha256_path is None:
+            continue
+        try:
+            st = os.stat(model)
+        except OSError as e:
+            finish('sha256', sha256_path, model, 'error', str(e))
+            continue
+        cached = index.get_hashes(st)[1] if index is not None else None
+        if cached:
+            stats['cached'] += 1
+            write_sha256(model, sha256_path, cached, 'cached')
+        else:
+            tasks.append((model, st, sha256_path))
+
+    def hashed(model, st, sha256_path, sha, error):
+        if error:
+            finish('sha256', sha256_path, model, 'error', error)
+            return
+        stats['hashed'] += 1
+        stats['bytes'] += st.st_size
+        if index is not None:
+            index.put_hashes(st, sha256=sha)
+        write_sha256(model, sha256_path, sha, 'written')
+
+    conversions = [(source, preview_path) for _, _, source, preview_path in missing if source]
+    image_module = import_pillow() if conversions else None
+    stats['previews_unavailable'] = bool(conversions) and image_module is None
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, preview_workers)) as thumbnails:
+            previews_done = {}
+            if image_module is not None:
+                previews_done = {thumbnails.submit(_preview_job, image_module, source, preview_path, preview_size): (source, preview_path)
+                                 for source, preview_path in conversions}
+            try:
+                if workers <= 1:
+                    for model, st, sha256_path in tasks:
+                        hashed(model, st, sha256_path, *_hash_job(model))
+                else:
+                    with ProcessPoolExecutor(max_workers=workers) as pool:
+                        futures = {pool.submit(_hash_job, os.fspath(model)): (model, st, sha256_path) for model, st, sha256_path in tasks}
+                        try:
+                            for future in as_completed(futures):
+                                hashed(*futures[future], *future.result())
+                        except BaseException:
+                            pool.shutdown(wait=True, cancel_futures=True)
+                            raise
+                for future in as_completed(previews_done):
+                    source, preview_path = previews_done[future]
+                    finish('preview', preview_path, source, *future.result())
+            except BaseException:
+                thumbnails.shutdown(wait=True, cancel_futures=True)
+                raise
+    finally:
+        stats['seconds'] = time.perf_counter() - started
+    return records, stats
+
+
+def format_size(num_bytes):
+    """Formats a byte count for display (e.g. 6.46 GB)."""
+    size = float(num_bytes)
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if size < 1024 or unit == 'TB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.2f} {unit}"
+        size /= 1024
+
+
+def write_plan(path, actions):
+    """Writes an action plan as JSON."""
+    plan = {
+        'version': PLAN_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'actions': actions,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(plan, f, indent=1)
+
+
+def plan_action_error(action):
+    """Returns why an action cannot be applied as written (e.g. a hand-edited plan), or None."""
+    if not isinstance(action, dict):
+        return "not an object"
+    if action.get('op') not in ('move', 'delete'):
+        return f"unknown operation {action.get('op')!r}"
+    if not isinstance(action.get('src'), str) or not action['src']:
+        return "'src' must be a path"
+    if not isinstance(action.get('reason'), str):
+        return "'reason' must be a string"
+    if action['op'] == 'move' and (not isinstance(action.get('dest'), str) or not action['dest']):
+        return "a move needs a 'dest' path"
+    return None
+
+
+def read_plan(path):
+    """Reads an action plan written by write_plan() and returns its actions; a malformed plan raises ValueError."""
+    with open(path, 'r', encoding='utf-8') as f:
+        plan = json.load(f)
+    if not isinstance(plan, dict):
+        raise ValueError("not a plan object")
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError(f"unsupported plan version {plan.get('version')}")
+    actions = plan.get('actions')
+    if not isinstance(actions, list):
+        raise ValueError("no 'actions' list")
+    errors = []
+    targets = {}
+    for n, action in enumerate(actions):
+        error = plan_action_error(action)
+        if not error and action['op'] == 'move':
+            if action['dest'] in targets:
+                error = f"same 'dest' as action {targets[action['dest']]}"
+            targets.setdefault(action['dest'], n)
+        if error:
+            errors.append(f"action {n}: {error}")
+    if errors:
+        more = f" (and {len(errors) - 5} more)" if len(errors) > 5 else ""
+        raise ValueError("; ".join(errors[:5]) + more)
+    return actions
+
+
+def default_undo_journal_path():
+    """Undo journals are written next to the script, one per run."""
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return Path(__file__).parent / f'{UNDO_JOURNAL_PREFIX}{stamp}.jsonl'
+
+
+def _same_device(src, dest_dir):
+    try:
+        return os.stat(src).st_dev == os.stat(dest_dir).st_dev
+    except OSError:
         return False
 
-    for stem in groups.keys():
-        if stem == 'unknown': continue
-        
-        parts = stem.split('_')
-        # Generate candidates: "A_B_C" -> "A", "A_B"
-        candidates = []
-        for i in range(1, len(parts) + 1):
-            candidates.append('_'.join(parts[:i]))
-            
-        for base in candidates:
-            if base in IGNORE_GROUPS:
-                continue
-            version_map[base].append(stem)
 
-    # Filter useful versions
-    # Rule 1: Must have > 1 variant for this base
-    # Rule 2: At least one of the variants must actually contain a model file. 
-    #         (Otherwise we just grouping random orphan sidecars)
-    final_map = {}
-    for base, stems in version_map.items():
-        if len(stems) > 1:
-            has_model = any(group_has_model(s) for s in stems)
-            if has_model:
-                final_map[base] = sorted(stems)
+def _rename_no_replace(src, dest):
+    """
+    Renames src to dest, raising FileExistsError instead of replacing a file that appeared at
+    dest: a hard link fails atomically if dest exists. Symlinks, and filesystems without hard
+    links, fall back to checking dest right before os.rename.
+    """
+    if not os.path.islink(src):
+        try:
+            os.link(src, dest)
+        except FileExistsError:
+            raise
+        except OSError:
+            pass
+        else:
+            os.remove(src)
+            return
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+    os.rename(src, dest)
+
+
+def _copy_move(src, dest):
+    """Cross-device move: copy to a temporary name, rename into place (never over an existing dest), then remove the source."""
+    partial = f"{dest}.partial"
+    try:
+        shutil.copy2(src, partial)
+        _rename_no_replace(partial, dest)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+
+
+def apply_plan(actions, journal_path=None, workers=DEFAULT_COPY_WORKERS, batch_size=APPLY_BATCH_SIZE, progress=None):
+    """
+    Applies move/delete actions in batches and returns counts per (op, reason), plus
+    'skipped' and 'failed'.
+    - Every action is re-validated first: a source that is gone, or a destination that already
+      exists, is skipped (re-running a partly applied plan only does what is left). Files are
+      committed without replacing anything at the destination, and only the first of several
+      moves to the same destination is applied.
+    - Same-filesystem moves are a single os.rename; cross-device moves are copied in parallel
+      by `workers` threads.
+    - Each completed action is appended to the undo journal (JSON lines), synced once per batch.
+      The journal is only created right before the first change, so a run that changes nothing leaves none.
+    """
+    counts = defaultdict(int)
+    targets = set()  # destinations claimed by a move of this run
+    journal = None
+
+    def open_journal():
+        nonlocal journal
+        if journal is None and journal_path:
+            journal = open(journal_path, 'a', encoding='utf-8')
+
+    def done(action, status, error=None):
+        if status == 'done':
+            counts[(action['op'], action['reason'])] += 1
+            if journal:
+                journal.write(json.dumps(action) + '\n')
+                journal.flush()
+        else:
+            counts[status] += 1
+        if progress:
+            progress(action, status, error)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for start in range(0, len(actions), batch_size):
+                copies = []
+                for action in actions[start:start + batch_size]:
+                    error = plan_action_error(action)
+                    if error:
+                        # Reported with the fields progress callbacks rely on
+                        fields = action if isinstance(action, dict) else {}
+                        described = {key: str(fields.get(key, '?')) for key in ('op', 'reason', 'src')}
+                        done(dict(described, dest=None), 'failed', error)
+                        continue
+                    src = action['src']
+                    if not os.path.lexists(src):
+                        done(action, 'skipped', 'source no longer exists')
+                        continue
+                    dest = action.get('dest')
+                    if action['op'] == 'move' and os.path.lexists(dest):
+                        done(action, 'skipped', f"destination {Path(dest).name} already exists")
+                        continue
+                    if action['op'] == 'move' and dest in targets:
+                        done(action, 'skipped', f"destination {Path(dest).name} is the target of another action")
+                        continue
+                    if action['op'] == 'move':
+                        targets.add(dest)
+                    # Raises before the first change when the journal cannot be written
+                    open_journal()
+                    try:
+                        if action['op'] == 'delete':
+                            os.remove(src)
+                        else:
+                            os.makedirs(os.path.dirname(dest), exist_ok=True)
+                            if not _same_device(src, os.path.dirname(dest)):
+                                copies.append((action, pool.submit(_copy_move, src, dest)))
+                                continue
+                            _rename_no_replace(src, dest)
+                    except FileExistsError:
+                        done(action, 'skipped', f"destination {Path(dest).name} already exists")
+                        continue
+                    except OSError as e:
+                        done(action, 'failed', str(e))
+                        continue
+                    done(action, 'done')
+
+                for action, future in copies:
+                    try:
+                        future.result()
+                    except FileExistsError:
+                        done(action, 'skipped', f"destination {Path(action['dest']).name} already exists")
+                        continue
+                    except OSError as e:
+                        done(action, 'failed', str(e))
+                        continue
+                    done(action, 'done')
+                if journal:
+                    os.fsync(journal.fileno())
+    finally:
+        if journal:
+            journal.close()
+    return counts
+
+
+def undo_journal(journal_path, progress=None):
+    """
+    Replays an undo journal in reverse: moved files go back to their source.
+    Deleted files cannot be restored and are only reported. Returns counts like apply_plan(), plus
+    'not_restorable' and 'unreadable' (lines that are not a valid action, such as the line torn
+    when a run is killed mid-write; they are skipped).
+    """
+    entries = []
+    unreadable = 0
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                action = json.loads(line)
+            except ValueError:
+                action = None
+            if plan_action_error(action):
+                unreadable += 1
+                continue
+            entries.append(action)
+    reverse = []
+    deleted = []
+    for action in reversed(entries):
+        if action['op'] == 'move':
+            reverse.append(dict(action, src=action['dest'], dest=action['src'], reason='undo'))
+        else:
+            deleted.append(action)
+            if progress:
+                progress(action, 'skipped', 'deleted files cannot be restored')
+    counts = apply_plan(reverse, progress=progress)
+    counts['not_restorable'] = len(deleted)
+    counts['unreadable'] = unreadable
+    return counts
+
+
+def group_key(filename, config=None):
+    """Returns the group a file name belongs to, as group_files_by_stem() does, or None if ignored."""
+    config = get_config(config)
+    result = config.classifier.classify(filename)
+    if result.ignored:
+        return None
+    key = result.stem or 'unknown'
+    return None if key in config.ignore_groups else key
+
+
+def download_stem(filename, config=None):
+    """Returns the stem of the model a partial download (e.g. 'x.safetensors.part') will become, or None."""
+    for suffix in DOWNLOAD_SUFFIXES:
+        if filename.endswith(suffix):
+            config = get_config(config)
+            result = config.classifier.classify(filename[:-len(suffix)])
+            if result.ftype == 'model' and not result.ignored and result.stem not in config.ignore_groups:
+                return result.stem
+            return None
+    return None
+
+
+class LiveGroups:
+    """
+    Stem groups kept up to date from file events (watch mode).
+    Adding an existing file or removing a missing one is a no-op, so events caused by our own
+    moves and deletes can be applied again safely. A model still being downloaded under a
+    temporary name (see DOWNLOAD_SUFFIXES) is kept in the group of the stem it will have.
+    """
+
+    def __init__(self, groups, config=None):
+        self.config = get_config(config)
+        self.groups = defaultdict(list)
+        self.by_dir = defaultdict(set)  # dir path -> file names, to drop whole directories
+        for stem, files in groups.items():
+            for f in files:
+                self.add(f)
+
+    def key(self, name):
+        return download_stem(name, self.config) or group_key(name, self.config)
+
+    def downloading(self, stem):
+        """True while a model of the group is still being downloaded."""
+        return any(download_stem(f.name, self.config) for f in self.groups.get(stem, ()))
+
+    def add(self, path):
+        """Adds a file, returns its group (None if ignored)."""
+        path = Path(path)
+        key = self.key(path.name)
+        if key is None:
+            return None
+        names = self.by_dir[str(path.parent)]
+        if path.name not in names:
+            names.add(path.name)
+            self.groups[key].append(path)
+        return key
+
+    def remove(self, path):
+        """Removes a file, returns its group (None if ignored or unknown)."""
+        path = Path(path)
+        key = self.key(path.name)
+        names = self.by_dir.get(str(path.parent))
+        if key is None or not names or path.name not in names:
+            return None
+        names.discard(path.name)
+        files = self.groups[key]
+        files.remove(path)
+        if not files:
+            del self.groups[key]
+        return key
+
+    def remove_tree(self, dir_path):
+        """Removes every file below dir_path, returns the affected groups."""
+        dir_path = str(dir_path)
+        prefix = dir_path.rstrip(os.sep) + os.sep
+        touched = set()
+        for d in [d for d in self.by_dir if d == dir_path or d.startswith(prefix)]:
+            for name in list(self.by_dir[d]):
+                key = self.remove(os.path.join(d, name))
+                if key:
+                    touched.add(key)
+            del self.by_dir[d]
+        return touched
+
+
+class InotifyWatcher:
+    """Recursive Linux inotify watcher (through ctypes), honouring the ignored folders."""
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, roots, config=None):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        # Imported here: only watch mode needs ctypes, and it is slow to import
+        import ctypes
+        import ctypes.util
+        self.get_errno = ctypes.get_errno
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # wd -> dir path
+        self.roots = [str(root) for root in as_root_list(roots)]
+        self.ignore_folders = get_config(config).ignore_folders
+        self.overflowed = False
+        for root in self.roots:
+            self._add_tree(root)
+
+    def _add_watch(self, dir_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), self.WATCH_MASK)
+        if wd < 0:
+            errno = self.get_errno()
+            raise OSError(errno, f"inotify_add_watch failed for {dir_path} (see fs.inotify.max_user_watches)")
+        self.watches[wd] = dir_path
+
+    def _add_tree(self, dir_path, events=None):
+        """Watches a directory tree; files already inside are appended to events as created."""
+        stack = [dir_path]
+        while stack:
+            current = stack.pop()
+            try:
+                # Watch first, then list: nothing created in between is missed
+                self._add_watch(current)
+                subdirs, files = list_directory(current)
+            except FileNotFoundError:
+                continue
+            if events is not None:
+                events.extend(('created', os.path.join(current, name)) for name in files)
+            stack.extend(_walk_children(current, subdirs, self.ignore_folders))
+
+    def poll(self, timeout):
+        """Waits up to timeout seconds, returns [(kind, path)] with kind 'created', 'deleted' or 'deleted_dir'."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 1024 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].split(b'\0', 1)[0]
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                self.overflowed = True
+                continue
+            dir_path = self.watches.get(wd)
+            if mask & self.IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            if dir_path is None or not name:
+                continue
+            path = os.path.join(dir_path, os.fsdecode(name))
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    if os.path.basename(path) not in self.ignore_folders:
+                        try:
+                            self._add_tree(path, events)
+                        except OSError as e:
+                            print(f"{Colors.WARNING}Cannot watch {path}: {e}{Colors.ENDC}")
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    events.append(('deleted_dir', path))
+            elif mask & (self.IN_CREATE | self.IN_MOVED_TO | self.IN_CLOSE_WRITE):
+                events.append(('created', path))
+            elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                events.append(('deleted', path))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: re-walks the tree (through the scan index) and reports the differences."""
+
+    def __init__(self, roots, index=None, interval=DEFAULT_POLL_INTERVAL, workers=1):
+        self.roots = as_root_list(roots)
+        self.index = index
+        self.interval = interval
+        self.workers = workers
+        self.overflowed = False
+        self.known = self._snapshot()
+        self.next_poll = time.monotonic() + interval
+
+    def _snapshot(self):
+        return {str(f) for f in iter_roots(self.roots, index=self.index, workers=self.workers)}
+
+    def poll(self, timeout):
+        """Waits up to timeout seconds, returns [(kind, path)] like InotifyWatcher.poll()."""
+        delay = self.next_poll - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(delay, 0))
+        self.next_poll = time.monotonic() + self.interval
+        current = self._snapshot()
+        events = [('deleted', p) for p in self.known - current] + [('created', p) for p in current - self.known]
+        self.known = current
+        return events
+
+    def close(self):
+        pass
+
+
+def peak_rss():
+    """Peak resident set size of the process in bytes, or None where it is not available (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler:
+    """
+    Per-phase instrumentation for --profile: wall time, items processed (files, groups or
+    actions) and the process peak RSS at the end of each phase.
+    Optionally runs cProfile over the whole run (write_stats) and exports the phases as a
+    Chrome trace (write_trace, viewable in chrome://tracing or Perfetto).
+    """
+
+    def __init__(self, cprofile=False):
+        self.started = time.perf_counter()
+        self.phases = []  # {'name', 'start', 'seconds', 'items', 'rss'}, in completion order
+        self.cprofile = None
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def add(self, name, seconds, items=None, start=None):
+        """Records a phase measured by the caller (start: perf_counter() value, default: now - seconds)."""
+        end = time.perf_counter()
+        start = end - seconds if start is None else start
+        self.phases.append({'name': name, 'start': start - self.started, 'seconds': seconds,
+                            'items': items, 'rss': peak_rss()})
+
+    @contextlib.contextmanager
+    def phase(self, name, items=None):
+        """Times the block; the yielded dict's 'items' may be set inside it."""
+        record = {'items': items}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.add(name, time.perf_counter() - start, record['items'], start)
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+
+    def summary(self):
+        """Returns the summary table as a list of lines."""
+        lines = [f"{'Phase':<16} {'Seconds':>9} {'Items':>10} {'Items/s':>12} {'Peak RSS':>11}"]
+        for phase in self.phases:
+            items = phase['items']
+            rate = f"{items / phase['seconds']:,.0f}" if items and phase['seconds'] > 0 else ""
+            rss = format_size(phase['rss']) if phase['rss'] is not None else "n/a"
+            lines.append(f"{phase['name']:<16} {phase['seconds']:>9.3f} {'' if items is None else items:>10} {rate:>12} {rss:>11}")
+        lines.append(f"{'total':<16} {time.perf_counter() - self.started:>9.3f}")
+        return lines
 
-    # Filter redundant bases (e.g. 'Urd' if 'Urd_from' has exact same stems)
-    # Iterate longest bases first
-    sorted_bases = sorted(final_map.keys(), key=len, reverse=True)
-    to_remove = set()
-    for i, base_long in enumerate(sorted_bases):
-        if base_long in to_remove: continue
-        for base_short in sorted_bases[i+1:]:
-            if base_short in to_remove: continue
-            
-            if base_long.startswith(base_short):
-                # Check if they point to the exact same set of stems
-                if set(final_map[base_long]) == set(final_map[base_short]):
-                    to_remove.add(base_short)
-    
-    for k in to_remove:
-        if k in final_map:
-            del final_map[k]
-                
-    return final_map
+    def write_trace(self, path):
+        """Writes the phases as Chrome trace 'complete' events."""
+        events = [
+            {'name': phase['name'], 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+             'ts': round(phase['start'] * 1e6), 'dur': round(phase['seconds'] * 1e6),
+             'args': {'items': phase['items'], 'peak_rss': phase['rss']}}
+            for phase in self.phases
+        ]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def write_stats(self, path):
+        """Dumps the cProfile statistics (read them with python -m pstats)."""
+        self.cprofile.dump_stats(path)
+
+
+_profiler = None
+
+def set_profiler(profiler):
+    """Installs the Profiler used by profile_phase() (None disables profiling)."""
+    global _profiler
+    _profiler = profiler
 
-def check_orphans_against_versions(groups, version_map):
+
+def profile_phase(name, items=None):
+    """Context manager timing a phase with the installed Profiler, a no-op without one."""
+    if _profiler is None:
+        return contextlib.nullcontext({'items': items})
+    return _profiler.phase(name, items)
+
+
+class RecordWriter:
     """
-    Checks if orphan groups might belong to a detected version family.
+    Machine-readable report output (--format json / ndjson).
+    Every record is a dict with a 'type': header, group, result, family, orphan_match, folder, summary.
+    ndjson writes each record on its own line as soon as it is emitted; json collects them and
+    writes one document on close(), with the header fields at the top level, the records in
+    lists (groups, results, families, orphan_matches, folders) and the summary as an object.
     """
-    potential_matches = {} # orphan_stem -> matched_base
-    
-    # Identify orphan groups
-    orphan_groups = []
-    for stem, files in groups.items():
-        if stem == 'unknown': continue
-        
-        has_model = False
-        for f in files:
-            for ext in MODEL_EXTENSIONS:
-                if f.name.endswith(ext):
-                    has_model = True
-                    break
-        if not has_model:
-            orphan_groups.append(stem)
-            
-    # Check each orphan
-    for orphan in orphan_groups:
-        # Check if orphan IS a base (e.g. Model.json vs Model_v1.safetensors)
-        if orphan in version_map:
-            potential_matches[orphan] = orphan
-            continue
-            
-        # Check if orphan is a prefix of a known base (unlikely if split by _ correctly)
-        # Check if orphan matches one of the versions
-        for base in version_map:
-            if orphan.startswith(base):
-                potential_matches[orphan] = base
-                
-    return potential_matches
+    LIST_KEYS = {'group': 'groups', 'result': 'results', 'family': 'families', 'orphan_match': 'orphan_matches', 'folder': 'folders'}
 
-def highlight_extension(filename):
-    """Returns the filename with the extension colorized."""
-    base, ext = get_file_stem(filename)
-    if base and ext:
-        ftype = get_file_type(filename)
-        if ftype == 'model':
-            color = Colors.EXT_MODEL
-        elif ftype == 'sidecar':
-            color = Colors.EXT_SIDECAR
+    def __init__(self, fmt, stream):
+        self.format = fmt
+        self.stream = stream
+        self.streaming = fmt == 'ndjson'
+        self.document = {'schema': REPORT_SCHEMA_VERSION}
+
+    def emit(self, record):
+        if self.streaming:
+            self.stream.write(json.dumps(record) + '\n')
+            self.stream.flush()
+            return
+        record_type = record['type']
+        body = {k: v for k, v in record.items() if k != 'type'}
+        if record_type == 'header':
+            self.document.update(body)
+        elif record_type == 'summary':
+            self.document['summary'] = body
         else:
-            color = Colors.EXT_UNKNOWN # Should not happen if get_file_stem worked with ALL_EXTENSIONS
-            
-        return f"{base}{color}{ext}{Colors.ENDC}"
-    return filename
+            self.document.setdefault(self.LIST_KEYS.get(record_type, record_type), []).append(body)
+
+    def header(self, **fields):
+        self.emit(dict(type='header', schema=REPORT_SCHEMA_VERSION, **fields))
+
+    def close(self):
+        if not self.streaming:
+            json.dump(self.document, self.stream, indent=1)
+            self.stream.write('\n')
+            self.stream.flush()
+
+
+def file_record(path, config=None):
+    """Report form of one file: path, kind and matched extension."""
+    result = get_config(config).classifier.classify(path.name)
+    return {'path': str(path), 'kind': result.ftype, 'ext': result.ext}
+
+
+def group_record(analysis, actions, config=None):
+    """Report form of an analyzed group (see analyze_group) and its planned actions."""
+    target_dir = analysis['target_dir']
+    return {
+        'type': 'group',
+        'stem': analysis['stem'],
+        'orphan': analysis['orphan'],
+        'target_dir': str(target_dir) if target_dir else None,
+        'files': [file_record(f, config) for f in analysis['files']],
+        'duplicates': [{'ext': ext, 'files': [str(f) for f in s_list]} for ext, s_list in analysis['duplicates']],
+        'moves': [{'src': str(f), 'dest': str(target_dir / f.name), 'cross_device': f in analysis['cross_device']}
+                  for f in analysis['moves']],
+        'actions': actions,
+    }
 
-def get_files_recursively(root_dir):
-    """Scans the directory recursively and returns a list of Path objects."""
-    file_list = []
-    print(f"Scanning {root_dir}...")
-    try:
-        for root, dirs, files in os.walk(root_dir):
-            # Modify dirs in-place to skip ignored directories
-            dirs[:] = [d for d in dirs if d not in IGNORE_FOLDERS]
-            
-            for file in files:
-                file_list.append(Path(root) / file)
-    except Exception as e:
-        print(f"Error scanning directory: {e}")
-    return file_list
 
 def confirm_action(prompt):
     """Asks user for confirmation. Returns True if confirmed."""
@@ -273,14 +2120,14 @@ def confirm_action(prompt):
             print("\nOperation cancelled by user.")
             sys.exit(1)
 
-def categorize_group(files):
+def categorize_group(files, config=None):
     """Separates a list of files into models and sidecars."""
     models = []
     sidecars = []
     others = []
     
     for f in files:
-        ftype = get_file_type(f.name)
+        ftype = get_file_type(f.name, config)
         if ftype == 'model':
             models.append(f)
         elif ftype == 'sidecar':
@@ -296,12 +2143,26 @@ def process_groups(groups, args, root_path):
 
     
     # Version Detection Mode
-def handle_versions_mode(groups, root_path):
+def top_level_folder(path, roots):
+    """Returns the first folder of path below the root holding it ('' directly in a root), or None."""
+    for root in roots:
+        try:
+            rel = path.parent.relative_to(root)
+        except ValueError:
+            continue
+        return rel.parts[0] if rel.parts else ""
+    return None
+
+def handle_versions_mode(groups, roots, all_candidates=False, inspect=None, writer=None, config=None):
     print(f"\n{Colors.BOLD}--- DETECTING VERSIONS ---{Colors.ENDC}")
-    version_map = detect_versions(groups)
-    orphan_matches = check_orphans_against_versions(groups, version_map)
+    with profile_phase('detect_versions', len(groups)):
+        version_map = detect_versions(groups, config)
+    with profile_phase('check_orphans', len(groups)):
+        orphan_matches = check_orphans_against_versions(groups, version_map, all_candidates=all_candidates, config=config)
     
-    if not version_map:
+    if writer:
+        emit_versions_records(writer, groups, version_map, orphan_matches, inspect, config=config)
+    elif not version_map:
         print("No multi-version models detected.")
     else:
         # Sort by Top-Level Folder, then Base Name
@@ -311,27 +2172,18 @@ def handle_versions_mode(groups, root_path):
             for stem in stems:
                 for f in groups[stem]:
                     # Try to find a model file first
-                    if get_file_type(f.name) == 'model':
-                        try:
-                            # Get top-level folder relative to root
-                            rel = f.parent.relative_to(root_path)
-                            if len(rel.parts) > 0:
-                                return (rel.parts[0], base)
-                            return ("", base) # File in root
-                        except ValueError:
-                            continue # Should not happen if f is from root_path scan
+                    if get_file_type(f.name, config) == 'model':
+                        # Get top-level folder relative to its root
+                        folder = top_level_folder(f, roots)
+                        if folder is not None:
+                            return (folder, base)
             
             # Fallback: check any file if no model found
             for stem in stems:
                 if groups[stem]:
-                    f = groups[stem][0]
-                    try:
-                        rel = f.parent.relative_to(root_path)
-                        if len(rel.parts) > 0:
-                            return (rel.parts[0], base)
-                        return ("", base)
-                    except ValueError:
-                        pass
+                    folder = top_level_folder(groups[stem][0], roots)
+                    if folder is not None:
+                        return (folder, base)
                             
             return ("", base)
 
@@ -340,69 +2192,418 @@ def handle_versions_mode(groups, root_path):
             for stem in stems:
                 files = groups[stem]
                 # Check if this specific stem is mainly models or sidecars
-                has_model = any(get_file_type(f.name) == 'model' for f in files)
+                has_model = any(get_file_type(f.name, config) == 'model' for f in files)
                 file_count = len(files)
                 
                 status = f"{Colors.OKGREEN}[MODEL]{Colors.ENDC}" if has_model else f"{Colors.FAIL}[ORPHAN]{Colors.ENDC}"
                 
                 print(f"  - {stem} ({file_count} files) {status}")
                 for f in files:
-                    print(f"      {highlight_extension(f.name)} [{Colors.OKBLUE}{f.parent}{Colors.ENDC}]")
+                    header = inspect(f) if inspect and get_file_type(f.name, config) == 'model' else None
+                    details = f" {describe_header(header)}" if header else ""
+                    print(f"      {highlight_extension(f.name, config)} [{Colors.OKBLUE}{f.parent}{Colors.ENDC}]{details}")
                 
-    if orphan_matches:
+    if orphan_matches and not writer:
         print(f"\n{Colors.BOLD}--- POTENTIAL ORPHAN MATCHES ---{Colors.ENDC}")
-        for orphan, base in sorted(orphan_matches.items()):
+        for orphan, match in sorted(orphan_matches.items()):
+            if all_candidates:
+                base, others = match[0], match[1:]
+            else:
+                base, others = match, []
             print(f"  {Colors.OK_ORPHAN}{orphan}{Colors.ENDC} seems related to group {Colors.HEADER}{base}{Colors.ENDC}")
+            if others:
+                print(f"      also matches: {', '.join(others)}")
+
+def emit_versions_records(writer, groups, version_map, orphan_matches, inspect=None, config=None):
+    """Writes version families and orphan matches as report records."""
+    for base in sorted(version_map):
+        stems = []
+        for stem in version_map[base]:
+            files = []
+            for f in groups[stem]:
+                record = file_record(f, config)
+                if inspect and record['kind'] == 'model':
+                    record['header'] = inspect(f)
+                files.append(record)
+            stems.append({'stem': stem, 'has_model': any(r['kind'] == 'model' for r in files), 'files': files})
+        writer.emit({'type': 'family', 'base': base, 'stems': stems})
+    for orphan, match in sorted(orphan_matches.items()):
+        candidates = match if isinstance(match, list) else [match]
+        writer.emit({'type': 'orphan_match', 'orphan': orphan, 'family': candidates[0], 'candidates': candidates})
+    writer.emit({'type': 'summary', 'families': len(version_map), 'orphan_matches': len(orphan_matches)})
+
+def analyze_group(stem, files, config=None):
+    """
+    Finds what is wrong with one group. Returns a dict with the models, sidecars and others,
+    the target_dir (folder of the first model), orphan status, duplicate sidecars as
+    [(ext, [paths])], the sidecars to move next to the model and, among those, the ones on
+    another device than the model (cross_device: for example on another --root).
+    """
+    models, sidecars, others = categorize_group(files, config)
+    result = {
+        'stem': stem, 'files': files, 'models': models, 'sidecars': sidecars, 'others': others,
+        'target_dir': None, 'orphan': bool(not models and sidecars), 'duplicates': [], 'moves': [],
+        'cross_device': [],
+    }
+    if models:
+        target_dir = models[0].parent
+        result['target_dir'] = target_dir
+
+        # Check Duplicates
+        sidecars_by_ext = defaultdict(list)
+        for s in sidecars:
+            _, matched_ext = get_file_stem(s.name, config)
+            if matched_ext:
+                sidecars_by_ext[matched_ext].append(s)
+        result['duplicates'] = [(ext, s_list) for ext, s_list in sidecars_by_ext.items() if len(s_list) > 1]
+
+        # Check Moves
+        result['moves'] = [s for s in sidecars if s.parent != target_dir]
+        result['cross_device'] = [s for s in result['moves'] if not _same_device(s, target_dir)]
+    return result
+
+
+def plan_group_actions(analysis, delete_orphan=False, delete_duplicates=False, move=False, confirm=None, cross_device=False):
+    """
+    Turns one analyzed group into serialisable actions:
+    {'op': 'delete' | 'move', 'reason': 'orphan' | 'duplicate' | 'misplaced', 'group', 'src', 'dest'}.
+    Sidecars on another device than their model are only moved with cross_device.
+    `confirm(prompt)` is asked before each action when given.
+    """
+    actions = []
+    deleted = set()
+    stem = analysis['stem']
+
+    def add(op, reason, src, dest=None, prompt=None):
+        if confirm and not confirm(prompt):
+            return False
+        actions.append({'op': op, 'reason': reason, 'group': stem, 'src': str(src), 'dest': str(dest) if dest else None})
+        return True
+
+    if analysis['orphan'] and delete_orphan:
+        for sidecar in analysis['sidecars']:
+            add('delete', 'orphan', sidecar, prompt=f"Delete orphan {sidecar.name}?")
+
+    target_dir = analysis['target_dir']
+    if delete_duplicates:
+        for ext, s_list in analysis['duplicates']:
+            # Preference: Same dir as model
+            keep = next((s for s in s_list if s.parent == target_dir), s_list[0])
+            for s in s_list:
+                if s != keep and add('delete', 'duplicate', s, prompt=f"Delete duplicate {s.name} (keeping {keep.name})?"):
+                    deleted.add(s)
+
+    if move:
+        destinations = set()
+        for sidecar in analysis['moves']:
+            dest_path = target_dir / sidecar.name
+            # Never overwrite, including another sidecar moved there by this plan
+            if sidecar in deleted or dest_path in destinations:
+                continue
+            if not cross_device and sidecar in analysis['cross_device']:
+                continue
+            if add('move', 'misplaced', sidecar, dest_path, prompt=f"Move {sidecar.name} to {target_dir}?"):
+                destinations.add(dest_path)
+    return actions
+
+
+def _natural_key(stem):
+    """Sort key ordering version numbers numerically (Model_v9 < Model_v10)."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', stem)]
+
+
+def stem_families(version_map):
+    """Returns stem -> family base, each stem belonging to the longest base that lists it."""
+    families = {}
+    for base in sorted(version_map, key=len):
+        for stem in version_map[base]:
+            families[stem] = base
+    return families
+
+
+def plan_keep_latest(groups, version_map, keep, config=None):
+    """
+    Plans the deletion of old versions: in each family (see stem_families), the stems that
+    have a model are ordered by version (natural name order) and every file of the stems
+    after the `keep` latest ones is deleted. Orphan stems are left to --delete_orphan.
+    """
+    by_family = defaultdict(list)
+    for stem, base in stem_families(version_map).items():
+        if any(get_file_type(f.name, config) == 'model' for f in groups[stem]):
+            by_family[base].append(stem)
+    actions = []
+    for base in sorted(by_family):
+        stems = sorted(by_family[base], key=_natural_key, reverse=True)
+        for stem in sorted(stems[keep:], key=_natural_key):
+            actions.extend({'op': 'delete', 'reason': 'old_version', 'group': stem, 'src': str(f), 'dest': None}
+                           for f in groups[stem])
+    return actions
+
+
+def usage_report(groups, roots, sizes=None, version_map=None, keep_latest=None, config=None):
+    """
+    Aggregates file sizes by top-level folder (prefixed with
+    its root when there are several roots), by status
+    (model, sidecar, other, and the bytes --delete_orphan / --delete_duplicates would free)
+    and by version family. Families are ranked by reclaimable bytes; with keep_latest, the
+    old versions plan_keep_latest() would delete are reclaimable too.
+    Sizes come from the `sizes` mapping (as filled by walk_tree(sizes=...)) or, without it,
+    from the FileRecords of a walk that collected them.
+    Returns a dict: total, files, folders, status, reclaimable, families, actions.
+    """
+    config = get_config(config)
+    if version_map is None:
+        version_map = detect_versions(groups, config)
+    roots = as_root_list(roots)
+    prefixes = [(str(root).rstrip(os.sep) + os.sep, str(root) if len(roots) > 1 else None) for root in roots]
+    actions = plan_keep_latest(groups, version_map, keep_latest, config) if keep_latest is not None else []
+    reasons = {action['src']: action['reason'] for action in actions}
+    for stem in sorted(groups):
+        if stem == 'unknown':
+            continue
+        analysis = analyze_group(stem, groups[stem], config)
+        for action in plan_group_actions(analysis, delete_orphan=True, delete_duplicates=True):
+            reasons.setdefault(action['src'], action['reason'])
+
+    families = stem_families(version_map)
+    folders = defaultdict(int)
+    status = dict.fromkeys(('model', 'sidecar', 'other', 'orphan', 'duplicate', 'old_version'), 0)
+    family_stats = {base: {'base': base, 'bytes': 0, 'reclaimable': 0, 'orphan': 0, 'duplicate': 0, 'old_version': 0,
+                           'old_versions': []} for base in version_map}
+    total = count = 0
+    for stem, files in groups.items():
+        family = family_stats.get(families.get(stem))
+        for f in files:
+            size = (f.size if sizes is None else sizes.get(f)) or 0
+            total += size
+            count += 1
+            path = str(f)
+            folder = next(((prefix, label) for prefix, label in prefixes if path.startswith(prefix)), None)
+            if folder is None:
+                folders[os.path.dirname(path)] += size
+            else:
+                relative = path[len(folder[0]):]
+                top = relative.split(os.sep, 1)[0] if os.sep in relative else '.'
+                folders[top if folder[1] is None else os.path.join(folder[1], top)] += size
+            reason = reasons.get(path)
+            status[reason or get_file_type(f.name, config)] += size
+            if family is not None:
+                family['bytes'] += size
+                if reason:
+                    family[reason] += size
+                    family['reclaimable'] += size
+                if reason == 'old_version' and stem not in family['old_versions']:
+                    family['old_versions'].append(stem)
+
+    ranked = sorted(family_stats.values(), key=lambda fam: (-fam['reclaimable'], -fam['bytes'], fam['base']))
+    return {
+        'total': total,
+        'files': count,
+        'folders': dict(sorted(folders.items(), key=lambda item: (-item[1], item[0]))),
+        'status': status,
+        'reclaimable': status['orphan'] + status['duplicate'] + status['old_version'],
+        'families': ranked,
+        'actions': actions,
+    }
+
+
+class Cleaner:
+    """
+    Library entry point for one model library, kept under one or several roots (for example
+    a local SSD and an archive NAS): scans it and returns data instead of printing.
+    The groups of every root are merged, so a sidecar on one root is matched with its model
+    on another.
+    The configuration and the scan index are opened on first use, and the scan results are
+    cached until the next scan(), so a long-lived instance can be queried repeatedly
+    (from several threads: accesses are serialised).
+    """
+
+    def __init__(self, roots, config=None, index_path=None, scan_workers=1):
+        self.roots = as_root_list(roots)
+        self.index_path = index_path  # None: no scan index, every scan walks the whole tree
+        self.scan_workers = scan_workers  # listing threads per root
+        self._config = config
+        self._index = None
+        self._has_sizes = False
+        self._groups = None
+        self._versions = None
+        self.last_scan = {}  # files found, directories walked, re-listed and unreadable (errors) in the last scan()
+        self._lock = threading.RLock()
+
+    @property
+    def config(self):
+        """The CleanerConfig in use (safetensor_cleaner.json next to the script unless given)."""
+        if self._config is None:
+            self._config = get_config()
+        return self._config
+
+    @property
+    def index(self):
+        """The ScanIndex, opened on first use, or None without index_path."""
+        if self._index is None and self.index_path is not None:
+            self._index = ScanIndex(self.index_path)
+        return self._index
+
+    def scan(self, rescan=False, sizes=False):
+        """
+        (Re)scans the roots, concurrently, and returns the number of files found; raises
+        FileNotFoundError if a root is missing. The walker's records are grouped as they come,
+        nothing else keeps the file list. With sizes, file sizes are collected during the walk.
+        """
+        for root in self.roots:
+            if not root.is_dir():
+                raise FileNotFoundError(f"Directory {root} does not exist")
+        with self._lock:
+            stats = {'files': 0}
+            walk_seconds = 0.0
+            profiling = _profiler is not None
+
+            def counted(records):
+                nonlocal walk_seconds
+                records = iter(records)
+                while True:
+                    # The walk and the grouping are interleaved: time the walker's share apart
+                    if profiling:
+                        started = time.perf_counter()
+                    record = next(records, None)
+                    if profiling:
+                        walk_seconds += time.perf_counter() - started
+                    if record is None:
+                        return
+                    stats['files'] += 1
+                    yield record
+
+            started = time.perf_counter()
+            records = iter_roots(self.roots, index=self.index, rescan=rescan, workers=self.scan_workers,
+                                 config=self.config, stats=stats, with_sizes=sizes)
+            self._groups = group_files_by_stem(counted(records), self.config)
+            if profiling:
+                _profiler.add('scan', walk_seconds, stats['files'], started)
+                _profiler.add('group', time.perf_counter() - started - walk_seconds, stats['files'])
+            self._has_sizes = sizes
+            self._versions = None
+            self.last_scan = stats
+            return stats['files']
+
+    def groups(self):
+        """Stem -> list of files, as group_files_by_stem() returns."""
+        with self._lock:
+            if self._groups is None:
+                self.scan()
+            return self._groups
+
+    def versions(self):
+        """Version families: base -> list of stems (see detect_versions)."""
+        with self._lock:
+            if self._versions is None:
+                groups = self.groups()
+                with profile_phase('detect_versions', len(groups)):
+                    self._versions = detect_versions(groups, self.config)
+            return self._versions
+
+    def orphans(self):
+        """Stem -> files of the groups that have sidecars but no model."""
+        with self._lock:
+            orphans = {}
+            for stem, files in self.groups().items():
+                if stem == 'unknown':
+                    continue
+                models, sidecars, _ = categorize_group(files, self.config)
+                if sidecars and not models:
+                    orphans[stem] = files
+            return orphans
+
+    def orphan_matches(self, all_candidates=False):
+        """Orphan stem -> family base(s) it may belong to (see check_orphans_against_versions)."""
+        with self._lock:
+            return check_orphans_against_versions(self.groups(), self.versions(), all_candidates=all_candidates, config=self.config)
+
+    def usage(self, keep_latest=None):
+        """Disk usage by folder, status and family (see usage_report); rescans with sizes if needed."""
+        with self._lock:
+            if not self._has_sizes:
+                self.scan(sizes=True)
+            return usage_report(self.groups(), self.roots, version_map=self.versions(), keep_latest=keep_latest, config=self.config)
+
+    def analyze(self):
+        """Returns the analyze_group() result of every group, sorted by stem ('unknown' excluded)."""
+        with self._lock:
+            groups = self.groups()
+            return [analyze_group(stem, groups[stem], self.config) for stem in sorted(groups) if stem != 'unknown']
+
+    def plan(self, delete_orphan=True, delete_duplicates=True, move=True, cross_device=False):
+        """Returns the cleanup actions for the whole library (nothing is changed)."""
+        actions = []
+        for analysis in self.analyze():
+            actions.extend(plan_group_actions(analysis, delete_orphan, delete_duplicates, move, cross_device=cross_device))
+        return actions
+
+    def apply(self, actions, journal_path=None, workers=DEFAULT_COPY_WORKERS):
+        """Applies actions with apply_plan() and returns its counts; the next query rescans."""
+        with self._lock:
+            try:
+                return apply_plan(actions, journal_path=journal_path, workers=workers)
+            finally:
+                self._groups = self._versions = None
+
+    def fill_sidecars(self, workers=2, previews=False, preview_workers=DEFAULT_PREVIEW_WORKERS, preview_size=PREVIEW_SIZE):
+        """Writes missing .sha256 (and .preview.webp) sidecars with fill_sidecars(); the next query rescans."""
+        with self._lock:
+            try:
+                return fill_sidecars(self.groups(), workers=workers, previews=previews, preview_workers=preview_workers,
+                                     preview_size=preview_size, index=self.index, config=self.config)
+            finally:
+                self._groups = self._versions = None
+
+    def close(self):
+        with self._lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
-def handle_cleanup_mode(groups, args):
-    """Handles standard cleanup operations: Orphans, Duplicates, and Moves."""
-    files_moved = 0
-    orphans_deleted = 0
-    duplicates_deleted = 0
+def handle_cleanup_mode(groups, args, writer=None, config=None):
+    """
+    Handles standard cleanup operations: Orphans, Duplicates, and Moves.
+    With a writer, each reported group is emitted as a record instead of being printed
+    (streamed in scan order for ndjson, as soon as the group is analyzed).
+    """
+    plan_out = getattr(args, 'plan_out', None)
+    delete_orphan, delete_duplicates, move = args.delete_orphan, args.delete_duplicates, args.move
+    if plan_out and not (delete_orphan or delete_duplicates or move):
+        # A plan written for review proposes every kind of action
+        delete_orphan = delete_duplicates = move = True
+    confirm = confirm_action if args.confirm_each else None
+    cross_device = getattr(args, 'allow_cross_device', False)
+    actions = []
+
+    counts = defaultdict(int)
 
     # Sort groups by stem for consistent output
-    sorted_stems = sorted([k for k in groups.keys() if k != 'unknown'])
+    if writer and writer.streaming:
+        sorted_stems = [k for k in groups.keys() if k != 'unknown']
+    else:
+        sorted_stems = sorted([k for k in groups.keys() if k != 'unknown'])
     if 'unknown' in groups:
         sorted_stems.append('unknown')
-        
+
+    # Analysis and output are interleaved: the analysis time is summed apart
+    loop_started = time.perf_counter()
+    analysis_seconds = 0.0
     for stem in sorted_stems:
         files = groups[stem]
-        models, sidecars, others = categorize_group(files)
-        
-        # Determine strict matching logic
-        has_orphans = False
-        has_duplicates = False
-        has_moves = False
-        
-        # Check Orphans
-        if not models and sidecars:
-            has_orphans = True
-            
-        # Check Models present
-        target_dir = None
-        duplicates_list = [] # List of lists of dupes
-        moves_list = []
-        
-        if models:
-            target_dir = models[0].parent
-            
-            # Check Duplicates
-            sidecars_by_ext = defaultdict(list)
-            for s in sidecars:
-                _, matched_ext = get_file_stem(s.name)
-                if matched_ext:
-                    sidecars_by_ext[matched_ext].append(s)
-            
-            for ext, s_list in sidecars_by_ext.items():
-                if len(s_list) > 1:
-                    has_duplicates = True
-                    duplicates_list.append((ext, s_list))
-            
-            # Check Moves (only valid existing sidecars)
-            for sidecar in sidecars:
-                if sidecar.exists() and sidecar.parent != target_dir:
-                    has_moves = True
-                    moves_list.append(sidecar)
+        started = time.perf_counter()
+        analysis = analyze_group(stem, files, config)
+        analysis_seconds += time.perf_counter() - started
+        has_orphans = analysis['orphan']
+        has_duplicates = bool(analysis['duplicates'])
+        has_moves = bool(analysis['moves'])
 
         # Decision to print group
         action_needed = has_orphans or has_duplicates or has_moves
@@ -414,6 +2615,16 @@ def handle_cleanup_mode(groups, args):
         if not should_print:
             continue
 
+        counts['groups'] += 1
+        counts['orphans'] += has_orphans
+        counts['duplicates'] += len(analysis['duplicates'])
+        counts['moves'] += len(analysis['moves'])
+        if writer:
+            group_actions = plan_group_actions(analysis, delete_orphan, delete_duplicates, move, cross_device=cross_device)
+            actions.extend(group_actions)
+            writer.emit(group_record(analysis, group_actions, config))
+            continue
+
         # Print Group Header
         print(f"\n{Colors.HEADER}Group: {stem}{Colors.ENDC}")
         
@@ -421,132 +2632,614 @@ def handle_cleanup_mode(groups, args):
         unknown_exts = set()
         
         for f in files:
-            # Re-verify existence for display? Logic assumes files exist from scan.
-            print(f"  - {highlight_extension(f.name)} ({f.parent})")
+            print(f"  - {highlight_extension(f.name, config)} ({f.parent})")
             if stem == 'unknown':
                 unknown_exts.add(f.suffix)
 
         if stem == 'unknown' and unknown_exts:
             print(f"\n{Colors.BOLD}Unknown Extensions found: {', '.join(sorted(unknown_exts))}{Colors.ENDC}")
 
-        # --- EXECUTE ACTIONS ---
-
-        # 1. Orphans
         if has_orphans:
-            if args.verbose or True: # Orphans are always notable if we are printing the group
-                print(f"  {Colors.FAIL}[ORPHAN]{Colors.ENDC} No model found.")
-            
-            if args.delete_orphan:
-                for sidecar in sidecars:
-                    if args.confirm_each:
-                        if not confirm_action(f"Delete orphan {sidecar.name}?"):
-                            continue
-                    try:
-                        print(f"  {Colors.FAIL}Deleting orphan: {sidecar.name}{Colors.ENDC}")
-                        os.remove(sidecar)
-                        orphans_deleted += 1
-                    except OSError as e:
-                        print(f"  Error deleting {sidecar.name}: {e}")
+            print(f"  {Colors.FAIL}[ORPHAN]{Colors.ENDC} No model found.")
+        for ext, s_list in analysis['duplicates']:
+            print(f"  {Colors.WARNING}[DUPLICATE]{Colors.ENDC} Found {len(s_list)} files for extension {ext}")
+        for sidecar in analysis['moves']:
+            note = " (other device, needs --allow-cross-device)" if sidecar in analysis['cross_device'] and not cross_device else ""
+            print(f"  {Colors.OKCYAN}[MOVE]{Colors.ENDC} {sidecar.name} -> {analysis['target_dir']}{note}")
 
-        # 2. Duplicates
-        if has_duplicates:
-            for ext, s_list in duplicates_list:
-                print(f"  {Colors.WARNING}[DUPLICATE]{Colors.ENDC} Found {len(s_list)} files for extension {ext}")
-                
-                if args.delete_duplicates:
-                    # Preference: Same dir as model
-                    keep = None
-                    for s in s_list:
-                        if s.parent == target_dir:
-                            keep = s
-                            break
-                    if not keep:
-                        keep = s_list[0] 
-                        
-                    for s in s_list:
-                        if s != keep:
-                            if args.confirm_each:
-                                if not confirm_action(f"Delete duplicate {s.name} (keeping {keep.name})?"):
-                                    continue
-                            try:
-                                print(f"  {Colors.FAIL}Deleting duplicate: {s.name}{Colors.ENDC}")
-                                os.remove(s)
-                                duplicates_deleted += 1
-                            except OSError as e:
-                                print(f"  Error deleting {s}: {e}")
-
-        # 3. Moves
-        if has_moves:
-            # Refresh moves list if we deleted stuff? 
-            # Ideally re-check existence.
-            valid_moves = [m for m in moves_list if m.exists()]
-            
-            for sidecar in valid_moves:
-                print(f"  {Colors.OKCYAN}[MOVE]{Colors.ENDC} {sidecar.name} -> {target_dir}")
-                
-                if args.move:
-                    dest_path = target_dir / sidecar.name
-                    if dest_path.exists():
-                        print(f"    Skipping move: Destination {dest_path.name} already exists.")
-                        continue
-                        
-                    if args.confirm_each:
-                        if not confirm_action(f"Move {sidecar.name} to {target_dir}?"):
-                            continue
-                    
-                    try:
-                        shutil.move(str(sidecar), str(dest_path))
-                        files_moved += 1
-                        print(f"    {Colors.OKGREEN}Moved successfully.{Colors.ENDC}")
-                    except OSError as e:
-                        print(f"    Error moving {sidecar.name}: {e}")
+        actions.extend(plan_group_actions(analysis, delete_orphan, delete_duplicates, move, confirm=confirm, cross_device=cross_device))
+
+    if _profiler is not None:
+        _profiler.add('categorize', analysis_seconds, len(sorted_stems), loop_started)
+        _profiler.add('report', time.perf_counter() - loop_started - analysis_seconds, counts['groups'])
+
+    summary = {'type': 'summary', 'applied': False, **counts, 'actions': len(actions)}
+    if plan_out:
+        write_plan(plan_out, actions)
+        if writer:
+            writer.emit(dict(summary, plan=str(plan_out)))
+            return
+        print(f"\n{Colors.BOLD}--- PLAN WRITTEN ---{Colors.ENDC}")
+        print(f"{len(actions)} actions written to {plan_out}. No changes were made.")
+        print(f"Review it, then run with --apply-plan {plan_out}")
+        return
 
     # Summary
     if not (args.move or args.delete_orphan or args.delete_duplicates):
+        if writer:
+            writer.emit(summary)
+            return
         print(f"\n{Colors.BOLD}--- DRY RUN COMPLETE ---{Colors.ENDC}")
         print("No changes were made. Use --move, --delete_orphan, or --delete_duplicates to apply changes.")
-    else:
-        print(f"\n{Colors.BOLD}--- OPERATION COMPLETE ---{Colors.ENDC}")
-        print(f"Moved: {files_moved}")
-        print(f"Orphans Deleted: {orphans_deleted}")
-        print(f"Duplicates Deleted: {duplicates_deleted}")
+        return
 
-def process_groups(groups, args, root_path):
-    """Analyzes and processes the file groups based on arguments."""
+    run_plan(actions, args, writer=writer)
+
+def run_plan(actions, args, writer=None):
+    """Applies a list of actions with the batched executor and prints (or emits) the outcome."""
+    print(f"\n{Colors.BOLD}--- APPLYING {len(actions)} ACTIONS ---{Colors.ENDC}")
+
+    def progress(action, status, error):
+        if writer:
+            writer.emit(dict(action, type='result', status=status, error=error))
+            return
+        name = Path(action['src']).name
+        if status == 'done':
+            if action['op'] == 'move':
+                print(f"  {Colors.OKGREEN}Moved{Colors.ENDC} {name} -> {Path(action['dest']).parent}")
+            else:
+                print(f"  {Colors.FAIL}Deleted {action['reason']}: {name}{Colors.ENDC}")
+        elif status == 'skipped':
+            print(f"    Skipping {action['op']} of {name}: {error}")
+        elif status == 'failed':
+            print(f"    Error on {action['op']} of {name}: {error}")
+
+    journal_path = getattr(args, 'undo_journal', None) or default_undo_journal_path()
+    try:
+        with profile_phase('apply', len(actions)):
+            counts = apply_plan(actions, journal_path=journal_path, workers=getattr(args, 'copy_workers', DEFAULT_COPY_WORKERS), progress=progress)
+    except OSError as e:
+        # Raised before any action when the journal cannot be written
+        print(f"Error: cannot write undo journal {journal_path}: {e}")
+        return
+
+    # Only written when something was applied
+    journaled = os.path.exists(journal_path)
+    if writer:
+        writer.emit({
+            'type': 'summary', 'applied': True, 'actions': len(actions),
+            'moved': counts[('move', 'misplaced')], 'orphans_deleted': counts[('delete', 'orphan')],
+            'duplicates_deleted': counts[('delete', 'duplicate')], 'old_versions_deleted': counts[('delete', 'old_version')],
+            'skipped': counts['skipped'], 'failed': counts['failed'], 'undo_journal': str(journal_path) if journaled else None,
+        })
+        return
+
+    print(f"\n{Colors.BOLD}--- OPERATION COMPLETE ---{Colors.ENDC}")
+    print(f"Moved: {counts[('move', 'misplaced')]}")
+    print(f"Orphans Deleted: {counts[('delete', 'orphan')]}")
+    print(f"Duplicates Deleted: {counts[('delete', 'duplicate')]}")
+    if counts[('delete', 'old_version')]:
+        print(f"Old Versions Deleted: {counts[('delete', 'old_version')]}")
+    if counts['skipped'] or counts['failed']:
+        print(f"Skipped: {counts['skipped']}, Failed: {counts['failed']}")
+    if journaled:
+        print(f"Undo journal: {journal_path} (use --undo {journal_path} to move files back)")
+
+def handle_duplicate_models_mode(groups, index=None, config=None):
+    """Reports model files with identical content (under any name or folder)."""
+    print(f"\n{Colors.BOLD}--- DUPLICATE MODELS ---{Colors.ENDC}")
+
+    def progress(path, size):
+        print(f"  Hashing {path.name} ({format_size(size)})...")
+
+    errors = []
+    duplicates = find_duplicate_models(groups, index=index, progress=progress, errors=errors, config=config)
+    for path, error in errors:
+        print(f"  Error reading {path}: {error}")
+    if not duplicates:
+        print("No duplicate models found.")
+        return
+
+    wasted = 0
+    for sha, size, paths in duplicates:
+        wasted += size * (len(paths) - 1)
+        print(f"\n{Colors.HEADER}{sha[:16]}{Colors.ENDC} {format_size(size)} x {len(paths)}")
+        for p in paths:
+            print(f"  - {highlight_extension(p.name, config)} [{Colors.OKBLUE}{p.parent}{Colors.ENDC}]")
+
+    print(f"\n{Colors.BOLD}Duplicate sets: {len(duplicates)}, reclaimable: {format_size(wasted)}{Colors.ENDC}")
+    print("No changes were made.")
+
+def handle_verify_mode(groups, args, index=None, config=None):
+    """Verifies model hashes against their .sha256 / .civitai.info sidecars."""
+    print(f"\n{Colors.BOLD}--- VERIFYING MODEL HASHES ---{Colors.ENDC}")
+    journal_path = None if args.no_journal else Path(args.verify_journal)
+    if journal_path and journal_path.exists():
+        print(f"Resuming from {journal_path}")
+
+    def progress(record, stats):
+        name = Path(record['path']).name
+        rate = stats['bytes'] / max(time.perf_counter() - started, 1e-9)
+        if record['status'] == 'ok':
+            if args.verbose:
+                print(f"  {Colors.OKGREEN}[OK]{Colors.ENDC} {name} ({format_size(rate)}/s)")
+        elif record['status'] == 'mismatch':
+            print(f"  {Colors.FAIL}[MISMATCH]{Colors.ENDC} {name}: differs from {', '.join(record['mismatched'])}")
+        else:
+            print(f"  {Colors.FAIL}[ERROR]{Colors.ENDC} {name}: {record['error']}")
+
+    started = time.perf_counter()
+    try:
+        records, stats = verify_models(groups, workers=args.verify_workers, journal_path=journal_path,
+                                       index=index, progress=progress, config=config)
+    except KeyboardInterrupt:
+        print(f"\n{Colors.WARNING}Verification interrupted.{Colors.ENDC} Run the same command again to resume.")
+        sys.exit(1)
+
+    counts = defaultdict(int)
+    for record in records:
+        counts[record['status']] += 1
+    problems = [r for r in records if r['status'] != 'ok']
+    if problems:
+        print(f"\n{Colors.BOLD}Corrupt or mismatched models:{Colors.ENDC}")
+        for record in sorted(problems, key=lambda r: r['path']):
+            reason = record['error'] or f"differs from {', '.join(record['mismatched'])}"
+            print(f"  - {highlight_extension(Path(record['path']).name, config)} [{Colors.OKBLUE}{Path(record['path']).parent}{Colors.ENDC}] {reason}")
+
+    seconds = stats['seconds'] or 1e-9
+    print(f"\n{Colors.BOLD}--- VERIFY COMPLETE ---{Colors.ENDC}")
+    print(f"OK: {counts['ok']}, mismatched: {counts['mismatch']}, errors: {counts['error']}")
+    print(f"Resumed from journal: {stats['resumed']}, models without a recorded hash: {stats['no_reference']}")
+    print(f"Hashed {stats['files']} files, {format_size(stats['bytes'])} in {stats['seconds']:.1f}s: "
+          f"{stats['bytes'] / seconds / 1e9:.2f} GB/s, {stats['files'] / seconds:.1f} files/s")
+
+def handle_fill_sidecars_mode(groups, args, index=None, config=None):
+    """Writes missing .sha256 sidecars (and with --fill-previews, downscaled .preview.webp previews)."""
+    print(f"\n{Colors.BOLD}--- FILLING MISSING SIDECARS ---{Colors.ENDC}")
+
+    def progress(record, stats):
+        name = Path(record['path']).name
+        if record['status'] == 'error':
+            print(f"  {Colors.FAIL}[ERROR]{Colors.ENDC} {name}: {record['error']}")
+        elif record['status'] != 'small' and args.verbose:
+            print(f"  {Colors.OKGREEN}[{record['status'].upper()}]{Colors.ENDC} {highlight_extension(name, config)} [{Colors.OKBLUE}{Path(record['path']).parent}{Colors.ENDC}]")
+
+    try:
+        records, stats = fill_sidecars(groups, workers=args.verify_workers, previews=args.fill_previews,
+                                       preview_workers=args.preview_workers, preview_size=args.preview_size,
+                                       index=index, progress=progress, config=config)
+    except KeyboardInterrupt:
+        print(f"\n{Colors.WARNING}Interrupted.{Colors.ENDC} Sidecars written so far are complete; run the same command again to continue.")
+        sys.exit(1)
+    if stats['previews_unavailable']:
+        print(f"{Colors.WARNING}Previews skipped: Pillow with WebP support is not installed (pip install pillow).{Colors.ENDC}")
+
+    seconds = stats['seconds'] or 1e-9
+    written = sum(1 for r in records if r['kind'] == 'sha256' and r['status'] in ('written', 'cached'))
+    small = sum(1 for r in records if r['status'] == 'small')
+    print(f"\n{Colors.BOLD}--- FILL COMPLETE ---{Colors.ENDC}")
+    print(f".sha256 written: {written} ({stats['cached']} from the index cache), previews written: {stats['previews']}"
+          f" ({small} already small), errors: {stats['errors']}")
+    print(f"Hashed {stats['hashed']} files, {format_size(stats['bytes'])} in {stats['seconds']:.1f}s: "
+          f"{stats['bytes'] / seconds / 1e9:.2f} GB/s")
+
+def handle_check_headers_mode(groups, index=None, config=None):
+    """Reads the safetensors headers of every model and reports truncated or corrupt files."""
+    print(f"\n{Colors.BOLD}--- CHECKING SAFETENSORS HEADERS ---{Colors.ENDC}")
+    checked = 0
+    broken = 0
+    by_architecture = defaultdict(int)
+    for stem in sorted(k for k in groups if k != 'unknown'):
+        for f in groups[stem]:
+            if get_file_type(f.name, config) != 'model':
+                continue
+            info = inspect_model(f, index=index)
+            if info is None:
+                continue
+            checked += 1
+            if info.get('error'):
+                broken += 1
+                print(f"  {highlight_extension(f.name, config)} [{Colors.OKBLUE}{f.parent}{Colors.ENDC}] {describe_header(info)}")
+            else:
+                by_architecture[info['architecture']] += 1
+
+    print(f"\n{Colors.BOLD}Checked: {checked}, broken: {broken}{Colors.ENDC}")
+    for arch, count in sorted(by_architecture.items(), key=lambda item: (-item[1], item[0])):
+        print(f"  {arch}: {count}")
+
+def handle_usage_mode(groups, roots, args, writer=None, config=None):
+    """
+    Reports where the bytes are: by top-level folder, by status and by version family, ranked
+    by reclaimable space. With --keep-latest N, also shows what pruning old versions would free
+    (and writes those deletions with --plan-out; nothing is deleted here).
+    """
+    report = usage_report(groups, roots, keep_latest=args.keep_latest, config=config)
+    plan_out = getattr(args, 'plan_out', None)
+    if plan_out:
+        write_plan(plan_out, report['actions'])
+    status = report['status']
+    summary = {
+        'type': 'summary', 'total': report['total'], 'files': report['files'], 'status': status,
+        'reclaimable': report['reclaimable'], 'keep_latest': args.keep_latest, 'actions': len(report['actions']),
+    }
+    if plan_out:
+        summary['plan'] = str(plan_out)
+
+    if writer:
+        for folder, size in report['folders'].items():
+            writer.emit({'type': 'folder', 'folder': folder, 'bytes': size})
+        for family in report['families']:
+            writer.emit(dict(family, type='family'))
+        writer.emit(summary)
+        return
+
+    print(f"\n{Colors.BOLD}--- DISK USAGE ---{Colors.ENDC}")
+    print(f"Total: {format_size(report['total'])} in {report['files']} files")
+
+    print(f"\n{Colors.BOLD}By folder:{Colors.ENDC}")
+    for folder, size in report['folders'].items():
+        print(f"  {format_size(size):>12}  {folder}")
+
+    print(f"\n{Colors.BOLD}By status:{Colors.ENDC}")
+    print(f"  {format_size(status['model']):>12}  models")
+    print(f"  {format_size(status['sidecar']):>12}  sidecars")
+    print(f"  {format_size(status['other']):>12}  other files")
+    print(f"  {format_size(status['orphan']):>12}  {Colors.FAIL}orphan sidecars{Colors.ENDC} (--delete_orphan)")
+    print(f"  {format_size(status['duplicate']):>12}  {Colors.WARNING}duplicate sidecars{Colors.ENDC} (--delete_duplicates)")
+    if args.keep_latest is not None:
+        print(f"  {format_size(status['old_version']):>12}  {Colors.OKCYAN}old versions{Colors.ENDC} (--keep-latest {args.keep_latest})")
+    print(f"  Reclaimable: {Colors.BOLD}{format_size(report['reclaimable'])}{Colors.ENDC}")
+
+    families = report['families'] if args.verbose else report['families'][:20]
+    if families:
+        print(f"\n{Colors.BOLD}Families by reclaimable space:{Colors.ENDC}")
+    for family in families:
+        print(f"  {Colors.HEADER}{family['base']}{Colors.ENDC}: {format_size(family['bytes'])},"
+              f" reclaimable {format_size(family['reclaimable'])}")
+        if family['old_versions']:
+            print(f"      old versions: {', '.join(family['old_versions'])} ({format_size(family['old_version'])})")
+    if len(families) < len(report['families']):
+        print(f"  ... {len(report['families']) - len(families)} more (use --verbose to list all)")
+
+    if plan_out:
+        print(f"\n{len(report['actions'])} deletions of old versions written to {plan_out}. No changes were made.")
+        print(f"Review it, then run with --apply-plan {plan_out}")
+    elif report['actions']:
+        print(f"\nUse --plan-out to write the {len(report['actions'])} deletions of old versions to a plan.")
+
+def handle_watch_mode(groups, args, roots, index=None, config=None):
+    """
+    Long-running mode: keeps the stem groups in memory, updates them from file events
+    (inotify, or polling with --poll), and reports / fixes each changed group once it has been
+    quiet for --debounce seconds (so a bulk download is handled once it is complete).
+    The policies only apply to groups that change while watching: what is found at startup
+    (or by the rescan after an event overflow) is reported, unless --fix-existing. Groups with a
+    model still being downloaded under a temporary name are left alone until it is complete.
+    """
+    policies = dict(delete_orphan=args.delete_orphan, delete_duplicates=args.delete_duplicates, move=args.move)
+    live = LiveGroups(groups, config)
+    journal_path = args.undo_journal or default_undo_journal_path()
+    if args.confirm_each:
+        print(f"{Colors.WARNING}--confirm-each is ignored in watch mode.{Colors.ENDC}")
+
+    watcher = None
+    if not args.poll:
+        try:
+            watcher = InotifyWatcher(roots)
+        except OSError as e:
+            print(f"{Colors.WARNING}inotify unavailable ({e}), polling every {args.poll_interval}s instead.{Colors.ENDC}")
+    if watcher is None:
+        watcher = PollingWatcher(roots, index=index, interval=args.poll_interval, workers=args.scan_workers)
+    print(f"\n{Colors.BOLD}--- WATCHING {', '.join(map(str, roots))} ({type(watcher).__name__}) ---{Colors.ENDC}")
+    if any(policies.values()):
+        print(f"Policies: {', '.join(k for k, v in policies.items() if v)} (undo journal: {journal_path})")
+        if not args.fix_existing:
+            print("Existing problems are only reported; add --fix-existing to apply the policies to them too.")
+
+    def log(message):
+        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {message}", flush=True)
+
+    def settle(stems, apply=True):
+        for stem in sorted(stems):
+            files = live.groups.get(stem)
+            if not files or stem == 'unknown':
+                continue
+            if live.downloading(stem):
+                log(f"{Colors.OKBLUE}[DOWNLOADING]{Colors.ENDC} {stem}: left alone until the model download is complete")
+                continue
+            analysis = analyze_group(stem, files, config)
+            if analysis['orphan']:
+                log(f"{Colors.FAIL}[ORPHAN]{Colors.ENDC} {stem}: {', '.join(f.name for f in analysis['sidecars'])}")
+            for ext, s_list in analysis['duplicates']:
+                log(f"{Colors.WARNING}[DUPLICATE]{Colors.ENDC} {stem}: {len(s_list)} files for extension {ext}")
+            for sidecar in analysis['moves']:
+                log(f"{Colors.OKCYAN}[MOVE]{Colors.ENDC} {sidecar} -> {analysis['target_dir']}")
+            if not apply:
+                continue
+            actions = plan_group_actions(analysis, **policies, cross_device=args.allow_cross_device)
+            if not actions:
+                continue
+
+            def progress(action, status, error):
+                if status == 'done':
+                    log(f"  {action['op']} {action['src']}" + (f" -> {action['dest']}" if action['dest'] else ""))
+                    live.remove(action['src'])
+                    if action['dest']:
+                        live.add(action['dest'])
+                else:
+                    log(f"  {status} {action['op']} {action['src']}: {error}")
+
+            try:
+                apply_plan(actions, journal_path=journal_path, workers=args.copy_workers, progress=progress)
+            except OSError as e:
+                log(f"Error applying actions for {stem}: {e}")
+
+    # The state at startup is handled like one big batch of changes
+    settle(list(live.groups), apply=args.fix_existing)
+
+    dirty = {}  # stem -> time of the last event
+    rescanned = set()  # stems dirtied by an overflow rescan, not by an event of their own
+    try:
+        while True:
+            now = time.monotonic()
+            due = [stem for stem, last in dirty.items() if now - last >= args.debounce]
+            if due:
+                for stem in due:
+                    del dirty[stem]
+                settle([stem for stem in due if stem not in rescanned])
+                settle([stem for stem in due if stem in rescanned], apply=args.fix_existing)
+                rescanned.difference_update(due)
+            timeout = min((args.debounce - (now - last) for last in dirty.values()), default=args.debounce)
+            events = watcher.poll(max(timeout, 0.1))
+
+            if watcher.overflowed:
+                log(f"{Colors.WARNING}Event queue overflowed, rescanning.{Colors.ENDC}")
+                watcher.overflowed = False
+                stats = {}
+                records = iter_roots(roots, index=index, workers=args.scan_workers, config=config, stats=stats)
+                live = LiveGroups(group_files_by_stem(records, config), config)
+                for dir_path, error in stats.get('errors', ()):
+                    log(f"Error scanning directory {dir_path}: {error}")
+                dirty.update(dict.fromkeys(live.groups, time.monotonic()))
+                rescanned.update(live.groups)
+                continue
+
+            now = time.monotonic()
+            for kind, path in events:
+                if kind == 'created':
+                    stems = [live.add(path)]
+                elif kind == 'deleted':
+                    stems = [live.remove(path)]
+                else:
+                    stems = live.remove_tree(path)
+                for stem in stems:
+                    if stem:
+                        dirty[stem] = now
+                        rescanned.discard(stem)
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        watcher.close()
+
+def handle_undo_mode(journal_path):
+    """Moves files back using an undo journal written by a previous run."""
+    print(f"\n{Colors.BOLD}--- UNDOING {journal_path} ---{Colors.ENDC}")
+
+    def progress(action, status, error):
+        name = Path(action['src']).name
+        if status == 'done':
+            print(f"  {Colors.OKGREEN}Restored{Colors.ENDC} {name} -> {Path(action['dest']).parent}")
+        else:
+            print(f"    Skipping {name}: {error}")
+
+    counts = undo_journal(journal_path, progress=progress)
+    print(f"\nRestored: {counts[('move', 'undo')]}, Skipped: {counts['skipped']}, Failed: {counts['failed']}, "
+          f"Not restorable (deleted): {counts['not_restorable']}")
+    if counts['unreadable']:
+        print(f"{Colors.WARNING}Skipped {counts['unreadable']} unreadable journal line(s) (torn by an interrupted run?){Colors.ENDC}")
+
+def process_groups(groups, args, roots, index=None, writer=None, config=None):
+    """Analyzes and processes the file groups based on arguments (with `config`, default: the global one)."""
+    # Report headers keep 'root' (the first root) for readers of the single-root format
+    location = {'root': str(roots[0]), 'roots': [str(root) for root in roots]}
     
+    # Disk Usage Mode
+    if args.usage:
+        if writer:
+            writer.header(mode='usage', **location)
+        with profile_phase('usage', len(groups)):
+            handle_usage_mode(groups, roots, args, writer=writer, config=config)
+        return
+
+    # Duplicate Models Mode
+    if args.find_duplicate_models:
+        with profile_phase('duplicates', len(groups)):
+            handle_duplicate_models_mode(groups, index=index, config=config)
+        return
+
+    # Watch Mode
+    if args.watch:
+        handle_watch_mode(groups, args, roots, index=index, config=config)
+        return
+
+    # Verify Mode
+    if args.verify:
+        with profile_phase('verify', len(groups)):
+            handle_verify_mode(groups, args, index=index, config=config)
+        return
+
+    # Sidecar Repair Mode
+    if args.fill_sidecars:
+        with profile_phase('fill_sidecars', len(groups)):
+            handle_fill_sidecars_mode(groups, args, index=index, config=config)
+        return
+
+    # Header Check Mode
+    if args.check_headers:
+        with profile_phase('check_headers', len(groups)):
+            handle_check_headers_mode(groups, index=index, config=config)
+        return
+
     # Version Detection Mode
     if args.show_versions:
-        handle_versions_mode(groups, root_path)
+        inspect = (lambda f: inspect_model(f, index=index)) if args.inspect_headers else None
+        if writer:
+            writer.header(mode='versions', **location)
+        handle_versions_mode(groups, roots, all_candidates=args.orphan_candidates, inspect=inspect, writer=writer, config=config)
         return
 
     # Standard Cleanup Mode
-    handle_cleanup_mode(groups, args)
+    if writer:
+        writer.header(mode='cleanup', **location)
+    handle_cleanup_mode(groups, args, writer=writer, config=config)
 
 def main():
     parser = argparse.ArgumentParser(description="Reorganize model sidecar files.")
-    parser.add_argument("--root", type=str, default=".", help="Root directory to scan (default: current)")
+    parser.add_argument("--root", type=str, nargs="+", default=["."], help="Root directories to scan, e.g. a local SSD and a NAS: their groups are merged (default: current)")
+    parser.add_argument("--allow-cross-device", action="store_true", help="With --move, also move sidecars to a model on another device (copy then delete); by default they are only reported")
     parser.add_argument("--move", action="store_true", help="Move sidecars to the model's directory")
     parser.add_argument("--delete_orphan", action="store_true", help="Delete sidecars that have no corresponding model")
     parser.add_argument("--delete_duplicates", action="store_true", help="Delete duplicate sidecars (keeps one near model)")
     parser.add_argument("--confirm-each", action="store_true", help="Interactive mode: Ask before every action")
     parser.add_argument("--verbose", action="store_true", help="Show all groups, even those without actions")
     parser.add_argument("--show-versions", action="store_true", help="Show multiple versions of models and related orphans")
+    parser.add_argument("--orphan-candidates", action="store_true", help="With --show-versions, list every family an orphan may belong to (longest match first)")
+    parser.add_argument("--inspect-headers", action="store_true", help="With --show-versions, read safetensors headers to show architecture, dtype and parameter count")
+    parser.add_argument("--check-headers", action="store_true", help="Read every safetensors header and report truncated or corrupt models")
+    parser.add_argument("--find-duplicate-models", action="store_true", help="Find model files with identical content (size, partial hash, then full SHA-256)")
+    parser.add_argument("--verify", action="store_true", help="Hash models and compare with their .sha256 / .civitai.info sidecars")
+    parser.add_argument("--verify-workers", type=int, default=2, help="Processes hashing in parallel for --verify and --fill-sidecars, i.e. files read at once (default: 2)")
+    parser.add_argument("--verify-journal", type=str, default=str(DEFAULT_VERIFY_JOURNAL), help="Progress journal used to resume an interrupted --verify run")
+    parser.add_argument("--no-journal", action="store_true", help="Do not write or resume from the --verify progress journal")
+    parser.add_argument("--fill-sidecars", action="store_true", help="Write the missing .sha256 sidecars of models (hashes cached in the index are reused)")
+    parser.add_argument("--fill-previews", action="store_true", help="Also downscale previews larger than --preview-size into a .preview.webp (needs Pillow, implies --fill-sidecars)")
+    parser.add_argument("--preview-size", type=int, default=PREVIEW_SIZE, help=f"Longest side in pixels of the .preview.webp previews (default: {PREVIEW_SIZE})")
+    parser.add_argument("--preview-workers", type=int, default=DEFAULT_PREVIEW_WORKERS, help=f"Threads converting previews (default: {DEFAULT_PREVIEW_WORKERS})")
+    parser.add_argument("--plan-out", type=str, help="Write the cleanup actions to a JSON plan instead of applying them (all kinds of actions unless --move/--delete_* are given)")
+    parser.add_argument("--apply-plan", type=str, help="Apply a plan written by --plan-out (no scan)")
+    parser.add_argument("--undo", type=str, metavar="JOURNAL", help="Move files back using the undo journal of a previous run")
+    parser.add_argument("--undo-journal", type=str, help="Where to write the undo journal (default: safetensor_cleaner.undo-<time>.jsonl next to the script)")
+    parser.add_argument("--copy-workers", type=int, default=DEFAULT_COPY_WORKERS, help=f"Parallel copies for moves across filesystems (default: {DEFAULT_COPY_WORKERS})")
+    parser.add_argument("--watch", action="store_true", help="Keep running: watch the tree and report (and with --move/--delete_*, fix) groups as files change")
+    parser.add_argument("--fix-existing", action="store_true", help="With --watch and --move/--delete_*, also fix the problems found at startup (default: only report them, and fix what changes while watching)")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_WATCH_DEBOUNCE, help=f"With --watch, seconds a group must stay unchanged before it is handled (default: {DEFAULT_WATCH_DEBOUNCE:g})")
+    parser.add_argument("--poll", action="store_true", help="With --watch, poll the tree instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help=f"With --watch --poll, seconds between scans (default: {DEFAULT_POLL_INTERVAL:g})")
+    parser.add_argument("--usage", action="store_true", help="Report disk usage by top-level folder, status and version family, ranked by reclaimable space")
+    parser.add_argument("--keep-latest", type=int, metavar="N", help="With --usage, show what deleting all but the N latest versions of each family would free (--plan-out writes those deletions)")
     parser.add_argument("--show-unknown", action="store_true", help="Show files that were not categorized into groups")
+    parser.add_argument("--index", type=str, default=str(DEFAULT_INDEX_PATH), help="Scan index database, reused between runs (default: safetensor_cleaner.db next to the script)")
+    parser.add_argument("--no-index", action="store_true", help="Do not use the scan index, always walk the whole tree")
+    parser.add_argument("--scan-workers", type=int, default=1, help="List directories in parallel with N threads (useful on NFS/SMB mounts, default: 1)")
+    parser.add_argument("--rescan", action="store_true", help="Ignore the stored listings and re-list every directory (the index is refreshed)")
     
-    args = parser.parse_args()
+    parser.add_argument("--format", choices=("text", "json", "ndjson"), default="text", help="Report format for cleanup, --show-versions, --usage and --apply-plan: text (default), json (one document) or ndjson (one record per line, streamed)")
     
-    root_path = Path(args.root).resolve()
-    if not root_path.exists():
-        print(f"Error: Directory {root_path} does not exist.")
-        return
+    parser.add_argument("--profile", action="store_true", help="Print wall time, files/s and peak RSS of each phase (scan, grouping, version detection, categorize, apply...) to stderr")
+    parser.add_argument("--profile-stats", type=str, metavar="FILE", help="With --profile, also run cProfile and dump its statistics to FILE (python -m pstats FILE)")
+    parser.add_argument("--profile-trace", type=str, metavar="FILE", help="With --profile, also write the phases as a Chrome trace JSON (chrome://tracing, Perfetto)")
+    
+    args = parser.parse_args()
+    if args.keep_latest is not None:
+        if args.keep_latest < 1:
+            parser.error("--keep-latest must be at least 1")
+        args.usage = True
+    if args.fill_previews:
+        args.fill_sidecars = True
+
+    if args.format != 'text':
+        if args.confirm_each:
+            parser.error("--confirm-each needs --format text")
+        if args.undo or args.watch or args.verify or args.fill_sidecars or args.check_headers or args.find_duplicate_models:
+            parser.error("--format json/ndjson is available for cleanup, --show-versions, --usage and --apply-plan")
+
+    profiler = None
+    if args.profile or args.profile_stats or args.profile_trace:
+        profiler = Profiler(cprofile=bool(args.profile_stats))
+        set_profiler(profiler)
+    try:
+        if args.format == 'text':
+            run(args)
+        else:
+            # Progress messages go to stderr, stdout only carries the report
+            writer = RecordWriter(args.format, sys.stdout)
+            with contextlib.redirect_stdout(sys.stderr):
+                run(args, writer=writer)
+            writer.close()
+    finally:
+        if profiler is not None:
+            report_profile(profiler, args)
+
+def report_profile(profiler, args):
+    """Prints the --profile table to stderr and writes the optional pstats / trace files."""
+    profiler.stop()
+    print(f"\n{Colors.BOLD}--- PROFILE ---{Colors.ENDC}", file=sys.stderr)
+    for line in profiler.summary():
+        print(line, file=sys.stderr)
+    try:
+        if args.profile_stats:
+            profiler.write_stats(args.profile_stats)
+            print(f"cProfile statistics written to {args.profile_stats}", file=sys.stderr)
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
+            print(f"Chrome trace written to {args.profile_trace}", file=sys.stderr)
+    except OSError as e:
+        print(f"Error writing profile: {e}", file=sys.stderr)
 
-    files = get_files_recursively(root_path)
-    if not files:
-        print("No files found.")
+def run(args, writer=None):
+    """Runs the mode selected by the command line arguments."""
+    if args.undo:
+        handle_undo_mode(args.undo)
         return
-        
-    groups = group_files_by_stem(files)
-    process_groups(groups, args, root_path)
+    if args.apply_plan:
+        try:
+            actions = read_plan(args.apply_plan)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading plan {args.apply_plan}: {e}")
+            return
+        if writer:
+            writer.header(mode='apply_plan', plan=args.apply_plan)
+        run_plan(actions, args, writer=writer)
+        return
+    
+    roots = as_root_list(args.root)
+    for root_path in roots:
+        if not root_path.exists():
+            print(f"Error: Directory {root_path} does not exist.")
+            return
+
+    cleaner = Cleaner(roots, config=load_cli_config(),
+                      index_path=None if args.no_index else args.index, scan_workers=args.scan_workers)
+    try:
+        print(f"Scanning {', '.join(map(str, roots))}...")
+        try:
+            found = cleaner.scan(rescan=args.rescan, sizes=args.usage)
+        except sqlite3.Error as e:
+            print(f"{Colors.WARNING}Scan index unavailable ({e}), falling back to a full scan.{Colors.ENDC}")
+            cleaner.close()
+            cleaner.index_path = None
+            found = cleaner.scan(sizes=args.usage)
+        for dir_path, error in cleaner.last_scan.get('errors', ()):
+            print(f"Error scanning directory {dir_path}: {error}")
+        if cleaner.index is not None:
+            print(f"Index: {cleaner.last_scan['directories']} directories, {cleaner.last_scan['relisted']} re-listed.")
+        if not found:
+            print("No files found.")
+            return
+
+        process_groups(cleaner.groups(), args, roots, index=cleaner.index, writer=writer, config=cleaner.config)
+    finally:
+        cleaner.close()
+
+def load_cli_config():
+    """Loads safetensor_cleaner.json, reports it on stderr and makes it the default configuration."""
+    config = load_config()
+    if config.load_error:
+        print(f"{Colors.FAIL}Error loading config: {config.load_error}{Colors.ENDC}", file=sys.stderr)
+    elif config.source:
+        print(f"{Colors.OKBLUE}Loaded configuration from {config.source.name}{Colors.ENDC}", file=sys.stderr)
+    set_default_config(config)
+    return config
 
 if __name__ == "__main__":
     try:
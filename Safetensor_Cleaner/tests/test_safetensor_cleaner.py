@@ -0,0 +1,933 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import hashlib
+import io
+import importlib.util
+import json
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from pathlib import Path
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "safetensor_cleaner.py"
+SPEC = importlib.util.spec_from_file_location("safetensor_cleaner", MODULE_PATH)
+assert SPEC and SPEC.loader
+CLEANER = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = CLEANER
+SPEC.loader.exec_module(CLEANER)
+
+
+class CleanerTestCase(unittest.TestCase):
+    def make_tree(self, files: list[str] | dict[str, bytes]) -> Path:
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        root = Path(temporary.name) / "models"
+        contents = files if isinstance(files, dict) else dict.fromkeys(files, b"")
+        for relative, content in contents.items():
+            path = root / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content)
+        return root
+
+    def groups_of(self, root: Path) -> dict:
+        return CLEANER.group_files_by_stem(CLEANER.walk_tree(root))
+
+    def open_index(self) -> "CLEANER.ScanIndex":
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        index = CLEANER.ScanIndex(Path(temporary.name) / "index.db")
+        self.addCleanup(index.close)
+        return index
+
+
+class ScanIndexTests(CleanerTestCase):
+    def test_index_scan_matches_os_walk(self):
+        root = self.make_tree([
+            "a.safetensors", "a.preview.png",
+            "Loras/b_v1.safetensors", "Loras/deep/b_v2.civitai.info",
+            "VAE/skipped.safetensors",
+        ])
+        expected = set(CLEANER.get_files_recursively(root))
+        self.assertEqual(set(CLEANER.get_files_recursively(root, index=self.open_index())), expected)
+        self.assertNotIn(root / "VAE" / "skipped.safetensors", expected)
+
+    def test_unchanged_directories_are_served_from_index(self):
+        root = self.make_tree(["Loras/a.safetensors"])
+        index = self.open_index()
+        CLEANER.get_files_recursively(root, index=index)
+        # Forge a stale listing with a matching mtime: the index must be trusted
+        loras = str(root / "Loras")
+        mtime_ns = os.stat(loras).st_mtime_ns
+        index.conn.execute("UPDATE dirs SET mtime_ns = ?, files = ? WHERE path = ?", (mtime_ns, "ghost.safetensors", loras))
+        files = CLEANER.get_files_recursively(root, index=index)
+        self.assertEqual([f.name for f in files], ["ghost.safetensors"])
+
+    def test_changed_directory_is_relisted(self):
+        root = self.make_tree(["Loras/a.safetensors"])
+        index = self.open_index()
+        CLEANER.get_files_recursively(root, index=index)
+        (root / "Loras" / "b.safetensors").write_bytes(b"")
+        os.utime(root / "Loras", ns=(0, 10**18))
+        names = {f.name for f in CLEANER.get_files_recursively(root, index=index)}
+        self.assertEqual(names, {"a.safetensors", "b.safetensors"})
+
+    def test_sizes_are_read_even_when_the_listing_is_cached(self):
+        root = self.make_tree({"Loras/a.safetensors": b"12345"})
+        index = self.open_index()
+        CLEANER.walk_tree(root, index=index)
+        sizes = {}
+        stats = {}
+        loras = str(root / "Loras")
+        mtime_ns = os.stat(loras).st_mtime_ns
+        index.conn.execute("UPDATE dirs SET mtime_ns = ? WHERE path = ?", (mtime_ns, loras))
+        CLEANER.walk_tree(root, index=index, sizes=sizes, stats=stats)
+        self.assertEqual(sizes, {root / "Loras" / "a.safetensors": 5})
+
+        # Growing a file (a resumed download) leaves the directory mtime alone
+        with open(root / "Loras" / "a.safetensors", "ab") as f:
+            f.write(b"0" * 1000)
+        os.utime(loras, ns=(mtime_ns, mtime_ns))
+        sizes = {}
+        stats = {}
+        CLEANER.walk_tree(root, index=index, sizes=sizes, stats=stats)
+        self.assertEqual(stats["relisted"], 1)  # the root only (its mtime is within the racy window)
+        self.assertEqual(sizes, {root / "Loras" / "a.safetensors": 1005})
+
+    def test_unreadable_directories_are_reported_in_stats(self):
+        root = self.make_tree(["Loras/a.safetensors", "Locked/b.safetensors"])
+        listing = CLEANER.list_directory
+
+        def list_directory(dir_path, sizes=None):
+            if dir_path.endswith("Locked"):
+                raise PermissionError("Permission denied")
+            return listing(dir_path, sizes)
+
+        stats = {}
+        output = io.StringIO()
+        with mock.patch.object(CLEANER, "list_directory", list_directory), contextlib.redirect_stdout(output):
+            files = list(CLEANER.iter_roots([root / "Loras", root / "Locked"], workers=2, stats=stats))
+        self.assertEqual([f.name for f in files], ["a.safetensors"])
+        self.assertEqual(stats["errors"], [(str(root / "Locked"), "Permission denied")])
+        self.assertEqual(output.getvalue(), "")
+
+    def test_directories_that_cannot_be_stat_are_reported_with_an_index(self):
+        root = self.make_tree(["Loras/a.safetensors", "Locked/b.safetensors"])
+        index = self.open_index()
+        stat = os.stat
+
+        def locked_stat(path, *args, **kwargs):
+            if str(path).endswith("Locked"):
+                raise PermissionError("Permission denied")
+            return stat(path, *args, **kwargs)
+
+        stats = {}
+        with mock.patch.object(CLEANER.os, "stat", locked_stat):
+            files = list(CLEANER.iter_tree(root, index=index, stats=stats))
+        self.assertEqual([f.name for f in files], ["a.safetensors"])
+        self.assertEqual(stats["errors"], [(str(root / "Locked"), "Permission denied")])
+
+    def test_removed_directories_are_pruned(self):
+        root = self.make_tree(["Loras/a.safetensors", "Old/b.safetensors"])
+        index = self.open_index()
+        CLEANER.get_files_recursively(root, index=index)
+        (root / "Old" / "b.safetensors").unlink()
+        (root / "Old").rmdir()
+        CLEANER.get_files_recursively(root, index=index, rescan=True)
+        self.assertNotIn(str(root / "Old"), index.load(root))
+
+
+class ParallelWalkerTests(CleanerTestCase):
+    def test_parallel_walk_matches_sequential_order(self):
+        root = self.make_tree(
+            [f"Loras/f{n}/m{n}_{k}.safetensors" for n in range(12) for k in range(3)]
+            + ["VAE/skipped.safetensors", "ControlNet/deep/skipped.pth", "top.sha256"]
+        )
+        sequential = CLEANER.walk_tree(root)
+        self.assertEqual(set(sequential), set(CLEANER.get_files_recursively(root)))
+        self.assertEqual(CLEANER.walk_tree(root, workers=8), sequential)
+
+    def test_parallel_walk_with_index(self):
+        root = self.make_tree(["a/x.safetensors", "b/y.safetensors", "b/c/z.preview.png"])
+        index = self.open_index()
+        first = CLEANER.walk_tree(root, index=index, workers=4)
+        self.assertEqual(CLEANER.walk_tree(root, index=index, workers=4), first)
+        self.assertEqual(len(first), 3)
+
+
+    def test_every_connection_use_holds_the_lock(self):
+        root = self.make_tree([f"m{n}.safetensors" for n in range(8)])
+        index = self.open_index()
+        unlocked = []
+
+        class CheckedConnection:
+            def __init__(self, conn):
+                self.conn = conn
+
+            def __getattr__(self, name):
+                if not index.lock.locked():
+                    unlocked.append(name)
+                return getattr(self.conn, name)
+
+            def __enter__(self):
+                if not index.lock.locked():
+                    unlocked.append("__enter__")
+                return self.conn.__enter__()
+
+            def __exit__(self, *exc_info):
+                return self.conn.__exit__(*exc_info)
+
+        index.conn = CheckedConnection(index.conn)
+
+        def use(path):
+            st = os.stat(path)
+            index.put_hashes(st, partial="p")
+            index.put_header(st, {"tensors": 1})
+            return index.get_hashes(st), index.get_header(st)
+
+        CLEANER.walk_tree(root, index=index, workers=4)
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(use, sorted(root.iterdir())))
+        self.assertEqual(results, [(("p", None), {"tensors": 1})] * 8)
+        index.close()
+        self.assertEqual(unlocked, [])
+
+    def test_records_stream_with_bounded_read_ahead(self):
+        root = self.make_tree([f"d{n}/e{k}/m{n}_{k}.safetensors" for n in range(6) for k in range(6)])
+        read = CLEANER._read_directory
+        listed = []
+
+        def counting_read(dir_path, *args):
+            listed.append(dir_path)
+            return read(dir_path, *args)
+
+        first = next(CLEANER.iter_tree(root))
+        with mock.patch.object(CLEANER, "_read_directory", counting_read), mock.patch.object(CLEANER, "LISTINGS_PER_WORKER", 1):
+            for workers in (1, 2):
+                listed.clear()
+                walk = CLEANER.iter_tree(root, workers=workers)
+                self.assertEqual(next(walk), first)
+                # root, d0 and d0/e0, plus at most `workers` listings read ahead
+                self.assertLessEqual(len(listed), 3 + 2 * workers)
+                walk.close()
+
+    def test_several_roots_stream_in_root_order(self):
+        roots = [self.make_tree([f"{name}/f{n}/m{n}.safetensors" for n in range(30)]) / name for name in ("a", "b", "c")]
+        expected = [record for root in roots for record in CLEANER.iter_tree(root)]
+        stats = {}
+        self.assertEqual(list(CLEANER.iter_roots(roots, workers=2, stats=stats)), expected)
+        self.assertEqual(stats["directories"], 93)
+
+        with mock.patch.object(CLEANER, "ROOT_BATCH_SIZE", 1), mock.patch.object(CLEANER, "ROOT_QUEUE_BATCHES", 1):
+            walk = CLEANER.iter_roots(roots)
+            self.assertEqual(next(walk), expected[0])
+            walk.close()  # the walks of the other roots end instead of blocking on their full queues
+        with mock.patch.object(CLEANER, "iter_tree", side_effect=OSError("gone")), self.assertRaises(OSError):
+            list(CLEANER.iter_roots(roots))
+
+
+class FileRecordTests(CleanerTestCase):
+    def test_records_stand_in_for_paths(self):
+        root = self.make_tree({"b/x.tar.gz": b"123", "a/y.safetensors": b"", "a/z.preview.png": b""})
+        records = list(CLEANER.iter_tree(root, workers=4, with_sizes=True))
+        self.assertEqual([r.path for r in records], CLEANER.walk_tree(root))
+        y, z = (next(r for r in records if r.name == name) for name in ("y.safetensors", "z.preview.png"))
+        self.assertIs(y.parent, z.parent)
+        self.assertEqual(os.fspath(y), str(root / "a" / "y.safetensors"))
+        self.assertEqual(sorted(records, reverse=True), sorted(records, key=lambda r: r.path, reverse=True))
+        self.assertEqual(len({*records, *CLEANER.iter_tree(root)}), 3)
+        gz = next(r for r in records if r.name == "x.tar.gz")
+        self.assertEqual((gz.suffix, gz.size), (".gz", 3))
+        with open(gz, "rb") as f:
+            self.assertEqual(f.read(), b"123")
+
+    def test_grouping_streams_records(self):
+        root = self.make_tree(["m.safetensors", "m.preview.png", "VAE/skipped.safetensors"])
+        groups = CLEANER.group_files_by_stem(CLEANER.iter_tree(root))
+        self.assertEqual({stem: sorted(f.name for f in files) for stem, files in groups.items()},
+                         {"m": ["m.preview.png", "m.safetensors"]})
+
+
+class ExtensionClassifierTests(unittest.TestCase):
+    NAMES = [
+        "a.safetensors", "a.preview.png", "a.png", "a.civitai.info", "a.info", "a.cm-info.json",
+        "a.metadata.json", "a.json", "x_v1.2.safetensors", "notes", ".json", "script.py",
+        "archive.tar.gz", "backup.safetensors.bak", "weird.preview.jpeg.sha256", "model.gguf",
+    ]
+
+    @staticmethod
+    def linear_classify(name, ignore_extensions):
+        """Reference behaviour of the original endswith() scans."""
+        stem = ext = None
+        for candidate in sorted(CLEANER.MODEL_EXTENSIONS | CLEANER.SIDECAR_EXTENSIONS, key=len, reverse=True):
+            if name.endswith(candidate):
+                stem, ext = name[:-len(candidate)], candidate
+                break
+        if any(name.endswith(e) for e in CLEANER.MODEL_EXTENSIONS):
+            ftype = "model"
+        elif any(name.endswith(e) for e in CLEANER.SIDECAR_EXTENSIONS):
+            ftype = "sidecar"
+        else:
+            ftype = "other"
+        return stem, ext, ftype, any(name.endswith(e) for e in ignore_extensions)
+
+    def test_matches_linear_scans(self):
+        ignore = {".py", ".gz", "bak"}
+        classifier = CLEANER.ExtensionClassifier(CLEANER.MODEL_EXTENSIONS, CLEANER.SIDECAR_EXTENSIONS, ignore)
+        for name in self.NAMES:
+            with self.subTest(name=name):
+                self.assertEqual(tuple(classifier.classify(name)), self.linear_classify(name, ignore))
+
+    def test_ignored_files_and_cache(self):
+        classifier = CLEANER.ExtensionClassifier({".safetensors"}, {".json"}, (), {"safetensor_cleaner.json"})
+        self.assertTrue(classifier.classify("safetensor_cleaner.json").ignored)
+        self.assertIs(classifier.classify("m.json"), classifier.classify("m.json"))
+        with mock.patch.object(CLEANER, "CLASSIFY_CACHE_SIZE", 10):
+            for n in range(25):
+                classifier.classify(f"m{n}.json")
+        self.assertLessEqual(len(classifier.cache), 10)
+
+
+def reference_detect_versions(groups):
+    """The original quadratic detect_versions, kept to check the trie implementation."""
+    version_map = {}
+    for stem in groups:
+        if stem == "unknown":
+            continue
+        parts = stem.split("_")
+        for i in range(1, len(parts) + 1):
+            base = "_".join(parts[:i])
+            if base not in CLEANER.get_config().ignore_groups:
+                version_map.setdefault(base, []).append(stem)
+    final_map = {}
+    for base, stems in version_map.items():
+        if len(stems) > 1 and any(CLEANER.get_file_type(f.name) == "model" for s in stems for f in groups[s]):
+            final_map[base] = sorted(stems)
+    sorted_bases = sorted(final_map, key=len, reverse=True)
+    to_remove = set()
+    for i, long_base in enumerate(sorted_bases):
+        if long_base in to_remove:
+            continue
+        for short_base in sorted_bases[i + 1:]:
+            if short_base not in to_remove and long_base.startswith(short_base):
+                if set(final_map[long_base]) == set(final_map[short_base]):
+                    to_remove.add(short_base)
+    return {base: stems for base, stems in final_map.items() if base not in to_remove}
+
+
+def make_groups(stems_and_exts):
+    groups = {}
+    for stem, ext in stems_and_exts:
+        groups.setdefault(stem, []).append(Path("/models") / f"{stem}{ext}")
+    return groups
+
+
+class DetectVersionsTests(unittest.TestCase):
+    def test_readme_examples(self):
+        groups = make_groups([
+            ("Urd_from_v1", ".safetensors"), ("Urd_from_v2", ".safetensors"), ("Urd_from_v2", ".png"),
+            ("pieModels_applePieV2", ".safetensors"), ("pieModels_blueberryPie", ".civitai.info"),
+            ("Lonely", ".safetensors"),
+        ])
+        self.assertEqual(CLEANER.detect_versions(groups), {
+            "Urd_from": ["Urd_from_v1", "Urd_from_v2"],
+            "pieModels": ["pieModels_applePieV2", "pieModels_blueberryPie"],
+        })
+
+    def test_matches_reference_on_random_libraries(self):
+        rng = random.Random(1234)
+        tokens = ["A", "B", "v1", "v2", "", "x"]
+        for _ in range(200):
+            entries = []
+            for _ in range(rng.randint(1, 25)):
+                stem = "_".join(rng.choice(tokens) for _ in range(rng.randint(1, 4))) or "A"
+                entries.append((stem, rng.choice([".safetensors", ".preview.png", ".civitai.info"])))
+            entries.append(("stable_cascade_stage_b", ".safetensors"))
+            groups = make_groups(entries)
+            result = CLEANER.detect_versions(groups)
+            expected = reference_detect_versions(groups)
+            self.assertEqual(result, expected)
+            self.assertEqual(list(result), list(expected))
+
+
+class OrphanMatchTests(unittest.TestCase):
+    def test_longest_family_wins_and_candidates_are_ranked(self):
+        groups = make_groups([
+            ("Art_v1", ".safetensors"), ("Art_v2", ".safetensors"),
+            ("Art_Nouveau_v1", ".safetensors"), ("Art_Nouveau_v2", ".safetensors"),
+            ("Art_Nouveau_v3", ".civitai.info"), ("Artwork", ".preview.png"), ("Other", ".json"),
+        ])
+        version_map = {"Art": [], "Art_Nouveau": []}
+        self.assertEqual(CLEANER.check_orphans_against_versions(groups, version_map), {
+            "Art_Nouveau_v3": "Art_Nouveau", "Artwork": "Art",
+        })
+        self.assertEqual(CLEANER.check_orphans_against_versions(groups, version_map, all_candidates=True), {
+            "Art_Nouveau_v3": ["Art_Nouveau", "Art"], "Artwork": ["Art"],
+        })
+
+    def test_orphan_that_is_a_base_matches_itself(self):
+        groups = make_groups([("Model_v1", ".safetensors"), ("Model", ".json")])
+        self.assertEqual(CLEANER.check_orphans_against_versions(groups, {"Model": [], "Mod": []}), {"Model": "Model"})
+
+
+class DuplicateModelTests(CleanerTestCase):
+    def test_same_content_under_other_names_is_found(self):
+        weights = b"W" * 5000
+        root = self.make_tree({
+            "Loras/a.safetensors": weights,
+            "Archive/copy_of_a.safetensors": weights,
+            "Loras/b.safetensors": b"X" * 5000,      # same size, other content
+            "Loras/c.safetensors": b"W" * 4000,      # other size
+            "Loras/a.preview.png": weights,          # sidecars are never models
+        })
+        duplicates = CLEANER.find_duplicate_models(self.groups_of(root))
+        self.assertEqual(len(duplicates), 1)
+        sha, size, paths = duplicates[0]
+        self.assertEqual(size, 5000)
+        self.assertEqual({p.name for p in paths}, {"a.safetensors", "copy_of_a.safetensors"})
+
+    def test_read_errors_are_collected_not_printed(self):
+        root = self.make_tree({"a.safetensors": b"W" * 5000, "b.safetensors": b"W" * 5000})
+        errors = []
+        output = io.StringIO()
+        with mock.patch.object(CLEANER, "file_sha256", side_effect=OSError("I/O error")), contextlib.redirect_stdout(output):
+            self.assertEqual(CLEANER.find_duplicate_models(self.groups_of(root), errors=errors), [])
+        self.assertEqual(sorted((p.name, error) for p, error in errors), [("a.safetensors", "I/O error"), ("b.safetensors", "I/O error")])
+        self.assertEqual(output.getvalue(), "")
+
+    def test_hashes_are_cached_and_sidecars_reused(self):
+        weights = b"W" * 5000
+        sha = hashlib.sha256(weights).hexdigest()
+        root = self.make_tree({
+            "a.safetensors": weights,
+            "a.sha256": sha.upper().encode() + b"  a.safetensors\n",
+            "b.safetensors": weights,
+        })
+        index = self.open_index()
+        hashed = []
+        progress = lambda path, size: hashed.append(path.name)
+        self.assertEqual(len(CLEANER.find_duplicate_models(self.groups_of(root), index=index, progress=progress)), 1)
+        self.assertEqual(hashed, ["b.safetensors"])
+        hashed.clear()
+        self.assertEqual(len(CLEANER.find_duplicate_models(self.groups_of(root), index=index, progress=progress)), 1)
+        self.assertEqual(hashed, [])
+
+
+class VerifyTests(CleanerTestCase):
+    def make_library(self):
+        good, bad = b"G" * 3000, b"B" * 3000
+        civitai = {"files": [{"name": "bad.safetensors", "primary": True, "hashes": {"SHA256": "AB" * 32}}]}
+        return self.make_tree({
+            "good.safetensors": good,
+            "good.sha256": hashlib.sha256(good).hexdigest().encode(),
+            "bad.safetensors": bad,
+            "bad.civitai.info": json.dumps(civitai).encode(),
+            "nohash.safetensors": b"N",
+        })
+
+    def test_mismatches_are_reported(self):
+        root = self.make_library()
+        records, stats = CLEANER.verify_models(self.groups_of(root), workers=2)
+        statuses = {Path(r["path"]).name: (r["status"], r["mismatched"]) for r in records}
+        self.assertEqual(statuses, {
+            "good.safetensors": ("ok", []),
+            "bad.safetensors": ("mismatch", ["bad.civitai.info"]),
+        })
+        self.assertEqual((stats["files"], stats["bytes"], stats["no_reference"]), (2, 6000, 0))
+
+    def test_journal_resumes_and_is_removed(self):
+        root = self.make_library()
+        journal = root.parent / "verify.jsonl"
+        good = root / "good.safetensors"
+        st = os.stat(good)
+        journal.write_text(json.dumps({
+            "path": str(good), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": "x",
+            "status": "ok", "mismatched": [], "error": None,
+        }) + "\n{torn")
+        records, stats = CLEANER.verify_models(self.groups_of(root), workers=1, journal_path=journal)
+        self.assertEqual((stats["resumed"], stats["files"], len(records)), (1, 1, 2))
+        self.assertFalse(journal.exists())
+
+    def test_errors_are_retried_and_not_counted_as_resumed(self):
+        root = self.make_library()
+        journal = root.parent / "verify.jsonl"
+        bad = root / "bad.safetensors"
+        st = os.stat(bad)
+        journal.write_text(json.dumps({
+            "path": str(bad), "size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": None,
+            "status": "error", "mismatched": [], "error": "Input/output error",
+        }) + "\n")
+        (root / "good.safetensors").unlink()
+        (root / "good.safetensors").symlink_to(root / "missing.safetensors")
+        records, stats = CLEANER.verify_models(self.groups_of(root), workers=1, journal_path=journal)
+        statuses = {Path(r["path"]).name: r["status"] for r in records}
+        self.assertEqual(statuses, {"good.safetensors": "error", "bad.safetensors": "mismatch"})
+        self.assertEqual((stats["resumed"], stats["files"]), (0, 1))
+
+
+class FillSidecarsTests(CleanerTestCase):
+    def test_missing_hashes_are_written_and_cached(self):
+        root = self.make_tree({
+            "a/new.safetensors": b"N" * 3000,
+            "a/done.safetensors": b"D",
+            "a/done.sha256": b"0" * 64,
+            "b/twice.safetensors": b"1",
+            "b/twice.ckpt": b"2",
+        })
+        index = self.open_index()
+        records, stats = CLEANER.fill_sidecars(self.groups_of(root), workers=2, index=index)
+        self.assertEqual([(Path(r["path"]).name, r["status"]) for r in records], [("new.sha256", "written")])
+        sha = hashlib.sha256(b"N" * 3000).hexdigest()
+        self.assertEqual(CLEANER.read_sha256_sidecar(root / "a" / "new.sha256"), sha)
+        self.assertEqual(index.get_hashes(os.stat(root / "a" / "new.safetensors"))[1], sha)
+        self.assertEqual(list(root.rglob("*.partial")), [])
+
+        (root / "a" / "new.sha256").unlink()
+        records, stats = CLEANER.fill_sidecars(self.groups_of(root), workers=1, index=index)
+        self.assertEqual((stats["hashed"], stats["cached"], records[0]["status"]), (0, 1, "cached"))
+        self.assertEqual(CLEANER.read_sha256_sidecar(root / "a" / "new.sha256"), sha)
+
+    def test_large_previews_are_downscaled(self):
+        root = self.make_tree({"big.safetensors": b"B", "big.sha256": b"0" * 64, "small.safetensors": b"S", "small.sha256": b"0" * 64})
+        self.assertEqual(CLEANER.get_file_stem("big.preview.webp"), ("big", ".preview.webp"))
+        with mock.patch.object(CLEANER, "import_pillow", return_value=None):
+            (root / "big.preview.png").write_bytes(b"")
+            records, stats = CLEANER.fill_sidecars(self.groups_of(root), previews=True)
+        self.assertEqual((records, stats["previews_unavailable"]), ([], True))
+
+        Image = CLEANER.import_pillow()
+        if Image is None:
+            self.skipTest("Pillow with WebP support is not installed")
+        Image.new("RGB", (1000, 600), "red").save(root / "big.preview.png")
+        Image.new("RGB", (100, 60), "red").save(root / "small.jpg")
+        records, stats = CLEANER.fill_sidecars(self.groups_of(root), previews=True, preview_size=200)
+        self.assertEqual(sorted((Path(r["source"]).name, r["status"]) for r in records),
+                         [("big.preview.png", "written"), ("small.jpg", "small")])
+        with Image.open(root / "big.preview.webp") as image:
+            self.assertEqual(image.size, (200, 120))
+        self.assertFalse((root / "small.preview.webp").exists())
+
+
+class ApplyPlanTests(CleanerTestCase):
+    def plan(self, root: Path) -> list[dict]:
+        actions = []
+        for stem, files in sorted(self.groups_of(root).items()):
+            analysis = CLEANER.analyze_group(stem, files)
+            actions += CLEANER.plan_group_actions(analysis, delete_orphan=True, delete_duplicates=True, move=True)
+        return actions
+
+    def test_plan_apply_and_undo(self):
+        root = self.make_tree([
+            "Loras/a.safetensors", "Loras/a.preview.png", "Other/a.preview.png", "Other/a.civitai.info",
+            "Other/orphan.json",
+        ])
+        actions = self.plan(root)
+        self.assertEqual(
+            sorted((a["op"], a["reason"], Path(a["src"]).relative_to(root).as_posix()) for a in actions),
+            [("delete", "duplicate", "Other/a.preview.png"), ("delete", "orphan", "Other/orphan.json"),
+             ("move", "misplaced", "Other/a.civitai.info")],
+        )
+        plan_path = root.parent / "plan.json"
+        CLEANER.write_plan(plan_path, actions)
+        journal = root.parent / "undo.jsonl"
+        counts = CLEANER.apply_plan(CLEANER.read_plan(plan_path), journal_path=journal, batch_size=1)
+        self.assertEqual(counts[("move", "misplaced")], 1)
+        self.assertEqual(counts[("delete", "duplicate")] + counts[("delete", "orphan")], 2)
+        self.assertTrue((root / "Loras" / "a.civitai.info").exists())
+
+        # Re-applying the same plan does nothing
+        self.assertEqual(CLEANER.apply_plan(actions)["skipped"], 3)
+
+        # A run killed mid-write leaves a torn last line
+        with open(journal, "a", encoding="utf-8") as f:
+            f.write('{"op":"mo')
+        counts = CLEANER.undo_journal(journal)
+        self.assertEqual(counts[("move", "undo")], 1)
+        self.assertEqual(counts["unreadable"], 1)
+        self.assertTrue((root / "Other" / "a.civitai.info").exists())
+
+    def test_existing_destination_is_never_overwritten(self):
+        root = self.make_tree(["A/m.safetensors", "B/m.sha256"])
+        actions = self.plan(root)
+        (root / "A" / "m.sha256").write_text("newer")
+        counts = CLEANER.apply_plan(actions)
+        self.assertEqual(counts["skipped"], 1)
+        self.assertEqual((root / "A" / "m.sha256").read_text(), "newer")
+
+    def test_malformed_actions_are_rejected(self):
+        root = self.make_tree(["A/m.sha256"])
+        src = str(root / "A" / "m.sha256")
+        bad = [{"src": src, "reason": "orphan"}, {"op": "move", "src": src, "reason": "misplaced"},
+               {"op": "delete", "reason": "orphan"}, {"op": "delete", "src": src}, "delete"]
+        plan_path = root.parent / "plan.json"
+        CLEANER.write_plan(plan_path, bad)
+        with self.assertRaisesRegex(ValueError, "action 0: unknown operation.*action 4: not an object"):
+            CLEANER.read_plan(plan_path)
+
+        failures = []
+        counts = CLEANER.apply_plan(bad, progress=lambda action, status, error: failures.append((action["op"], status)))
+        self.assertEqual(counts["failed"], 5)
+        self.assertEqual(failures[0], ("?", "failed"))
+        self.assertTrue((root / "A" / "m.sha256").exists())
+
+    def test_journal_is_only_written_when_something_changes(self):
+        root = self.make_tree(["A/m.safetensors", "B/m.sha256"])
+        actions = self.plan(root)
+        (root / "A" / "m.sha256").write_text("newer")
+        journal = root.parent / f"{CLEANER.UNDO_JOURNAL_PREFIX}1.jsonl"
+        self.assertEqual(CLEANER.apply_plan(actions, journal_path=journal)["skipped"], 1)
+        self.assertFalse(journal.exists())
+        self.assertTrue(CLEANER.get_config().classifier.classify(journal.name).ignored)
+
+    def test_moves_never_replace_a_destination_created_meanwhile(self):
+        root = self.make_tree({"A/x.json": b"first", "B/x.json": b"second", "C/y.json": b"third"})
+        dest = str(root / "D" / "x.json")
+        actions = [{"op": "move", "reason": "misplaced", "src": str(root / folder / "x.json"), "dest": dest}
+                   for folder in ("A", "B")]
+        plan_path = root.parent / "plan.json"
+        CLEANER.write_plan(plan_path, actions)
+        with self.assertRaisesRegex(ValueError, "action 1: same 'dest' as action 0"):
+            CLEANER.read_plan(plan_path)
+        counts = CLEANER.apply_plan(actions)
+        self.assertEqual((counts[("move", "misplaced")], counts["skipped"]), (1, 1))
+        self.assertEqual((root / "D" / "x.json").read_bytes(), b"first")
+        self.assertTrue((root / "B" / "x.json").exists())
+
+        # A file appearing between the check and the rename (or the end of a copy) is kept
+        with self.assertRaises(FileExistsError):
+            CLEANER._rename_no_replace(str(root / "B" / "x.json"), dest)
+        with mock.patch.object(CLEANER.os, "link", side_effect=OSError("no hard links")), self.assertRaises(FileExistsError):
+            CLEANER._rename_no_replace(str(root / "B" / "x.json"), dest)
+        with self.assertRaises(FileExistsError):
+            CLEANER._copy_move(str(root / "C" / "y.json"), dest)
+        self.assertEqual((root / "D" / "x.json").read_bytes(), b"first")
+        self.assertEqual(sorted(p.name for p in (root / "D").iterdir()), ["x.json"])
+        self.assertTrue((root / "B" / "x.json").exists() and (root / "C" / "y.json").exists())
+
+    def test_copy_move(self):
+        root = self.make_tree({"src/x.json": b"data"})
+        (root / "dst").mkdir()
+        CLEANER._copy_move(str(root / "src" / "x.json"), str(root / "dst" / "x.json"))
+        self.assertEqual((root / "dst" / "x.json").read_bytes(), b"data")
+        self.assertFalse((root / "src" / "x.json").exists())
+
+
+class WatchTests(CleanerTestCase):
+    def test_live_groups_follow_events(self):
+        root = self.make_tree(["A/m.safetensors", "A/m.preview.png", "B/sub/m.civitai.info"])
+        live = CLEANER.LiveGroups(self.groups_of(root))
+        self.assertEqual(len(live.groups["m"]), 3)
+        self.assertEqual(live.add(root / "A" / "m.preview.png"), "m")
+        self.assertEqual(len(live.groups["m"]), 3)
+        self.assertEqual(live.remove(root / "A" / "m.safetensors"), "m")
+        self.assertTrue(CLEANER.analyze_group("m", live.groups["m"])["orphan"])
+        self.assertEqual(live.remove_tree(root / "B"), {"m"})
+        self.assertIsNone(live.add(root / "A" / "script.py"))
+
+    def watch(self, root: Path, events: list[list[tuple[str, Path]]], **options) -> str:
+        """Runs handle_watch_mode with a watcher delivering `events` one batch per poll, then Ctrl-C."""
+        batches = iter(events)
+
+        class FakeWatcher:
+            overflowed = False
+
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def poll(self, timeout):
+                try:
+                    return [(kind, str(path)) for kind, path in next(batches)]
+                except StopIteration:
+                    raise KeyboardInterrupt
+
+            def close(self):
+                pass
+
+        args = argparse.Namespace(
+            delete_orphan=False, delete_duplicates=False, move=False, confirm_each=False, fix_existing=False,
+            poll=True, poll_interval=0, debounce=0, scan_workers=1, copy_workers=1, allow_cross_device=False,
+            undo_journal=str(root.parent / "undo.jsonl"),
+        )
+        vars(args).update(options)
+        output = io.StringIO()
+        with mock.patch.object(CLEANER, "PollingWatcher", FakeWatcher), contextlib.redirect_stdout(output):
+            CLEANER.handle_watch_mode(self.groups_of(root), args, [root])
+        return re.sub(r"\x1b\[[0-9;]*m", "", output.getvalue())
+
+    def test_watch_only_reports_existing_problems_and_waits_for_downloads(self):
+        root = self.make_tree(["A/old.civitai.info", "B/new.safetensors.part"])
+        self.assertEqual(CLEANER.download_stem("new.safetensors.part"), "new")
+        self.assertIsNone(CLEANER.download_stem("new.preview.png.part"))
+        (root / "B" / "new.civitai.info").write_bytes(b"{}")
+        output = self.watch(root, [[("created", root / "B" / "new.civitai.info")]], delete_orphan=True)
+        self.assertIn("[ORPHAN] old: old.civitai.info", output)
+        self.assertIn("[DOWNLOADING] new", output)
+        self.assertNotIn("[ORPHAN] new", output)
+        self.assertTrue((root / "A" / "old.civitai.info").exists())
+        self.assertTrue((root / "B" / "new.civitai.info").exists())
+
+        # The download completes (renamed into place): the group now has its model
+        (root / "B" / "new.safetensors.part").rename(root / "B" / "new.safetensors")
+        self.watch(root, [[("deleted", root / "B" / "new.safetensors.part"), ("created", root / "B" / "new.safetensors")]],
+                   delete_orphan=True)
+        self.assertTrue((root / "B" / "new.civitai.info").exists())
+
+        self.watch(root, [], delete_orphan=True, fix_existing=True)
+        self.assertFalse((root / "A" / "old.civitai.info").exists())
+
+    def test_polling_watcher_reports_differences(self):
+        root = self.make_tree(["A/m.safetensors"])
+        watcher = CLEANER.PollingWatcher(root, interval=0)
+        (root / "A" / "m.safetensors").unlink()
+        (root / "A" / "n.safetensors").write_bytes(b"")
+        self.assertEqual(sorted((kind, Path(p).name) for kind, p in watcher.poll(1)),
+                         [("created", "n.safetensors"), ("deleted", "m.safetensors")])
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+    def test_inotify_watcher_sees_new_directories(self):
+        root = self.make_tree(["A/m.safetensors"])
+        watcher = CLEANER.InotifyWatcher(root)
+        self.addCleanup(watcher.close)
+        (root / "New").mkdir()
+        (root / "A" / "m.safetensors").unlink()
+        events = watcher.poll(1)
+        (root / "New" / "x.json").write_bytes(b"")
+        events += watcher.poll(1)
+        self.assertIn(("deleted", str(root / "A" / "m.safetensors")), events)
+        self.assertIn(("created", str(root / "New" / "x.json")), events)
+
+
+class ReportFormatTests(CleanerTestCase):
+    def cleanup_report(self, fmt: str, root: Path) -> str:
+        args = argparse.Namespace(
+            delete_orphan=False, delete_duplicates=False, move=False, confirm_each=False,
+            verbose=False, show_unknown=False, plan_out=None,
+        )
+        stream = io.StringIO()
+        writer = CLEANER.RecordWriter(fmt, stream)
+        with contextlib.redirect_stdout(io.StringIO()):
+            writer.header(mode="cleanup", root=str(root))
+            CLEANER.handle_cleanup_mode(self.groups_of(root), args, writer=writer)
+        writer.close()
+        return stream.getvalue()
+
+    def test_ndjson_streams_one_record_per_group(self):
+        root = self.make_tree(["A/m.safetensors", "B/m.civitai.info", "B/orphan.json", "A/fine.safetensors"])
+        records = [json.loads(line) for line in self.cleanup_report("ndjson", root).splitlines()]
+        self.assertEqual([r["type"] for r in records], ["header", "group", "group", "summary"])
+        groups = {r["stem"]: r for r in records if r["type"] == "group"}
+        self.assertTrue(groups["orphan"]["orphan"])
+        self.assertEqual(groups["m"]["moves"], [{"src": str(root / "B" / "m.civitai.info"), "dest": str(root / "A" / "m.civitai.info"), "cross_device": False}])
+        self.assertEqual(records[-1]["moves"], 1)
+
+    def test_json_is_one_document(self):
+        root = self.make_tree(["A/m.safetensors", "B/m.civitai.info"])
+        document = json.loads(self.cleanup_report("json", root))
+        self.assertEqual(document["schema"], CLEANER.REPORT_SCHEMA_VERSION)
+        self.assertEqual([g["stem"] for g in document["groups"]], ["m"])
+        self.assertFalse(document["summary"]["applied"])
+
+
+class MultiRootTests(CleanerTestCase):
+    def test_roots_are_merged_into_one_stem_index(self):
+        ssd = self.make_tree({"Loras/a.safetensors": b"m", "Loras/fine.safetensors": b"m"})
+        nas = self.make_tree({"Archive/a.civitai.info": b"i", "Archive/gone.json": b"j"})
+        with CLEANER.Cleaner([ssd, nas, ssd / "Loras"], index_path=ssd.parent / "index.db", scan_workers=2) as cleaner:
+            self.assertEqual(cleaner.roots, [ssd, nas])
+            self.assertEqual(cleaner.scan(), 4)
+            self.assertEqual(sorted(cleaner.groups()), ["a", "fine", "gone"])
+            self.assertEqual(list(cleaner.orphans()), ["gone"])
+            self.assertEqual(cleaner.last_scan["directories"], 4)
+            moves = [(a["src"], a["dest"]) for a in cleaner.plan(delete_orphan=False)]
+            self.assertEqual(moves, [(str(nas / "Archive" / "a.civitai.info"), str(ssd / "Loras" / "a.civitai.info"))])
+            self.assertEqual(cleaner.usage()["folders"], {str(ssd / "Loras"): 2, str(nas / "Archive"): 2})
+
+    def test_cross_device_moves_need_permission(self):
+        root = self.make_tree(["A/m.safetensors", "B/m.sha256"])
+        with mock.patch.object(CLEANER, "_same_device", return_value=False):
+            analysis = CLEANER.analyze_group("m", CLEANER.walk_tree(root))
+        self.assertEqual(analysis["cross_device"], [root / "B" / "m.sha256"])
+        self.assertEqual(CLEANER.plan_group_actions(analysis, move=True), [])
+        self.assertEqual(len(CLEANER.plan_group_actions(analysis, move=True, cross_device=True)), 1)
+
+
+class UsageTests(CleanerTestCase):
+    def test_usage_by_folder_status_and_family(self):
+        root = self.make_tree({
+            "Loras/Style_v1.safetensors": b"1" * 100, "Loras/Style_v2.safetensors": b"2" * 200,
+            "Loras/Style_v10.safetensors": b"3" * 400, "Loras/Style_v1.json": b"j" * 10,
+            "Old/Style_v10.json": b"d" * 20, "Loras/Style_v10.json": b"d" * 20,
+            "Old/gone.preview.png": b"p" * 5, "top.ckpt": b"c" * 1000,
+        })
+        with CLEANER.Cleaner(root) as cleaner:
+            report = cleaner.usage()
+            self.assertEqual(report["total"], 1755)
+            self.assertEqual(report["folders"], {".": 1000, "Loras": 730, "Old": 25})
+            self.assertEqual(report["status"]["orphan"], 5)
+            self.assertEqual(report["status"]["duplicate"], 20)
+            self.assertEqual(report["reclaimable"], 25)
+            self.assertEqual([f["base"] for f in report["families"]], ["Style"])
+
+            # v10 is the latest version, then v2: only v1 (model and sidecar) goes
+            report = cleaner.usage(keep_latest=2)
+            self.assertEqual(report["families"][0]["old_versions"], ["Style_v1"])
+            self.assertEqual(report["status"]["old_version"], 110)
+            self.assertEqual(sorted(Path(a["src"]).name for a in report["actions"]), ["Style_v1.json", "Style_v1.safetensors"])
+            self.assertEqual(report["reclaimable"], 135)
+
+
+class ProfilerTests(CleanerTestCase):
+    def test_phases_are_recorded_and_traced(self):
+        root = self.make_tree(["A/m_v1.safetensors", "B/m_v1.civitai.info", "A/m_v2.safetensors"])
+        profiler = CLEANER.Profiler()
+        CLEANER.set_profiler(profiler)
+        self.addCleanup(CLEANER.set_profiler, None)
+        args = argparse.Namespace(
+            delete_orphan=False, delete_duplicates=False, move=False, confirm_each=False,
+            verbose=False, show_unknown=False, plan_out=None,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            cleaner = CLEANER.Cleaner(root)
+            cleaner.versions()
+            CLEANER.handle_cleanup_mode(cleaner.groups(), args)
+        self.assertEqual([p["name"] for p in profiler.phases], ["scan", "group", "detect_versions", "categorize", "report"])
+        self.assertEqual(profiler.phases[0]["items"], 3)
+        self.assertTrue(all(p["seconds"] >= 0 for p in profiler.phases))
+        self.assertEqual(len(profiler.summary()), 7)
+
+        trace = root.parent / "trace.json"
+        profiler.write_trace(trace)
+        events = json.loads(trace.read_text())["traceEvents"]
+        self.assertEqual({e["ph"] for e in events}, {"X"})
+        self.assertEqual(events[1]["name"], "group")
+
+
+class CleanerApiTests(CleanerTestCase):
+    def test_queries_return_data_without_printing(self):
+        root = self.make_tree([
+            "Loras/Style_v1.safetensors", "Loras/Style_v2.safetensors", "Other/Style_v2.civitai.info",
+            "Other/Style_v3.json", "skip/x.safetensors",
+        ])
+        config = CLEANER.CleanerConfig(ignore_folders=["skip"])
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), CLEANER.Cleaner(root, config=config, index_path=root.parent / "index.db") as cleaner:
+            self.assertEqual(sorted(cleaner.groups()), ["Style_v1", "Style_v2", "Style_v3"])
+            self.assertEqual(cleaner.versions(), {"Style": ["Style_v1", "Style_v2", "Style_v3"]})
+            self.assertIs(cleaner.versions(), cleaner.versions())
+            self.assertEqual(list(cleaner.orphans()), ["Style_v3"])
+            self.assertEqual(cleaner.orphan_matches(), {"Style_v3": "Style"})
+            actions = cleaner.plan(delete_orphan=False)
+            self.assertEqual([(a["op"], a["group"]) for a in actions], [("move", "Style_v2")])
+
+            cleaner.apply(actions)
+            self.assertEqual(cleaner.plan(delete_orphan=False), [])
+            self.assertEqual(cleaner.last_scan["directories"], 3)
+        self.assertEqual(stdout.getvalue(), "")
+
+    def test_records_and_reports_use_the_cleaner_config(self):
+        root = self.make_tree(["Models/a.ckpt2", "Models/a.sha256"])
+        config = CLEANER.CleanerConfig(model_extensions=CLEANER.MODEL_EXTENSIONS | {".ckpt2"})
+        with CLEANER.Cleaner(root, config=config) as cleaner:
+            files = sorted(cleaner.groups()["a"])
+            self.assertEqual([f.name for f in files], ["a.ckpt2", "a.sha256"])
+            self.assertTrue(files[0].path.exists())
+            self.assertEqual(CLEANER.file_record(files[0], cleaner.config)["kind"], "model")
+            self.assertEqual(CLEANER.file_record(files[0])["kind"], "other")
+            record = CLEANER.group_record(cleaner.analyze()[0], [], cleaner.config)
+            self.assertEqual([f["kind"] for f in record["files"]], ["model", "sidecar"])
+            colors = CLEANER.Colors
+            self.assertEqual(CLEANER.highlight_extension("a.ckpt2", cleaner.config), f"a{colors.EXT_MODEL}.ckpt2{colors.ENDC}")
+
+    def test_config_file_is_read_lazily(self):
+        root = self.make_tree(["a.safetensors", "b.json"])
+        config_path = root.parent / "config.json"
+        config_path.write_text(json.dumps({"ignore_groups": ["b"]}))
+        config = CLEANER.load_config(config_path)
+        self.assertEqual(config.source, config_path)
+        self.assertEqual(list(CLEANER.Cleaner(root, config=config).groups()), ["a"])
+
+        config_path.write_text("{not json")
+        self.assertIsNotNone(CLEANER.load_config(config_path).load_error)
+
+
+def safetensors_bytes(tensors: dict, metadata: dict | None = None, truncate: int = 0) -> bytes:
+    header, offset = {}, 0
+    for name, (dtype, shape) in tensors.items():
+        size = 2
+        for dim in shape:
+            size *= dim
+        header[name] = {"dtype": dtype, "shape": shape, "data_offsets": [offset, offset + size]}
+        offset += size
+    if metadata:
+        header["__metadata__"] = metadata
+    raw = json.dumps(header).encode()
+    data = struct.pack("<Q", len(raw)) + raw + b"\0" * offset
+    return data[:len(data) - truncate] if truncate else data
+
+
+class SafetensorsHeaderTests(CleanerTestCase):
+    def test_header_summary_and_architecture(self):
+        root = self.make_tree({
+            "lora.safetensors": safetensors_bytes({
+                "lora_te2_text_model.lora_up.weight": ("F16", [4, 8]),
+                "lora_unet_x.lora_down.weight": ("F16", [8, 4]),
+            }, {"ss_network_dim": "4"}),
+            "flux.safetensors": safetensors_bytes({"double_blocks.0.img_attn.qkv.weight": ("BF16", [3, 3])}),
+        })
+        info = CLEANER.read_safetensors_header(root / "lora.safetensors")
+        self.assertIsNone(info["error"])
+        self.assertEqual((info["tensors"], info["parameters"], info["dtypes"]), (2, 64, {"F16": 2}))
+        self.assertEqual(info["metadata"], {"ss_network_dim": "4"})
+        self.assertEqual(info["architecture"], "SDXL LoRA")
+        self.assertEqual(CLEANER.read_safetensors_header(root / "flux.safetensors")["architecture"], "Flux model")
+
+    def test_truncated_files_are_reported(self):
+        root = self.make_tree({
+            "short.safetensors": safetensors_bytes({"w": ("F16", [16])}, truncate=4),
+            "garbage.safetensors": b"\xff" * 64,
+        })
+        self.assertIn("truncated", CLEANER.read_safetensors_header(root / "short.safetensors")["error"])
+        self.assertIn("header", CLEANER.read_safetensors_header(root / "garbage.safetensors")["error"])
+
+    def test_summary_is_cached_in_index(self):
+        root = self.make_tree({"m.safetensors": safetensors_bytes({"w": ("F32", [2])})})
+        index = self.open_index()
+        first = CLEANER.inspect_model(root / "m.safetensors", index=index)
+        self.assertEqual(index.get_header(os.stat(root / "m.safetensors")), first)
+        self.assertIsNone(CLEANER.inspect_model(root / "m.ckpt", index=index))
+
+
+GENERATOR_PATH = Path(__file__).resolve().parents[1] / "benchmarks" / "generate_library.py"
+GENERATOR_SPEC = importlib.util.spec_from_file_location("generate_library", GENERATOR_PATH)
+assert GENERATOR_SPEC and GENERATOR_SPEC.loader
+GENERATOR = importlib.util.module_from_spec(GENERATOR_SPEC)
+GENERATOR_SPEC.loader.exec_module(GENERATOR)
+
+
+class GenerateLibraryTests(unittest.TestCase):
+    def test_manifest_matches_what_the_cleaner_finds(self):
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        root = Path(temporary.name) / "models"
+        manifest = GENERATOR.generate_library(root, models=60, orphans=7, duplicates=4, misplaced=3, files_per_dir=20, model_size=1024)
+        self.assertEqual(sum(1 for path in root.rglob("*") if path.is_file()), manifest["files"])
+
+        config = CLEANER.CleanerConfig(ignore_folders=manifest["ignored_folders"])
+        cleaner = CLEANER.Cleaner(root, config=config)
+        self.assertEqual(cleaner.scan(), manifest["files"] - len(manifest["ignored_folders"]) * 10)
+        self.assertEqual(len(cleaner.orphans()), manifest["orphans"])
+        self.assertEqual(len(cleaner.versions()), manifest["families"])
+        self.assertFalse(any(stem.startswith("ignored") for stem in cleaner.groups()))
+        self.assertEqual((root / "Loras" / "folder00000" / "model000000_v1.safetensors").stat().st_size, 1024)
+
+
+if __name__ == "__main__":
+    unittest.main()
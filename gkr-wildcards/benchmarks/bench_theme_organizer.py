@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""Time theme extraction on PNGs embedding the combined workflow: targeted node lookup vs full JSON parse."""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "theme_organizer.py"
+SPEC = importlib.util.spec_from_file_location("theme_organizer", MODULE_PATH)
+assert SPEC and SPEC.loader
+ORGANIZER = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = ORGANIZER
+SPEC.loader.exec_module(ORGANIZER)
+
+DEFAULT_WORKFLOW = Path(__file__).resolve().parents[2] / "ComfyUI-Workflows" / "gkr_combined_v9.1.json"
+THEME_TEXT = "ruined cathedral at dusk, __gkr_gothic/subject__, __gkr_gothic/lighting__"
+
+
+def full_parse_theme(info: dict, target_node: str = "672", ignored_keys: tuple = ("lastAccepted",)) -> str | None:
+    """The previous lookup: json.loads of the prompt and of the whole workflow, linear scan of its nodes."""
+    if "prompt" in info:
+        inputs = json.loads(info["prompt"]).get(target_node, {}).get("inputs", {})
+        for key, val in inputs.items():
+            if key not in ignored_keys and isinstance(val, str):
+                match = ORGANIZER.THEME_PATTERN.search(val)
+                if match:
+                    return match.group(1)
+    if "workflow" in info:
+        for node in json.loads(info["workflow"]).get("nodes", []):
+            if str(node.get("id")) == target_node:
+                for item in node.get("widgets_values", []):
+                    if isinstance(item, str):
+                        match = ORGANIZER.THEME_PATTERN.search(item)
+                        if match:
+                            return match.group(1)
+    return None
+
+
+def api_prompt(workflow: dict, target_node: str, theme_in_prompt: bool) -> dict:
+    """Approximates the API-format prompt ComfyUI saves next to the workflow (one entry per node)."""
+    prompt = {}
+    nodes = list(workflow["nodes"])
+    for subgraph in workflow.get("definitions", {}).get("subgraphs", []):
+        nodes.extend(dict(node, id=f"{subgraph['id'][:8]}:{node['id']}") for node in subgraph.get("nodes", []))
+    for node in nodes:
+        widgets = node.get("widgets_values")
+        values = widgets if isinstance(widgets, list) else []
+        prompt[str(node["id"])] = {
+            "class_type": node.get("type"),
+            "inputs": {f"input_{n}": value for n, value in enumerate(values) if not isinstance(value, dict)},
+            "_meta": {"title": node.get("title", node.get("type"))},
+        }
+    # The LoRA Manager text node either holds the text or receives it through a link
+    prompt[target_node]["inputs"] = {"text": THEME_TEXT if theme_in_prompt else ["1234", 0]}
+    return prompt
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def save_png(path: Path, texts: dict[str, str], width: int = 64, height: int = 64) -> None:
+    """Writes a grey PNG with tEXt chunks before the image data, as ComfyUI's SaveImage does."""
+    rows = b"".join(b"\0" + b"\x80" * (width * 3) for _ in range(height))
+    with open(path, "wb") as f:
+        f.write(ORGANIZER.PNG_SIGNATURE)
+        f.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        for key, value in texts.items():
+            f.write(png_chunk(b"tEXt", key.encode("latin-1") + b"\0" + value.encode("latin-1")))
+        f.write(png_chunk(b"IDAT", zlib.compress(rows)))
+        f.write(png_chunk(b"IEND", b""))
+
+
+def best_of(repeat: int, function, *args) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workflow", type=Path, default=DEFAULT_WORKFLOW, help="Workflow JSON embedded in the images (default: gkr_combined_v9.1.json)")
+    parser.add_argument("--node", default="672", help="Target node id (default: 672)")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement, the best is kept (default: 20)")
+    args = parser.parse_args()
+
+    workflow = json.loads(args.workflow.read_text(encoding="utf-8"))
+    for node in workflow["nodes"]:
+        if str(node.get("id")) == args.node:
+            node["widgets_values"] = [{"version": 1, "lastAccepted": {"insertedText": "__gkr_ignored/x__"}}, THEME_TEXT]
+            break
+    else:
+        print(f"Node {args.node} is not in {args.workflow.name}")
+        return 1
+    # Browsers serialize the workflow without spaces
+    workflow_text = json.dumps(workflow, separators=(",", ":"))
+
+    print(f"Workflow {args.workflow.name}: {len(workflow_text) / 1e6:.2f} MB, {len(workflow['nodes'])} top-level nodes")
+    print(f"{'theme found in':<16} {'read':>9} {'full parse':>11} {'targeted':>9} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as temporary:
+        for label, theme_in_prompt in (("prompt", True), ("workflow", False)):
+            prompt_text = json.dumps(api_prompt(workflow, args.node, theme_in_prompt))
+            path = Path(temporary) / f"{label}.png"
+            save_png(path, {"prompt": prompt_text, "workflow": workflow_text})
+
+            info, _ = ORGANIZER.read_metadata(path)
+            assert full_parse_theme(info, args.node) == ORGANIZER.theme_from_info(info, args.node) == "gothic"
+            read = best_of(args.repeat, ORGANIZER.read_metadata, path)
+            full = best_of(args.repeat, full_parse_theme, info, args.node)
+            targeted = best_of(args.repeat, ORGANIZER.theme_from_info, info, args.node)
+            print(f"{label:<16} {read * 1e3:>7.2f}ms {full * 1e3:>9.2f}ms {targeted * 1e3:>7.2f}ms {full / targeted:>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
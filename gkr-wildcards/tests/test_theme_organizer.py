@@ -0,0 +1,374 @@
+from __future__ import annotations
+
+import contextlib
+import importlib.util
+import io
+import json
+import random
+import sqlite3
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+
+MODULE_PATH = Path(__file__).resolve().parents[1] / "theme_organizer.py"
+SPEC = importlib.util.spec_from_file_location("theme_organizer", MODULE_PATH)
+assert SPEC and SPEC.loader
+ORGANIZER = importlib.util.module_from_spec(SPEC)
+sys.modules[SPEC.name] = ORGANIZER
+SPEC.loader.exec_module(ORGANIZER)
+
+
+def prompt_text(theme: str, node: str = "672") -> str:
+    return json.dumps({node: {"inputs": {"text": f"portrait, __gkr_{theme}/subject__", "lastAccepted": "__gkr_ignored/x__"}}})
+
+
+class ThemeOrganizerTestCase(unittest.TestCase):
+    def make_dir(self) -> Path:
+        temporary = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary.cleanup)
+        return Path(temporary.name)
+
+    def save_png(self, path: Path, **chunks: str) -> Path:
+        info = PngInfo()
+        for key, value in chunks.items():
+            info.add_text(key, value)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        Image.new("RGB", (8, 8)).save(path, pnginfo=info)
+        return path
+
+
+class ExtractThemeTests(ThemeOrganizerTestCase):
+    def test_prompt_node_then_workflow_widgets(self):
+        root = self.make_dir()
+        workflow = json.dumps({"nodes": [{"id": 672, "widgets_values": [{"lastAccepted": "__gkr_ignored/x__"}, "__gkr_anime/pose__"]}]})
+        self.assertEqual(ORGANIZER.extract_theme(self.save_png(root / "p.png", prompt=prompt_text("gothic"))), "gothic")
+        self.assertEqual(ORGANIZER.extract_theme(self.save_png(root / "w.png", workflow=workflow)), "anime")
+        self.assertIsNone(ORGANIZER.extract_theme(self.save_png(root / "n.png", prompt=prompt_text("gothic", node="1"))))
+
+
+class NodeLookupTests(unittest.TestCase):
+    def test_target_node_is_parsed_alone(self):
+        workflow = json.dumps({
+            "nodes": [{"id": 1, "widgets_values": ['{"id": 672, "text": "quoted"}']},
+                      {"id": 672, "widgets_values": ["__gkr_gothic/subject__"]}],
+            "definitions": {"subgraphs": [{"nodes": [{"id": 672, "widgets_values": ["__gkr_anime/x__"]}]}]},
+        }, separators=(",", ":"))
+        prompt = json.dumps({"1": {"inputs": {"text": 'say "672": {"inputs": {}}'}}, "672": {"inputs": {"text": "__gkr_scifi/x__"}}})
+        with mock.patch.object(ORGANIZER.json, "loads", side_effect=AssertionError("full parse")):
+            self.assertEqual(ORGANIZER.find_workflow_node(workflow, "672")["widgets_values"], ["__gkr_gothic/subject__"])
+            self.assertEqual(ORGANIZER.find_prompt_node(prompt, "672"), {"inputs": {"text": "__gkr_scifi/x__"}})
+            self.assertEqual(ORGANIZER.theme_from_info({"prompt": prompt, "workflow": workflow}), "scifi")
+
+    def test_full_parse_fallback(self):
+        # "id" is not the first key, and the subgraph copy must not be used
+        workflow = json.dumps({
+            "nodes": [{"type": "Text", "id": 672, "widgets_values": ["__gkr_japan/x__"]}],
+            "definitions": {"subgraphs": [{"nodes": [{"id": 672, "widgets_values": ["__gkr_anime/x__"]}]}]},
+        })
+        self.assertEqual(ORGANIZER.theme_from_info({"workflow": workflow}), "japan")
+        self.assertIsNone(ORGANIZER.find_workflow_node(json.dumps({"nodes": [{"id": 6720}]}), "672"))
+        self.assertIsNone(ORGANIZER.find_prompt_node(json.dumps({"67": {"inputs": {}}}), "672"))
+
+
+class ReadMetadataTests(ThemeOrganizerTestCase):
+    def test_png_text_chunks_match_pillow(self):
+        path = self.make_dir() / "chunks.png"
+        info = PngInfo()
+        info.add_text("prompt", prompt_text("gothic"))
+        info.add_text("workflow", json.dumps({"nodes": []}) + " " * 100_000, zip=True)
+        info.add_itxt("parameters", "caf\u00e9 __gkr_anime/x__", zip=True)
+        info.add_itxt("note", "plain")
+        Image.new("RGB", (30, 20)).save(path, pnginfo=info)
+        with Image.open(path) as image:
+            expected = dict(image.info)
+        metadata, size = ORGANIZER.read_metadata(path, keys=None)
+        self.assertEqual(metadata, {key: value for key, value in expected.items() if isinstance(value, str)})
+        self.assertEqual(size, (30, 20))
+        # Compressed chunks of other keys are not inflated
+        self.assertEqual(set(ORGANIZER.read_metadata(path)[0]), {"prompt", "workflow", "note"})
+
+    def test_webp_and_jpeg_exif(self):
+        root = self.make_dir()
+        exif = Image.Exif()
+        # As written by ComfyUI's WebP saver
+        exif[0x0110] = "prompt:" + prompt_text("scifi")
+        exif[0x010F] = "workflow:{}"
+        Image.new("RGB", (33, 21)).save(root / "comfy.webp", exif=exif, lossless=True)
+        metadata, size = ORGANIZER.read_metadata(root / "comfy.webp")
+        self.assertEqual((metadata["workflow"], size), ("{}", (33, 21)))
+        self.assertEqual(ORGANIZER.extract_theme(root / "comfy.webp"), "scifi")
+
+        exif = Image.Exif()
+        exif.get_ifd(0x8769)[0x9286] = b"UNICODE\0" + "steps: 30, __gkr_japan/scene__".encode("utf-16-be")
+        Image.new("RGB", (35, 23)).save(root / "saver.jpg", exif=exif.tobytes(), comment="made with __gkr_comics/x__")
+        metadata, size = ORGANIZER.read_metadata(root / "saver.jpg")
+        self.assertEqual(metadata, {"UserComment": "steps: 30, __gkr_japan/scene__", "comment": "made with __gkr_comics/x__"})
+        self.assertEqual(size, (35, 23))
+
+        data = (root / "saver.jpg").read_bytes()
+        sof = data.index(b"\xff\xc0")
+        for cut in (4, sof + 2, sof + 6):
+            with self.subTest(cut=cut):
+                (root / "truncated.jpg").write_bytes(data[:cut])
+                with self.assertRaisesRegex(ValueError, "truncated JPEG"):
+                    ORGANIZER.read_metadata(root / "truncated.jpg")
+
+        (root / "other.gif").write_bytes(b"GIF89a" + b"\0" * 20)
+        with self.assertRaises(ValueError):
+            ORGANIZER.read_metadata(root / "other.gif")
+
+
+class IterImagesTests(ThemeOrganizerTestCase):
+    def test_directories_are_walked_and_theme_folders_skipped(self):
+        root = self.make_dir()
+        for relative in ("b.png", "a.JPG", "notes.txt", "day1/c.webp", "day1/deep/d.png", "gothic/e.png", "mine/f.png"):
+            path = root / relative
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(b"")
+        loose = root / "notes.txt"
+
+        def names(*args, **kwargs) -> list[str]:
+            return [path.relative_to(root).as_posix() for path in ORGANIZER.iter_images(*args, **kwargs)]
+
+        self.assertEqual(names([root]), ["a.JPG", "b.png"])
+        skip = ORGANIZER.known_themes() | {"mine"}
+        self.assertIn("gothic", skip)
+        self.assertEqual(names([root, loose], recursive=True, skip_dirs=skip),
+                         ["a.JPG", "b.png", "day1/c.webp", "day1/deep/d.png", "notes.txt"])
+        self.assertEqual(names([root], recursive=True, extensions=["png"]),
+                         ["b.png", "day1/deep/d.png", "gothic/e.png", "mine/f.png"])
+
+
+class ExtractThemesTests(ThemeOrganizerTestCase):
+    def test_pool_matches_sequential_and_cache_skips_parsing(self):
+        root = self.make_dir()
+        images = [self.save_png(root / f"img{i:02d}.png", prompt=prompt_text(("gothic", "anime")[i % 2])) for i in range(12)]
+        images.append(root / "broken.png")
+        images[-1].write_bytes(b"not an image")
+
+        sequential = sorted(ORGANIZER.extract_themes(images, "672"))
+        self.assertEqual(sorted(ORGANIZER.extract_themes(images, "672", jobs=2)), sequential)
+        results = {path: (theme, error) for path, theme, error in sequential}
+        self.assertEqual(results[images[1]], ("anime", None))
+        self.assertIsNotNone(results[images[-1]][1])
+
+        cache = ORGANIZER.ThemeCache(root / "cache.db")
+        self.addCleanup(cache.close)
+        first = sorted(ORGANIZER.extract_themes(images, "672", cache=cache))
+        self.assertEqual(first, sequential)
+        with mock.patch.object(ORGANIZER, "extract_job", wraps=ORGANIZER.extract_job) as job:
+            second = sorted(ORGANIZER.extract_themes(images, "672", cache=cache))
+        self.assertEqual(second, sequential)
+        # Only the unreadable image is tried again
+        self.assertEqual([call.args[0] for call in job.call_args_list], [images[-1]])
+
+        self.save_png(images[0], prompt=prompt_text("scifi"))
+        self.assertEqual(dict((p, t) for p, t, _ in ORGANIZER.extract_themes(images[:1], "672", cache=cache)), {images[0]: "scifi"})
+
+
+
+def comfy_prompt(theme: str, seed: int, lora: str) -> str:
+    return json.dumps({
+        "3": {"class_type": "KSampler", "inputs": {"seed": seed, "steps": 30, "cfg": 4.5, "sampler_name": "euler", "scheduler": "karras", "model": ["10", 0]}},
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "SDXL/juggernautXL_v9.safetensors"}},
+        "10": {"class_type": "Lora Loader (LoraManager)", "inputs": {"loras": {"__value__": [
+            {"name": lora, "strength": 0.8, "active": True}, {"name": "disabled", "active": False}]}}},
+        "20": {"class_type": "ImpactWildcardProcessor", "inputs": {"seed": 1, "wildcard_text": "x"}},
+        "672": {"class_type": "Text (LoraManager)", "inputs": {
+            "text": f"ruined cathedral, __gkr_{theme}/subject__, __gkr_{theme}/lighting__ <lora:detailer:0.5>",
+            "lastAccepted": "__gkr_ignored/x__"}},
+    })
+
+
+class MetadataIndexTests(ThemeOrganizerTestCase):
+    def test_generation_info_from_prompt_and_parameters(self):
+        record = ORGANIZER.generation_info({"prompt": comfy_prompt("gothic", 42, "Inkpunk")}, (832, 1216))
+        self.assertEqual(record["theme"], "gothic")
+        self.assertEqual(record["wildcards"], ["gothic/subject", "gothic/lighting"])
+        self.assertEqual(record["checkpoints"], ["SDXL/juggernautXL_v9.safetensors"])
+        self.assertEqual(sorted(record["loras"]), ["Inkpunk", "detailer"])
+        self.assertEqual((record["seed"], record["steps"], record["cfg"], record["sampler"], record["scheduler"]), (42, 30, 4.5, "euler", "karras"))
+        self.assertEqual((record["width"], record["height"]), (832, 1216))
+        self.assertIn("ruined cathedral", record["text"])
+
+        parameters = "a knight, __gkr_ttrpg/class__\nNegative prompt: blurry\nSteps: 25, Sampler: DPM++ 2M, CFG scale: 6, Seed: 7, Model: ponyV6"
+        record = ORGANIZER.generation_info({"parameters": parameters})
+        self.assertEqual((record["theme"], record["seed"], record["steps"], record["cfg"]), ("ttrpg", 7, 25, 6.0))
+        self.assertEqual((record["sampler"], record["checkpoints"], record["wildcards"]), ("DPM++ 2M", ["ponyV6"], ["ttrpg/class"]))
+        self.assertNotIn("blurry", record["text"])
+
+    def test_index_is_incremental_and_searchable(self):
+        root = self.make_dir()
+        for i, (theme, lora) in enumerate((("gothic", "Inkpunk"), ("gothic", "other"), ("anime", "Inkpunk"))):
+            self.save_png(root / "out" / f"img{i}.png", prompt=comfy_prompt(theme, i, lora))
+        cache = ORGANIZER.ThemeCache(root / "cache.db")
+        self.addCleanup(cache.close)
+        images = list(ORGANIZER.iter_images([root / "out"]))
+
+        statuses = [status for _, status, _ in ORGANIZER.build_index(images, cache, "672", jobs=2)]
+        self.assertEqual(statuses, ["indexed"] * 3)
+        self.assertEqual([status for _, status, _ in ORGANIZER.build_index(images, cache, "672")], ["unchanged"] * 3)
+
+        paths = lambda results: [Path(result["path"]).name for result in results]
+        self.assertEqual(paths(cache.search(theme="gothic", lora="inkpunk")), ["img0.png"])
+        self.assertEqual(paths(cache.search("cathedral", checkpoint="juggernautXL_v9")), ["img0.png", "img1.png", "img2.png"])
+        self.assertEqual(paths(cache.search(wildcard="__gkr_anime/lighting__")), ["img2.png"])
+        self.assertEqual(cache.search(theme="anime")[0]["loras"], ["Inkpunk", "detailer"])
+
+        # A rewritten image is indexed again, a deleted one is pruned
+        self.save_png(images[1], prompt=comfy_prompt("scifi", 1, "other"))
+        images[2].unlink()
+        statuses = {path.name: status for path, status, _ in ORGANIZER.build_index(images[:2], cache, "672")}
+        self.assertEqual(statuses, {"img0.png": "unchanged", "img1.png": "indexed"})
+        self.assertEqual(cache.prune_records(root / "out", {cache.key(path) for path in images[:2]}), 1)
+        self.assertEqual(paths(cache.search("gothic")), ["img0.png"])
+        self.assertEqual(paths(cache.search(lora="other")), ["img1.png"])
+
+
+
+    def test_index_works_without_fts5(self):
+        class NoFts5(sqlite3.Connection):
+            def execute(self, sql, *args):
+                if "USING fts5" in sql:
+                    raise sqlite3.OperationalError("no such module: fts5")
+                return super().execute(sql, *args)
+
+        root = self.make_dir()
+        image = self.save_png(root / "out" / "img.png", prompt=comfy_prompt("gothic", 1, "Inkpunk"))
+        connect = sqlite3.connect
+        with mock.patch.object(ORGANIZER.sqlite3, "connect", lambda path: connect(path, factory=NoFts5)):
+            cache = ORGANIZER.ThemeCache(root / "cache.db")
+        self.assertFalse(cache.fts)
+        self.assertEqual([status for _, status, _ in ORGANIZER.build_index([image], cache, "672")], ["indexed"])
+        self.assertEqual(len(cache.search(theme="gothic", lora="inkpunk")), 1)
+        with self.assertRaisesRegex(sqlite3.OperationalError, "FTS5"):
+            cache.search("cathedral")
+        cache.close()
+
+        # With FTS5 available again the index is rebuilt, so text searches see every image
+        cache = ORGANIZER.ThemeCache(root / "cache.db")
+        self.addCleanup(cache.close)
+        self.assertTrue(cache.fts)
+        self.assertEqual([status for _, status, _ in ORGANIZER.build_index([image], cache, "672")], ["indexed"])
+        self.assertEqual(len(cache.search("cathedral")), 1)
+
+
+class DedupeTests(ThemeOrganizerTestCase):
+    def save_render(self, path: Path, seed: int, brightness: int = 0, size: tuple[int, int] = (640, 512)) -> Path:
+        rng = random.Random(seed)
+        image = Image.new("RGB", (16, 16))
+        image.putdata([tuple(min(255, rng.randrange(200) + brightness) for _ in range(3)) for _ in range(256)])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        image.resize(size, Image.Resampling.BICUBIC).save(path, quality=90)
+        return path
+
+    def test_bk_tree_matches_brute_force(self):
+        rng = random.Random(1)
+        values = [rng.getrandbits(64) for _ in range(300)]
+        values += [value ^ (1 << rng.randrange(64)) for value in values[:50]]
+        tree = ORGANIZER.BKTree()
+        for n, value in enumerate(values):
+            tree.add(value, n)
+        for query in values[:40]:
+            expected = sorted((bin(query ^ value).count("1"), n) for n, value in enumerate(values) if bin(query ^ value).count("1") <= 6)
+            self.assertEqual(sorted(tree.search(query, 6)), expected)
+
+    def test_near_duplicates_are_clustered_per_folder_and_moved(self):
+        root = self.make_dir()
+        original = self.save_render(root / "gothic" / "a.png", seed=1)
+        brighter = self.save_render(root / "gothic" / "b.jpg", seed=1, brightness=3, size=(1280, 1024))
+        other = self.save_render(root / "gothic" / "c.png", seed=2)
+        elsewhere = self.save_render(root / "anime" / "d.png", seed=1)
+        self.assertLessEqual((ORGANIZER.dhash(original) ^ ORGANIZER.dhash(brighter)).bit_count(), 2)
+
+        cache = ORGANIZER.ThemeCache(root / "cache.db")
+        self.addCleanup(cache.close)
+        images = list(ORGANIZER.iter_images([root], recursive=True))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            counts = ORGANIZER.dedupe(images, move=False, jobs=2, cache=cache)
+        self.assertEqual((counts["images"], counts["clusters"], counts["duplicates"]), (4, 1, 1))
+        self.assertIn("[DUPLICATE] b.jpg", output.getvalue())
+
+        with mock.patch.object(ORGANIZER, "dhash_job", side_effect=AssertionError("hashed again")), contextlib.redirect_stdout(io.StringIO()):
+            counts = ORGANIZER.dedupe(images, move=True, cache=cache)
+        self.assertEqual(counts["duplicates"], 1)
+        self.assertTrue((root / "gothic" / "duplicates" / "b.jpg").exists())
+        self.assertTrue(original.exists() and other.exists() and elsewhere.exists())
+        self.assertEqual(list(ORGANIZER.iter_images([root], recursive=True, skip_dirs={"duplicates"})), [elsewhere, original, other])
+
+
+class MoveImagesTests(ThemeOrganizerTestCase):
+    def test_interrupted_run_resumes_and_undo_restores(self):
+        root = self.make_dir()
+        journal = root / "moves.journal"
+        images = [self.save_png(root / f"{n}.png", prompt=prompt_text("gothic" if n % 2 else "anime")) for n in range(6)]
+        cache = ORGANIZER.ThemeCache(root / "cache.db")
+        self.addCleanup(cache.close)
+        themes = {path: theme for path, theme, _ in ORGANIZER.extract_themes(images, "672", cache=cache)}
+        moves = [(path, ORGANIZER.place_image(path, theme, move=True)) for path, theme in themes.items()]
+
+        # The third rename fails as a crash would: the first two are journaled, nothing else moved
+        rename = ORGANIZER.os.rename
+        calls = []
+
+        def crashing_rename(src, dest):
+            calls.append(src)
+            if len(calls) == 3:
+                raise KeyboardInterrupt
+            rename(src, dest)
+
+        with mock.patch.object(ORGANIZER.os, "rename", crashing_rename), contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(KeyboardInterrupt):
+                ORGANIZER.move_images(moves, journal, cache=cache)
+        self.assertEqual([entry["src"] for entry in ORGANIZER.read_journal(journal)], [str(images[0]), str(images[1])])
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = ORGANIZER.move_images(moves, journal, cache=cache)
+        self.assertEqual((counts["moved"], counts["skipped"]), (4, 2))
+        self.assertEqual(sorted(path.name for path in (root / "gothic").iterdir()), ["1.png", "3.png", "5.png"])
+        self.assertEqual(cache.themes(), {"anime", "gothic"})
+
+        # --undo reverts the last run only, then the one before it
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = ORGANIZER.undo_moves(journal, cache=cache)
+        self.assertEqual(counts["restored"], 4)
+        self.assertEqual([path.exists() for path in images], [False, False, True, True, True, True])
+        self.assertEqual(len(ORGANIZER.read_journal(journal)), 2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            ORGANIZER.undo_moves(journal, cache=cache)
+        self.assertTrue(all(path.exists() for path in images))
+        self.assertEqual(sorted(path.name for path in root.iterdir() if path.is_dir()), [])
+        self.assertEqual(ORGANIZER.read_journal(journal), [])
+
+    def test_existing_destination_is_not_overwritten(self):
+        root = self.make_dir()
+        image = self.save_png(root / "a.png", prompt=prompt_text("gothic"))
+        taken = self.save_png(root / "gothic" / "a.png", prompt=prompt_text("other"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = ORGANIZER.move_images([(image, taken)], root / "moves.journal")
+        self.assertEqual(counts["exists"], 1)
+        self.assertTrue(image.exists())
+        self.assertEqual(ORGANIZER.read_journal(root / "moves.journal"), [])
+
+    def test_lock_blocks_a_second_run_and_stale_locks_are_taken_over(self):
+        root = self.make_dir()
+        with ORGANIZER.RunLock(root / "moves.lock"):
+            with self.assertRaises(RuntimeError):
+                ORGANIZER.RunLock(root / "moves.lock").acquire()
+        self.assertFalse((root / "moves.lock").exists())
+
+        (root / "moves.lock").write_text("999999999")
+        with mock.patch.object(ORGANIZER, "_pid_alive", return_value=False):
+            with ORGANIZER.RunLock(root / "moves.lock"):
+                self.assertEqual((root / "moves.lock").read_text(), str(ORGANIZER.os.getpid()))
+
+
+if __name__ == "__main__":
+    unittest.main()
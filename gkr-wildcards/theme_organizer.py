@@ -1,101 +1,1250 @@
 #!/usr/bin/env python3
 
-# run with: uv run --with pillow theme_organizer.py -h
+# run with: uv run theme_organizer.py -h
 # Designed to work with Lora Manager prompt, must know the node ID to check first (default: 672). It will extract the theme from the image metadata and organize images into theme folders.
+# PNG text chunks and WebP/JPEG EXIF metadata are read directly (no image decoding, no dependency).
+# Extracted themes are cached in theme_organizer.db (keyed by path, size and mtime): re-runs only read new images.
+# --build-index stores each image's theme, wildcards, checkpoint, LoRAs, seed, sampler and size in the same
+# database (with full-text search); --search / --theme / --lora / --checkpoint / --wildcard then query it.
+# Only the target node is parsed out of the (multi-MB) workflow when it can be located, see benchmarks/bench_theme_organizer.py.
+# Directories can be given instead of files (-r to walk subdirectories; theme folders made by --move are skipped).
+# --dedupe finds near-duplicate renders within each folder (run with: uv run --with pillow theme_organizer.py --dedupe -r DIR).
+# With --move, themes are extracted first and the planned moves applied afterwards, each one appended to theme_organizer.journal:
+# an interrupted run is resumed by running it again, --undo moves the last run's images back. A lock file prevents concurrent runs.
 
 import argparse
+import contextlib
+import errno
 import json
+import os
 import re
 import shutil
+import sqlite3
+import struct
 import sys
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from PIL import Image
+from typing import BinaryIO, Callable, Iterable, Iterator
 
 THEME_PATTERN = re.compile(r"__gkr_([^/]+)/.*?__")
+DEFAULT_CACHE_PATH = Path(__file__).parent / "theme_organizer.db"
+# Moves done by --move, appended as they happen (--undo reverts the last run)
+DEFAULT_JOURNAL_PATH = Path(__file__).parent / "theme_organizer.journal"
+# Images queued per worker process: keeps every worker busy without queueing the whole input
+JOBS_QUEUE_FACTOR = 4
+CACHE_COMMIT_EVERY = 500
+IMAGE_EXTENSIONS = (".png", ".webp", ".jpg", ".jpeg")
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+METADATA_KEYS = ("prompt", "workflow")
+# Compressed text chunks larger than this once inflated are treated as corrupt (as Pillow does)
+MAX_TEXT_SIZE = 64 * 1024 * 1024
+# EXIF string tags searched for metadata: ComfyUI's WebP saver writes "prompt:{...}" in Model
+# and "workflow:{...}" in Make, other savers use ImageDescription or UserComment
+EXIF_TEXT_TAGS = {0x010E: "ImageDescription", 0x010F: "Make", 0x0110: "Model", 0x9286: "UserComment"}
+EXIF_IFD_POINTER = 0x8769
+EXIF_KEY_VALUE = re.compile(r"^([A-Za-z_]+):\s*(?=[{\[])")
 
-def extract_theme(
-    image_path: Path, 
-    target_node: str = "672", 
+# Generation metadata index (--build-index / --search)
+WILDCARD_PATTERN = re.compile(r"__gkr_([^/\s]+)/([^\s]+?)__")
+LORA_TAG_PATTERN = re.compile(r"<lora:([^:>]+)")
+CHECKPOINT_INPUTS = ("ckpt_name", "unet_name")
+# A1111-style "parameters" text (Image Saver nodes): "Steps: 30, Sampler: euler, ..., Seed: 42, Model: name"
+PARAMETER_PATTERN = re.compile(r"(?:^|,\s*)(Steps|Sampler|Schedule type|CFG scale|Seed|Model):\s*([^,\n]+)", re.M)
+MAX_INDEXED_TEXT = 20_000
+
+# Near-duplicate detection (--dedupe): 64-bit dHash, images within DEDUPE_THRESHOLD differing bits are duplicates
+HASH_SIZE = 8
+DEDUPE_THRESHOLD = 5
+DUPLICATES_FOLDER = "duplicates"
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+@lru_cache(maxsize=None)
+def _node_patterns(target_node: str) -> tuple[re.Pattern, re.Pattern]:
+    """Raw-text patterns of a node: its key in an API prompt, the start of its object in a workflow."""
+    node = re.escape(target_node)
+    return (
+        re.compile(r'(?<!\\)"%s"\s*:\s*\{' % node),
+        re.compile(r'\{\s*"id"\s*:\s*"?%s"?\s*[,}]' % node),
+    )
+
+
+def _decode_object(text: str, index: int) -> dict | None:
+    """Parses only the JSON object starting at text[index], or returns None."""
+    try:
+        value, _ = _JSON_DECODER.raw_decode(text, index)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def find_prompt_node(prompt_text: str, target_node: str) -> dict | None:
+    """
+    Returns the target node of an API-format prompt ({"<id>": {"inputs": ...}}). The node is
+    located with a raw text search and only its object is parsed; the whole prompt is parsed
+    only when that fails. Raises json.JSONDecodeError for an invalid prompt.
+    """
+    match = _node_patterns(target_node)[0].search(prompt_text)
+    if match:
+        node = _decode_object(prompt_text, match.end() - 1)
+        if node is not None:
+            return node
+    prompt_json = json.loads(prompt_text)
+    return prompt_json.get(target_node)
+
+
+def find_workflow_node(workflow_text: str, target_node: str) -> dict | None:
+    """
+    Returns the target node of a workflow's top-level "nodes" list. ComfyUI writes "id" first
+    in each node, so the node is located with a raw search for '{"id": <node>' between "nodes"
+    and the subgraph "definitions", and only that object is parsed. The whole workflow (several
+    MB for large workflows) is parsed only when that fails.
+    """
+    start = workflow_text.find('"nodes"')
+    if start != -1:
+        end = workflow_text.find('"definitions"', start)
+        match = _node_patterns(target_node)[1].search(workflow_text, start, end if end != -1 else len(workflow_text))
+        if match:
+            node = _decode_object(workflow_text, match.start())
+            if node is not None and str(node.get("id")) == target_node:
+                return node
+    workflow_json = json.loads(workflow_text)
+    for node in workflow_json.get("nodes", []):
+        if str(node.get("id")) == target_node:
+            return node
+    return None
+
+
+def theme_from_info(
+    info: dict,
+    target_node: str = "672",
     ignored_keys: tuple = ("lastAccepted",)
 ) -> str | None:
-    """Extracts the theme string from the image metadata, avoiding ignored keys like lastAccepted."""
+    """Extracts the theme string from image metadata (PIL's img.info), avoiding ignored keys like lastAccepted."""
+    # 1. Inspect the executed prompt inputs for the specific node
+    if "prompt" in info:
+        try:
+            node_data = find_prompt_node(info["prompt"], target_node) or {}
+            inputs = node_data.get("inputs", {})
+
+            # Check all input keys except ignored ones (like 'lastAccepted')
+            for key, val in inputs.items():
+                if key not in ignored_keys and isinstance(val, str):
+                    match = THEME_PATTERN.search(val)
+                    if match:
+                        return match.group(1)
+        except json.JSONDecodeError:
+            pass
+
+    # 2. Inspect workflow node widgets (skipping 'lastAccepted')
+    if "workflow" in info:
+        try:
+            node = find_workflow_node(info["workflow"], target_node)
+            if node is not None:
+                # Check widgets_values (often a list of values)
+                widgets = node.get("widgets_values", [])
+                if isinstance(widgets, list):
+                    for item in widgets:
+                        if isinstance(item, str):
+                            match = THEME_PATTERN.search(item)
+                            if match:
+                                return match.group(1)
+        except json.JSONDecodeError:
+            pass
+
+    # 3. Fallback: Search remaining metadata strings
+    for key, value in info.items():
+        if key not in ("prompt", "workflow") and isinstance(value, str):
+            match = THEME_PATTERN.search(value)
+            if match:
+                return match.group(1)
+
+    return None
+
+
+def _inflate(data: bytes) -> bytes:
+    inflater = zlib.decompressobj()
+    text = inflater.decompress(data, MAX_TEXT_SIZE)
+    if inflater.unconsumed_tail:
+        raise ValueError("compressed text chunk too large")
+    return text
+
+
+def read_png_metadata(f: BinaryIO, keys: Iterable[str] | None = METADATA_KEYS) -> tuple[dict, tuple[int, int] | None]:
+    """
+    Walks the chunks of a PNG (after its signature) up to the first IDAT and returns
+    ({key: text}, (width, height)). Uncompressed text chunks are always decoded, compressed
+    zTXt / iTXt chunks only when their key is in `keys` (all of them when keys is None).
+    """
+    keys = None if keys is None else set(keys)
+    info = {}
+    size = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type == b"IHDR":
+            data = f.read(length)
+            size = struct.unpack(">II", data[:8])
+        elif chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+            data = f.read(length)
+            key, _, rest = data.partition(b"\0")
+            key = key.decode("latin-1")
+            if chunk_type == b"tEXt":
+                info[key] = rest.decode("latin-1", "replace")
+            elif chunk_type == b"zTXt":
+                if keys is None or key in keys:
+                    info[key] = _inflate(rest[1:]).decode("latin-1", "replace")
+            else:
+                compressed = rest[:1] == b"\1"
+                _language, _, rest = rest[2:].partition(b"\0")
+                _translated, _, text = rest.partition(b"\0")
+                if not compressed:
+                    info[key] = text.decode("utf-8", "replace")
+                elif keys is None or key in keys:
+                    info[key] = _inflate(text).decode("utf-8", "replace")
+        else:
+            f.seek(length, os.SEEK_CUR)
+        # CRC
+        f.seek(4, os.SEEK_CUR)
+    return info, size
+
+
+def _exif_text(tag: int, value: bytes, order: str) -> str:
+    """Decodes an EXIF string value; UserComment starts with an 8-byte character code."""
+    if tag == 0x9286:
+        code, value = value[:8], value[8:]
+        if code.startswith(b"UNICODE"):
+            return value.decode("utf-16-be" if order == ">" else "utf-16-le", "replace").rstrip("\0")
+    return value.decode("utf-8", "replace").rstrip("\0")
+
+
+def parse_exif(data: bytes) -> dict:
+    """Returns the EXIF_TEXT_TAGS strings of an EXIF block ('Exif\\0\\0' prefix optional), keyed as in img.info."""
+    if data.startswith(b"Exif\0\0"):
+        data = data[6:]
+    if data[:2] not in (b"II", b"MM"):
+        return {}
+    order = "<" if data[:2] == b"II" else ">"
+    info = {}
     try:
-        with Image.open(image_path) as img:
-            info = img.info
+        pending = [struct.unpack(order + "I", data[4:8])[0]]
+        seen = set()
+        while pending:
+            offset = pending.pop()
+            if offset in seen or offset + 2 > len(data):
+                continue
+            seen.add(offset)
+            (count,) = struct.unpack(order + "H", data[offset:offset + 2])
+            for n in range(count):
+                entry = data[offset + 2 + 12 * n:offset + 14 + 12 * n]
+                tag, kind, length = struct.unpack(order + "HHI", entry[:8])
+                if tag == EXIF_IFD_POINTER:
+                    pending.append(struct.unpack(order + "I", entry[8:12])[0])
+                elif tag in EXIF_TEXT_TAGS and kind in (1, 2, 7):
+                    # BYTE, ASCII or UNDEFINED values, stored inline up to 4 bytes
+                    if length <= 4:
+                        value = entry[8:8 + length]
+                    else:
+                        (start,) = struct.unpack(order + "I", entry[8:12])
+                        value = data[start:start + length]
+                    text = _exif_text(tag, value, order)
+                    # "prompt:{...}" / "workflow:{...}" are stored under their own key
+                    match = EXIF_KEY_VALUE.match(text)
+                    if match:
+                        info[match.group(1).lower()] = text[match.end():]
+                    else:
+                        info[EXIF_TEXT_TAGS[tag]] = text
+    except struct.error:
+        pass
+    return info
+
+
+def read_webp_metadata(f: BinaryIO) -> tuple[dict, tuple[int, int] | None]:
+    """Reads the canvas size and EXIF strings of a WebP (after its 12-byte RIFF header); image data is skipped."""
+    info = {}
+    size = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        fourcc, length = struct.unpack("<4sI", header)
+        padded = length + (length & 1)
+        if fourcc == b"VP8X":
+            data = f.read(padded)
+            size = (int.from_bytes(data[4:7], "little") + 1, int.from_bytes(data[7:10], "little") + 1)
+        elif fourcc == b"VP8 " and size is None:
+            data = f.read(padded)
+            width, height = struct.unpack("<HH", data[6:10])
+            size = (width & 0x3FFF, height & 0x3FFF)
+        elif fourcc == b"VP8L" and size is None:
+            data = f.read(padded)
+            bits = int.from_bytes(data[1:5], "little")
+            size = ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        elif fourcc == b"EXIF":
+            info.update(parse_exif(f.read(padded)[:length]))
+        else:
+            f.seek(padded, os.SEEK_CUR)
+    return info, size
+
+
+def read_jpeg_metadata(f: BinaryIO) -> tuple[dict, tuple[int, int] | None]:
+    """Reads the size, EXIF strings and COM comment of a JPEG (after its SOI marker), stopping at the scan data."""
+    info = {}
+    size = None
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        kind = marker[1]
+        if kind == 0xFF:
+            # Fill byte before a marker
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if kind == 0xDA or kind == 0xD9:
+            break
+        if kind == 0x01 or 0xD0 <= kind <= 0xD7:
+            continue
+        length = f.read(2)
+        if len(length) < 2:
+            raise ValueError("truncated JPEG")
+        (length,) = struct.unpack(">H", length)
+        if kind == 0xE1 or kind == 0xFE:
+            data = f.read(length - 2)
+            if len(data) < length - 2:
+                raise ValueError("truncated JPEG")
+            if kind == 0xFE:
+                info["comment"] = data.decode("utf-8", "replace")
+            elif data.startswith(b"Exif\0\0"):
+                info.update(parse_exif(data))
+        elif 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+            data = f.read(length - 2)
+            if len(data) < 5:
+                raise ValueError("truncated JPEG")
+            height, width = struct.unpack(">HH", data[1:5])
+            size = (width, height)
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+    return info, size
+
+
+def read_metadata(image_path: Path, keys: Iterable[str] | None = METADATA_KEYS) -> tuple[dict, tuple[int, int] | None]:
+    """
+    Returns (info, (width, height)) of a PNG, WebP or JPEG image without decoding it: info
+    holds the text metadata (the equivalent of PIL's img.info strings, see read_png_metadata
+    for `keys`). Raises ValueError for other formats.
+    """
+    with open(image_path, "rb") as f:
+        head = f.read(12)
+        if head.startswith(PNG_SIGNATURE):
+            f.seek(len(PNG_SIGNATURE))
+            return read_png_metadata(f, keys)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return read_webp_metadata(f)
+        if head[:2] == b"\xff\xd8":
+            f.seek(2)
+            return read_jpeg_metadata(f)
+    raise ValueError("unsupported image format (PNG, WebP or JPEG expected)")
 
-        # 1. Inspect the executed prompt inputs for the specific node
-        if "prompt" in info:
-            try:
-                prompt_json = json.loads(info["prompt"])
-                node_data = prompt_json.get(target_node, {})
-                inputs = node_data.get("inputs", {})
-
-                # Check all input keys except ignored ones (like 'lastAccepted')
-                for key, val in inputs.items():
-                    if key not in ignored_keys and isinstance(val, str):
-                        match = THEME_PATTERN.search(val)
-                        if match:
-                            return match.group(1)
-            except json.JSONDecodeError:
-                pass
-
-        # 2. Inspect workflow node widgets (skipping 'lastAccepted')
-        if "workflow" in info:
-            try:
-                workflow_json = json.loads(info["workflow"])
-                for node in workflow_json.get("nodes", []):
-                    if str(node.get("id")) == target_node:
-                        # Check widgets_values (often a list of values)
-                        widgets = node.get("widgets_values", [])
-                        if isinstance(widgets, list):
-                            for item in widgets:
-                                if isinstance(item, str):
-                                    match = THEME_PATTERN.search(item)
-                                    if match:
-                                        return match.group(1)
-            except json.JSONDecodeError:
-                pass
-
-        # 3. Fallback: Search remaining metadata strings
-        for key, value in info.items():
-            if key not in ("prompt", "workflow") and isinstance(value, str):
-                match = THEME_PATTERN.search(value)
-                if match:
-                    return match.group(1)
 
+def extract_theme(
+    image_path: Path,
+    target_node: str = "672",
+    ignored_keys: tuple = ("lastAccepted",)
+) -> str | None:
+    """Extracts the theme string from the image metadata, avoiding ignored keys like lastAccepted."""
+    try:
+        info, _ = read_metadata(image_path)
+        return theme_from_info(info, target_node, ignored_keys)
     except Exception as e:
         print(f"Error reading {image_path.name}: {e}", file=sys.stderr)
 
     return None
 
 
+def _model_key(name: str) -> str:
+    """Lookup key of a checkpoint / LoRA name: file name without folder or extension, lowercase."""
+    name = name.replace("\\", "/").rsplit("/", 1)[-1]
+    stem, dot, ext = name.rpartition(".")
+    return (stem if dot and ext.lower() in ("safetensors", "ckpt", "pt", "gguf", "sft", "bin") else name).lower()
 
-def process_image(image_path: Path, move: bool, target_node: str):
-    if not image_path.is_file():
-        print(f"[SKIP] Not a file: {image_path}")
-        return
 
-    theme = extract_theme(image_path, target_node)
+def _number(value) -> int | float | None:
+    """Literal number of a prompt input ([node, output] links and booleans are not numbers)."""
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
 
-    if not theme:
-        print(f"[NOT FOUND] {image_path.name}: No matching '__gkr_<theme>/...' pattern found.")
+
+def generation_info(
+    info: dict,
+    size: tuple[int, int] | None = None,
+    target_node: str = "672",
+    ignored_keys: tuple = ("lastAccepted",),
+) -> dict:
+    """
+    Summarizes the generation metadata of an image: theme (see theme_from_info), wildcard
+    references ("theme/category"), checkpoints, LoRAs, seed, sampler, scheduler, steps, cfg,
+    width, height and the prompt text (string inputs, for full-text search).
+    Read from the ComfyUI prompt (API format) when present, else from A1111-style parameters.
+    """
+    record = {
+        "theme": theme_from_info(info, target_node, ignored_keys), "wildcards": [], "checkpoints": [], "loras": [],
+        "seed": None, "sampler": None, "scheduler": None, "steps": None, "cfg": None,
+        "width": size[0] if size else None, "height": size[1] if size else None, "text": "",
+    }
+    texts = []
+    try:
+        prompt = json.loads(info["prompt"]) if "prompt" in info else None
+    except json.JSONDecodeError:
+        prompt = None
+    if isinstance(prompt, dict):
+        nodes = [node for node in prompt.values() if isinstance(node, dict)]
+        # Sampler settings are taken from sampler nodes first (other nodes also have seeds)
+        nodes.sort(key=lambda node: "sampler" not in str(node.get("class_type", "")).lower())
+        for node in nodes:
+            inputs = node.get("inputs")
+            if not isinstance(inputs, dict):
+                continue
+            for key, value in inputs.items():
+                if key in ignored_keys:
+                    continue
+                if isinstance(value, str):
+                    if key in CHECKPOINT_INPUTS:
+                        record["checkpoints"].append(value)
+                    elif key == "lora_name":
+                        record["loras"].append(value)
+                    elif key in ("sampler_name", "scheduler"):
+                        field = "sampler" if key == "sampler_name" else "scheduler"
+                        record[field] = record[field] or value
+                    else:
+                        texts.append(value)
+                elif isinstance(value, dict) and isinstance(value.get("__value__"), list):
+                    # LoRA Manager loaders: {"__value__": [{"name": ..., "active": true}, ...]}
+                    record["loras"].extend(
+                        str(item["name"]) for item in value["__value__"]
+                        if isinstance(item, dict) and item.get("name") and item.get("active", True)
+                    )
+                elif _number(value) is not None:
+                    field = {"seed": "seed", "noise_seed": "seed", "steps": "steps", "cfg": "cfg"}.get(key)
+                    if field and record[field] is None:
+                        record[field] = value
+    elif "parameters" in info:
+        text = info["parameters"]
+        texts.append(text.split("\nNegative prompt:", 1)[0])
+        for name, value in PARAMETER_PATTERN.findall(text):
+            value = value.strip()
+            if name == "Model":
+                record["checkpoints"].append(value)
+            elif name in ("Sampler", "Schedule type"):
+                record["sampler" if name == "Sampler" else "scheduler"] = value
+            else:
+                try:
+                    number = float(value) if name == "CFG scale" else int(value)
+                except ValueError:
+                    continue
+                record[{"Steps": "steps", "CFG scale": "cfg", "Seed": "seed"}[name]] = number
+
+    for text in texts:
+        record["wildcards"].extend(f"{theme}/{category}" for theme, category in WILDCARD_PATTERN.findall(text))
+        record["loras"].extend(LORA_TAG_PATTERN.findall(text))
+    for field in ("wildcards", "checkpoints", "loras"):
+        record[field] = list(dict.fromkeys(record[field]))
+    record["text"] = "\n".join(dict.fromkeys(texts))[:MAX_INDEXED_TEXT]
+    return record
+
+
+def extract_job(image_path: Path, target_node: str) -> tuple[Path, os.stat_result | None, str | None, str | None]:
+    """Worker job: returns (path, stat, theme, error); errors are returned rather than printed."""
+    try:
+        st = image_path.stat()
+        info, _ = read_metadata(image_path)
+        return image_path, st, theme_from_info(info, target_node), None
+    except Exception as e:
+        return image_path, None, None, str(e)
+
+
+def index_job(image_path: Path, target_node: str) -> tuple[Path, os.stat_result | None, dict | None, str | None]:
+    """Worker job for --build-index: returns (path, stat, generation_info record, error)."""
+    try:
+        st = image_path.stat()
+        info, size = read_metadata(image_path, keys=None)
+        return image_path, st, generation_info(info, size, target_node), None
+    except Exception as e:
+        return image_path, None, None, str(e)
+
+
+class ThemeCache:
+    """
+    SQLite cache of extracted themes, keyed by the resolved image path and valid while the
+    image keeps the same size and mtime. Images without a theme are cached too (theme NULL),
+    images that could not be read are not.
+    The same database holds the searchable generation metadata index (--build-index): one
+    `images` row per image, its checkpoints / LoRAs and wildcard references in indexed tables,
+    and an FTS5 table over its theme, wildcards, models and prompt text. On SQLite builds
+    without FTS5 the index works without that table (fts is False) and text searches fail.
+    """
+    SCHEMA_VERSION = 3
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            for table in ("themes", "images", "image_models", "image_wildcards", "images_fts", "image_hashes"):
+                self.conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS themes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " node TEXT NOT NULL,"
+            " theme TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " id INTEGER PRIMARY KEY,"
+            " path TEXT NOT NULL UNIQUE,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " node TEXT NOT NULL,"
+            " theme TEXT,"
+            " seed INTEGER,"
+            " sampler TEXT,"
+            " scheduler TEXT,"
+            " steps INTEGER,"
+            " cfg REAL,"
+            " width INTEGER,"
+            " height INTEGER)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_theme ON images (theme)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_seed ON images (seed)")
+        # kind is 'checkpoint' or 'lora'; key is the name without folder or extension, lowercase
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_models ("
+            " image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,"
+            " kind TEXT NOT NULL,"
+            " name TEXT NOT NULL,"
+            " key TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS image_models_key ON image_models (kind, key)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS image_models_image ON image_models (image_id)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_wildcards ("
+            " image_id INTEGER NOT NULL REFERENCES images (id) ON DELETE CASCADE,"
+            " wildcard TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS image_wildcards_wildcard ON image_wildcards (wildcard)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS image_wildcards_image ON image_wildcards (image_id)")
+        had_fts = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'images_fts'").fetchone() is not None
+        try:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5 (theme, wildcards, models, text)"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        if self.fts and not had_fts:
+            # An index built without FTS5 has no text rows to match: build it again from scratch
+            for table in ("image_models", "image_wildcards", "images"):
+                self.conn.execute(f"DELETE FROM {table}")
+        # Perceptual hashes for --dedupe, as 16 hex digits (SQLite integers are signed)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS image_hashes ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " dhash TEXT NOT NULL)"
+        )
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.commit()
+        self.pending = 0
+
+    @staticmethod
+    def key(image_path: Path) -> str:
+        return str(image_path.resolve())
+
+    def get(self, image_path: Path, st: os.stat_result, target_node: str) -> tuple[bool, str | None]:
+        """Returns (found, theme) for an image whose size and mtime did not change."""
+        row = self.conn.execute(
+            "SELECT theme FROM themes WHERE path = ? AND size = ? AND mtime_ns = ? AND node = ?",
+            (self.key(image_path), st.st_size, st.st_mtime_ns, target_node),
+        ).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def put(self, image_path: Path, st: os.stat_result, target_node: str, theme: str | None) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO themes (path, size, mtime_ns, node, theme) VALUES (?, ?, ?, ?, ?)",
+            (self.key(image_path), st.st_size, st.st_mtime_ns, target_node, theme),
+        )
+        # Commit in batches: one transaction per image would dominate the run time
+        self.pending += 1
+        if self.pending >= CACHE_COMMIT_EVERY:
+            self.commit()
+
+    def has_record(self, image_path: Path, st: os.stat_result, target_node: str) -> bool:
+        """True when the image is indexed and did not change since."""
+        return self.conn.execute(
+            "SELECT 1 FROM images WHERE path = ? AND size = ? AND mtime_ns = ? AND node = ?",
+            (self.key(image_path), st.st_size, st.st_mtime_ns, target_node),
+        ).fetchone() is not None
+
+    def put_record(self, image_path: Path, st: os.stat_result, target_node: str, record: dict) -> None:
+        """Stores (or replaces) the generation_info record of an image; its theme is cached too."""
+        path = self.key(image_path)
+        self.remove_record(path)
+        cursor = self.conn.execute(
+            "INSERT INTO images (path, size, mtime_ns, node, theme, seed, sampler, scheduler, steps, cfg, width, height)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, target_node, record["theme"], record["seed"], record["sampler"],
+             record["scheduler"], record["steps"], record["cfg"], record["width"], record["height"]),
+        )
+        image_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT INTO image_models (image_id, kind, name, key) VALUES (?, ?, ?, ?)",
+            [(image_id, "checkpoint", name, _model_key(name)) for name in record["checkpoints"]]
+            + [(image_id, "lora", name, _model_key(name)) for name in record["loras"]],
+        )
+        self.conn.executemany(
+            "INSERT INTO image_wildcards (image_id, wildcard) VALUES (?, ?)",
+            [(image_id, wildcard) for wildcard in record["wildcards"]],
+        )
+        if self.fts:
+            self.conn.execute(
+                "INSERT INTO images_fts (rowid, theme, wildcards, models, text) VALUES (?, ?, ?, ?, ?)",
+                (image_id, record["theme"] or "", " ".join(record["wildcards"]),
+                 " ".join(record["checkpoints"] + record["loras"]), record["text"]),
+            )
+        self.put(image_path, st, target_node, record["theme"])
+
+    def remove_record(self, path: str) -> None:
+        row = self.conn.execute("SELECT id FROM images WHERE path = ?", (path,)).fetchone()
+        if row:
+            if self.fts:
+                self.conn.execute("DELETE FROM images_fts WHERE rowid = ?", row)
+            self.conn.execute("DELETE FROM images WHERE id = ?", row)
+
+    def prune_records(self, directory: Path, seen: set[str]) -> int:
+        """Removes the indexed images below directory that were not seen by the last walk; returns their number."""
+        root = str(directory.resolve()).rstrip(os.sep)
+        lower, upper = root + os.sep, root + chr(ord(os.sep) + 1)
+        gone = [path for (path,) in self.conn.execute("SELECT path FROM images WHERE path >= ? AND path < ?", (lower, upper))
+                if path not in seen]
+        for path in gone:
+            self.remove_record(path)
+        return len(gone)
+
+    def search(
+        self,
+        text: str | None = None,
+        theme: str | None = None,
+        lora: str | None = None,
+        checkpoint: str | None = None,
+        wildcard: str | None = None,
+        limit: int | None = 100,
+    ) -> list[dict]:
+        """
+        Returns the indexed images matching every given filter, by path: text is an FTS5 query
+        over theme, wildcards, models and prompt text; lora / checkpoint are model names (without
+        folder or extension, case-insensitive); wildcard is "theme/category".
+        A text query raises sqlite3.OperationalError when SQLite was built without FTS5.
+        """
+        where, params = [], []
+        if text:
+            if not self.fts:
+                raise sqlite3.OperationalError("full-text search needs an SQLite build with FTS5")
+            where.append("images.id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+            params.append(text)
+        if theme:
+            where.append("images.theme = ?")
+            params.append(theme)
+        for kind, name in (("lora", lora), ("checkpoint", checkpoint)):
+            if name:
+                where.append("images.id IN (SELECT image_id FROM image_models WHERE kind = ? AND key = ?)")
+                params.extend((kind, _model_key(name)))
+        if wildcard:
+            where.append("images.id IN (SELECT image_id FROM image_wildcards WHERE wildcard = ?)")
+            params.append(wildcard.strip("_").removeprefix("gkr_"))
+        sql = "SELECT * FROM images"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY path"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        cursor = self.conn.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        results = [dict(zip(columns, row)) for row in cursor]
+        for result in results:
+            models = self.conn.execute("SELECT kind, name FROM image_models WHERE image_id = ?", (result["id"],)).fetchall()
+            result["checkpoints"] = [name for kind, name in models if kind == "checkpoint"]
+            result["loras"] = [name for kind, name in models if kind == "lora"]
+        return results
+
+    def get_hash(self, image_path: Path, st: os.stat_result) -> int | None:
+        """Returns the cached dHash of an image whose size and mtime did not change, or None."""
+        row = self.conn.execute(
+            "SELECT dhash FROM image_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (self.key(image_path), st.st_size, st.st_mtime_ns),
+        ).fetchone()
+        return int(row[0], 16) if row else None
+
+    def put_hash(self, image_path: Path, st: os.stat_result, dhash: int) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO image_hashes (path, size, mtime_ns, dhash) VALUES (?, ?, ?, ?)",
+            (self.key(image_path), st.st_size, st.st_mtime_ns, f"{dhash:016x}"),
+        )
+        self.pending += 1
+        if self.pending >= CACHE_COMMIT_EVERY:
+            self.commit()
+
+    def themes(self) -> set[str]:
+        """Every theme found so far."""
+        return {theme for (theme,) in self.conn.execute("SELECT DISTINCT theme FROM themes WHERE theme IS NOT NULL")}
+
+    def moved(self, src: Path, dest: Path) -> None:
+        """Keeps the entry of a moved image (a rename keeps its mtime) under its new path."""
+        self.conn.execute("UPDATE OR REPLACE themes SET path = ? WHERE path = ?", (self.key(dest), self.key(src)))
+        self.remove_record(self.key(dest))
+        self.conn.execute("UPDATE images SET path = ? WHERE path = ?", (self.key(dest), self.key(src)))
+        self.conn.execute("UPDATE OR REPLACE image_hashes SET path = ? WHERE path = ?", (self.key(dest), self.key(src)))
+
+    def commit(self) -> None:
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self.conn.close()
+
+
+def known_themes(cache: ThemeCache | None = None) -> set[str]:
+    """Theme folder names: one per gkr-<theme>.yaml wildcard file next to the script, plus the cached themes."""
+    themes = {path.stem[len("gkr-"):] for path in Path(__file__).parent.glob("gkr-*.yaml")}
+    if cache is not None:
+        themes |= cache.themes()
+    return themes
+
+
+def iter_images(
+    paths: Iterable[Path],
+    recursive: bool = False,
+    extensions: Iterable[str] = IMAGE_EXTENSIONS,
+    skip_dirs: set[str] | frozenset = frozenset(),
+) -> Iterator[Path]:
+    """
+    Yields the images to process as they are found: file arguments as given, and the files of
+    directory arguments with one of `extensions` (case-insensitive). With recursive, their
+    subdirectories are walked too, except those named in skip_dirs (theme folders made by
+    --move); skip_dirs is checked as the walk goes, so themes added to it meanwhile are skipped.
+    """
+    extensions = tuple(ext.lower() if ext.startswith(".") else f".{ext.lower()}" for ext in extensions)
+    for path in paths:
+        if path.is_file():
+            yield path
+            continue
+        if not path.is_dir():
+            print(f"[SKIP] Not a file: {path}")
+            continue
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            files, subdirs = [], []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.name)
+                            elif entry.name.lower().endswith(extensions) and entry.is_file():
+                                files.append(entry.name)
+                        except OSError:
+                            continue
+            except OSError as e:
+                print(f"[SKIP] Cannot list {directory}: {e}", file=sys.stderr)
+                continue
+            for name in sorted(files):
+                yield directory / name
+            if recursive:
+                # Reversed so that the stack pops them in name order
+                stack.extend(directory / name for name in sorted(subdirs, reverse=True) if name not in skip_dirs)
+
+
+def run_jobs(job: Callable, items: Iterable, jobs: int, *args, lookup: Callable | None = None) -> Iterator:
+    """
+    Yields job(item, *args) for every item: in order in this process when jobs <= 1, else in
+    completion order from a pool of `jobs` processes. At most jobs * JOBS_QUEUE_FACTOR items are
+    queued at once, so a long (or lazily produced) input is consumed as the workers progress.
+    When lookup(item) returns a result (not None), it is yielded right away instead of running the job.
+    """
+    if jobs <= 1:
+        for item in items:
+            ready = lookup(item) if lookup else None
+            yield job(item, *args) if ready is None else ready
         return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = set()
+        try:
+            for item in items:
+                ready = lookup(item) if lookup else None
+                if ready is not None:
+                    yield ready
+                    continue
+                pending.add(pool.submit(job, item, *args))
+                if len(pending) >= jobs * JOBS_QUEUE_FACTOR:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+def extract_themes(
+    images: Iterable[Path], target_node: str, jobs: int = 1, cache: ThemeCache | None = None
+) -> Iterator[tuple[Path, str | None, str | None]]:
+    """
+    Yields (path, theme, error) for every image, as soon as it is known. Cached themes are
+    returned without opening the image; the others are extracted by extract_job (in `jobs`
+    processes) and cached.
+    """
+    def lookup(image_path: Path):
+        try:
+            st = image_path.stat()
+        except OSError:
+            return None
+        found, theme = cache.get(image_path, st, target_node)
+        # No stat in the result: nothing to store again
+        return (image_path, None, theme, None) if found else None
+
+    results = run_jobs(extract_job, images, jobs, target_node, lookup=lookup if cache is not None else None)
+    for image_path, st, theme, error in results:
+        if cache is not None and st is not None and error is None:
+            cache.put(image_path, st, target_node, theme)
+        yield image_path, theme, error
 
-    if move:
-        dest_dir = image_path.parent / theme
-        dest_dir.mkdir(parents=True, exist_ok=True)
-        dest_path = dest_dir / image_path.name
 
-        # Prevent overwriting if filename exists in target
-        if dest_path.exists() and dest_path != image_path:
-            print(f"[EXISTS] Cannot move {image_path.name}: File already exists in {theme}/")
+def build_index(
+    images: Iterable[Path], cache: ThemeCache, target_node: str, jobs: int = 1
+) -> Iterator[tuple[Path, str, str | None]]:
+    """
+    Indexes the generation metadata of images (see generation_info) with `jobs` processes.
+    Images already indexed with the same size and mtime are not read again.
+    Yields (path, status, error) as images are done, status being 'indexed', 'unchanged' or 'error'.
+    """
+    def lookup(image_path: Path):
+        try:
+            st = image_path.stat()
+        except OSError:
+            return None
+        return (image_path, None, None, None) if cache.has_record(image_path, st, target_node) else None
+
+    for image_path, st, record, error in run_jobs(index_job, images, jobs, target_node, lookup=lookup):
+        if error:
+            yield image_path, "error", error
+        elif record is None:
+            yield image_path, "unchanged", None
+        else:
+            cache.put_record(image_path, st, target_node, record)
+            yield image_path, "indexed", None
+
+
+class RunLock:
+    """
+    Lock file held while a run moves images, so that two runs (or a run and --undo) never
+    plan and rename the same files at the same time. A lock left by a process that no longer
+    exists is taken over.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.held = False
+
+    def _owner(self) -> int | None:
+        try:
+            return int(self.path.read_text(encoding="ascii").strip())
+        except (OSError, ValueError):
+            return None
+
+    def acquire(self) -> None:
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                pid = self._owner()
+                if pid is None or _pid_alive(pid):
+                    raise RuntimeError(
+                        f"Another theme_organizer run (pid {pid or '?'}) is moving images: {self.path} exists. "
+                        "Delete it if that run is no longer active."
+                    )
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self.path)
+                continue
+            with os.fdopen(fd, "w", encoding="ascii") as f:
+                f.write(str(os.getpid()))
+            self.held = True
             return
+        raise RuntimeError(f"Could not take the lock {self.path}")
+
+    def release(self) -> None:
+        if self.held:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+            self.held = False
+
+    def __enter__(self) -> "RunLock":
+        self.acquire()
+        return self
 
-        shutil.move(str(image_path), str(dest_path))
-        print(f"[MOVED] {image_path.name} -> {theme}/")
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _pid_alive(pid: int) -> bool:
+    # os.kill(pid, 0) terminates the process on Windows: treat the lock as held there
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _rename(src: Path, dest: Path) -> None:
+    """os.rename, falling back to a copy for moves to another device."""
+    try:
+        os.rename(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(str(src), str(dest))
+
+
+def move_images(
+    moves: Iterable[tuple[Path, Path]], journal_path: Path | None = None, cache: ThemeCache | None = None
+) -> dict[str, int]:
+    """
+    Applies planned (source, destination) moves. Each destination folder is created once, each
+    move re-checked just before the rename (source gone: already moved by an interrupted run;
+    destination taken: left alone) and, once done, appended to the journal so --undo can revert it.
+    Returns counts of moved, skipped, existing and failed moves.
+    """
+    run = datetime.now().isoformat(timespec="microseconds")
+    counts = {"moved": 0, "skipped": 0, "exists": 0, "failed": 0}
+    created: set[Path] = set()
+    journal = open(journal_path, "a", encoding="utf-8") if journal_path is not None else None
+    try:
+        for src, dest in moves:
+            if not src.exists():
+                counts["skipped"] += 1
+                continue
+            if dest.parent not in created:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                created.add(dest.parent)
+            if dest.exists():
+                counts["exists"] += 1
+                print(f"[EXISTS] Cannot move {src.name}: File already exists in {dest.parent.name}/")
+                continue
+            try:
+                _rename(src, dest)
+            except OSError as e:
+                counts["failed"] += 1
+                print(f"Error moving {src.name}: {e}", file=sys.stderr)
+                continue
+            if journal is not None:
+                journal.write(json.dumps({"run": run, "src": str(src), "dest": str(dest)}) + "\n")
+                journal.flush()
+            if cache is not None:
+                cache.moved(src, dest)
+            counts["moved"] += 1
+            print(f"[MOVED] {src.name} -> {dest.parent.name}/")
+    finally:
+        if journal is not None:
+            os.fsync(journal.fileno())
+            journal.close()
+    return counts
+
+
+def read_journal(journal_path: Path) -> list[dict]:
+    """Moves recorded in the journal, oldest first (a line torn by a crash is ignored)."""
+    entries = []
+    try:
+        with open(journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(entry, dict) and {"run", "src", "dest"} <= entry.keys():
+                    entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def undo_moves(journal_path: Path, cache: ThemeCache | None = None) -> dict[str, int]:
+    """
+    Moves the images of the last run recorded in the journal back, newest first, and removes
+    the folders it left empty. Reverted moves are dropped from the journal, so repeated --undo
+    steps back one run at a time; moves blocked by an existing file or an error stay for a later attempt.
+    """
+    entries = read_journal(journal_path)
+    counts = {"restored": 0, "missing": 0, "exists": 0, "failed": 0}
+    if not entries:
+        return counts
+    run = entries[-1]["run"]
+    reverted: set[int] = set()
+    folders: set[Path] = set()
+    for n in reversed([n for n, entry in enumerate(entries) if entry["run"] == run]):
+        entry = entries[n]
+        src, dest = Path(entry["src"]), Path(entry["dest"])
+        if not dest.exists():
+            counts["missing"] += 1
+            reverted.add(n)
+            print(f"[MISSING] {dest} is gone, cannot restore it")
+            continue
+        if src.exists():
+            counts["exists"] += 1
+            print(f"[EXISTS] Cannot restore {dest.name}: {src} already exists")
+            continue
+        try:
+            src.parent.mkdir(parents=True, exist_ok=True)
+            _rename(dest, src)
+        except OSError as e:
+            counts["failed"] += 1
+            print(f"Error restoring {dest.name}: {e}", file=sys.stderr)
+            continue
+        if cache is not None:
+            cache.moved(dest, src)
+        folders.add(dest.parent)
+        reverted.add(n)
+        counts["restored"] += 1
+        print(f"[RESTORED] {dest.parent.name}/{dest.name} -> {src.parent}")
+
+    for folder in folders:
+        with contextlib.suppress(OSError):
+            folder.rmdir()
+
+    temporary = journal_path.with_name(journal_path.name + ".partial")
+    with open(temporary, "w", encoding="utf-8") as f:
+        for entry in (entry for n, entry in enumerate(entries) if n not in reverted):
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, journal_path)
+    return counts
+
+
+def dhash(image_path: Path, hash_size: int = HASH_SIZE) -> int:
+    """
+    Difference hash of an image: one bit per pair of horizontally adjacent pixels of a
+    (hash_size + 1) x hash_size grayscale thumbnail. Large images are decoded at a reduced
+    size (JPEG draft mode, integer reduce for the other formats) before resampling.
+    """
+    # Imported here: Pillow is only needed for --dedupe
+    from PIL import Image
+
+    with Image.open(image_path) as image:
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        if image.mode not in ("L", "LA", "RGB", "RGBA"):
+            image = image.convert("RGB")
+        factor = min(image.size) // (hash_size * 8)
+        if factor > 1:
+            image = image.reduce(factor)
+        pixels = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR).tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for column in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return bits
+
+
+def dhash_job(image_path: Path) -> tuple[Path, os.stat_result | None, int | None, str | None]:
+    """Worker job for --dedupe: returns (path, stat, dhash, error)."""
+    try:
+        st = image_path.stat()
+        return image_path, st, dhash(image_path), None
+    except Exception as e:
+        return image_path, None, None, str(e)
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with the Hamming distance: radius searches skip most of the tree."""
+
+    def __init__(self):
+        self.root = None  # [hash, items, {distance: child}]
+
+    def add(self, value: int, item) -> None:
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = (value ^ node[0]).bit_count()
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> list[tuple[int, object]]:
+        """Returns (distance, item) for every item whose hash is within radius of value."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (value ^ node[0]).bit_count()
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            # Triangle inequality: only children at distance - radius .. distance + radius can match
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+def duplicate_clusters(hashes: dict[Path, int], threshold: int = DEDUPE_THRESHOLD) -> list[list[Path]]:
+    """
+    Groups images whose hashes are within threshold bits of each other (transitively). Each
+    cluster of two or more images is sorted by name: the first one is the image to keep.
+    """
+    tree = BKTree()
+    for path, value in hashes.items():
+        tree.add(value, path)
+    parent = {path: path for path in hashes}
+
+    def find(path: Path) -> Path:
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    for path, value in hashes.items():
+        for _, other in tree.search(value, threshold):
+            a, b = find(path), find(other)
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+    clusters = {}
+    for path in hashes:
+        clusters.setdefault(find(path), []).append(path)
+    return sorted(sorted(cluster) for cluster in clusters.values() if len(cluster) > 1)
+
+
+def hash_images(
+    images: Iterable[Path], jobs: int = 1, cache: ThemeCache | None = None
+) -> Iterator[tuple[Path, int | None, str | None]]:
+    """Yields (path, dhash, error) for every image; hashes are computed by `jobs` processes and cached."""
+    def lookup(image_path: Path):
+        try:
+            st = image_path.stat()
+        except OSError:
+            return None
+        value = cache.get_hash(image_path, st)
+        return None if value is None else (image_path, None, value, None)
+
+    for image_path, st, value, error in run_jobs(dhash_job, images, jobs, lookup=lookup if cache is not None else None):
+        if cache is not None and st is not None and error is None:
+            cache.put_hash(image_path, st, value)
+        yield image_path, value, error
+
+
+def dedupe(
+    images: Iterable[Path], move: bool, threshold: int = DEDUPE_THRESHOLD, jobs: int = 1,
+    cache: ThemeCache | None = None, journal_path: Path | None = None,
+) -> dict[str, int]:
+    """
+    Finds near-duplicate images within each folder (theme folder) and reports them; with move,
+    the duplicates (all but the first image of each cluster) go to a 'duplicates' subfolder
+    (see move_images for journal_path).
+    Returns counts of images hashed, clusters and duplicates.
+    """
+    folders: dict[Path, dict[Path, int]] = {}
+    counts = {"images": 0, "errors": 0, "clusters": 0, "duplicates": 0}
+    moves: list[tuple[Path, Path]] = []
+    for image_path, value, error in hash_images(images, jobs=jobs, cache=cache):
+        if error:
+            counts["errors"] += 1
+            print(f"Error reading {image_path.name}: {error}", file=sys.stderr)
+            continue
+        counts["images"] += 1
+        folders.setdefault(image_path.parent, {})[image_path] = value
+
+    for folder in sorted(folders):
+        hashes = folders[folder]
+        for cluster in duplicate_clusters(hashes, threshold):
+            keep = cluster[0]
+            counts["clusters"] += 1
+            print(f"[KEEP] {keep.name} [{folder}]")
+            for duplicate in cluster[1:]:
+                counts["duplicates"] += 1
+                distance = (hashes[keep] ^ hashes[duplicate]).bit_count()
+                print(f"  [DUPLICATE] {duplicate.name} (distance {distance})")
+                moves.append((duplicate, folder / DUPLICATES_FOLDER / duplicate.name))
+    if move and moves:
+        move_images(moves, journal_path, cache=cache)
+    return counts
+
+
+def print_search_results(results: list[dict]) -> None:
+    for result in results:
+        details = [f"theme={result['theme'] or '-'}"]
+        if result["seed"] is not None:
+            details.append(f"seed={result['seed']}")
+        if result["sampler"]:
+            details.append(f"sampler={result['sampler']}" + (f"/{result['scheduler']}" if result["scheduler"] else ""))
+        if result["width"]:
+            details.append(f"{result['width']}x{result['height']}")
+        if result["checkpoints"]:
+            details.append(f"checkpoint={', '.join(result['checkpoints'])}")
+        if result["loras"]:
+            details.append(f"loras={', '.join(result['loras'])}")
+        print(f"{result['path']}  {' '.join(details)}")
+    print(f"{len(results)} image(s) found.")
+
+
+def place_image(image_path: Path, theme: str | None, move: bool) -> Path | None:
+    """Reports the theme of an image; with move, returns where it goes (moves are done by move_images)."""
+    if not theme:
+        print(f"[NOT FOUND] {image_path.name}: No matching '__gkr_<theme>/...' pattern found.")
+        return None
+
+    if move and image_path.parent.name == theme:
+        print(f"[IN PLACE] {image_path.name} is already in {theme}/")
+    elif move:
+        return image_path.parent / theme / image_path.name
     else:
         print(f"[THEME] {image_path.name} : '{theme}'")
+    return None
+
+
+def process_image(image_path: Path, move: bool, target_node: str):
+    if not image_path.is_file():
+        print(f"[SKIP] Not a file: {image_path}")
+        return
+
+    theme = extract_theme(image_path, target_node)
+    dest_path = place_image(image_path, theme, move)
+    if dest_path is not None:
+        move_images([(image_path, dest_path)])
 
 
 def main():
@@ -104,9 +1253,26 @@ def main():
     )
     parser.add_argument(
         "images",
-        nargs="+",
+        nargs="*",
         type=Path,
-        help="One or more image file paths or glob patterns (e.g., *.png).",
+        help="Image files or directories (e.g., *.png or an output folder).",
+    )
+    parser.add_argument(
+        "-r",
+        "--recursive",
+        action="store_true",
+        help="Also process the subdirectories of directory arguments (theme folders are skipped).",
+    )
+    parser.add_argument(
+        "--ext",
+        nargs="+",
+        default=list(IMAGE_EXTENSIONS),
+        help=f"Image extensions processed in directories (default: {' '.join(IMAGE_EXTENSIONS)}).",
+    )
+    parser.add_argument(
+        "--include-themed",
+        action="store_true",
+        help="With --recursive, also walk subdirectories named after a theme.",
     )
     parser.add_argument(
         "-m",
@@ -121,11 +1287,143 @@ def main():
         default="672",
         help="Node ID to check first (default: '672').",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Read image metadata with N processes in parallel (default: 1).",
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        default=DEFAULT_CACHE_PATH,
+        help="Theme cache database, reused between runs (default: theme_organizer.db next to the script).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the theme cache.",
+    )
+    parser.add_argument(
+        "--journal",
+        type=Path,
+        default=DEFAULT_JOURNAL_PATH,
+        help="Journal of the moves made by --move, used by --undo; a '.lock' file next to it keeps two runs from moving images at once (default: theme_organizer.journal next to the script).",
+    )
+    parser.add_argument(
+        "--undo",
+        action="store_true",
+        help="Move the images of the last --move run (or --dedupe --move run) back, from the journal.",
+    )
+
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="Index the generation metadata (theme, wildcards, checkpoints, LoRAs, seed, sampler, size) of the images into the cache database.",
+    )
+    parser.add_argument(
+        "--search",
+        nargs="?",
+        const="",
+        metavar="QUERY",
+        help="Search the index instead of processing images: full-text QUERY (SQLite FTS5 syntax, e.g. 'gothic AND cathedral'), combined with the filters below.",
+    )
+    parser.add_argument("--theme", help="With --search, only images of this theme.")
+    parser.add_argument("--lora", help="With --search, only images using this LoRA (file name, case-insensitive).")
+    parser.add_argument("--checkpoint", help="With --search, only images made with this checkpoint (file name, case-insensitive).")
+    parser.add_argument("--wildcard", help="With --search, only images using this wildcard (e.g. gothic/subject).")
+    parser.add_argument("--limit", type=int, default=100, help="With --search, maximum number of results (default: 100, 0 for all).")
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Find near-duplicate images within each folder (perceptual hash, needs Pillow); with --move, move them to a 'duplicates' subfolder.",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=DEDUPE_THRESHOLD,
+        help=f"With --dedupe, maximum number of differing hash bits (out of {HASH_SIZE * HASH_SIZE}) for near-duplicates (default: {DEDUPE_THRESHOLD}).",
+    )
 
     args = parser.parse_args()
+    searching = args.search is not None or any((args.theme, args.lora, args.checkpoint, args.wildcard))
+    if not args.images and not searching and not args.undo:
+        parser.error("give image files or directories (or --search / --undo)")
+    if args.no_cache and (searching or args.build_index):
+        parser.error("--build-index and --search use the cache database, remove --no-cache")
+
+    lock = RunLock(args.journal.with_name(args.journal.name + ".lock"))
+    if args.move or args.undo:
+        try:
+            lock.acquire()
+        except RuntimeError as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
+    cache = None
+    try:
+        cache = None if args.no_cache else ThemeCache(args.cache)
+        if args.undo:
+            counts = undo_moves(args.journal, cache=cache)
+            print(f"Restored: {counts['restored']}, missing: {counts['missing']}, blocked: {counts['exists']}, errors: {counts['failed']}")
+            return
+
+        if searching:
+            try:
+                results = cache.search(args.search, theme=args.theme, lora=args.lora, checkpoint=args.checkpoint,
+                                       wildcard=args.wildcard, limit=args.limit)
+            except sqlite3.OperationalError as e:
+                print(f"Invalid search: {e}", file=sys.stderr)
+                sys.exit(2)
+            print_search_results(results)
+            return
+
+        if args.build_index:
+            if not cache.fts:
+                print("[WARN] SQLite has no FTS5 module: the index is built without full-text search", file=sys.stderr)
+            counts = {"indexed": 0, "unchanged": 0, "error": 0}
+            seen = set()
+            images = iter_images(args.images, recursive=args.recursive, extensions=args.ext)
+            for image_path, status, error in build_index(images, cache, args.node, jobs=args.jobs):
+                counts[status] += 1
+                seen.add(cache.key(image_path))
+                if error:
+                    print(f"Error reading {image_path.name}: {error}", file=sys.stderr)
+            removed = sum(cache.prune_records(path, seen) for path in args.images if path.is_dir() and args.recursive)
+            print(f"Indexed: {counts['indexed']}, unchanged: {counts['unchanged']}, errors: {counts['error']}, removed: {removed}")
+            return
+
+        if args.dedupe:
+            try:
+                import PIL  # noqa: F401
+            except ImportError:
+                print("--dedupe needs Pillow: uv run --with pillow theme_organizer.py --dedupe ...", file=sys.stderr)
+                sys.exit(2)
+            images = iter_images(args.images, recursive=args.recursive, extensions=args.ext, skip_dirs={DUPLICATES_FOLDER})
+            counts = dedupe(images, args.move, threshold=args.threshold, jobs=args.jobs, cache=cache, journal_path=args.journal)
+            print(f"Images: {counts['images']}, duplicate sets: {counts['clusters']}, duplicates: {counts['duplicates']}, errors: {counts['errors']}")
+            return
 
-    for path in args.images:
-        process_image(path, move=args.move, target_node=args.node)
+        # Every theme is extracted before the first move: the plan is applied in one pass afterwards
+        moves = []
+        skip_dirs = set() if args.include_themed else known_themes(cache)
+        images = iter_images(args.images, recursive=args.recursive, extensions=args.ext, skip_dirs=skip_dirs)
+        for image_path, theme, error in extract_themes(images, args.node, jobs=args.jobs, cache=cache):
+            if error:
+                print(f"Error reading {image_path.name}: {error}", file=sys.stderr)
+            if theme and not args.include_themed:
+                skip_dirs.add(theme)
+            dest_path = place_image(image_path, theme, args.move)
+            if dest_path is not None:
+                moves.append((image_path, dest_path))
+        if moves:
+            counts = move_images(moves, args.journal, cache=cache)
+            print(f"Moved: {counts['moved']}, already moved: {counts['skipped']}, blocked: {counts['exists']}, errors: {counts['failed']}")
+    finally:
+        if cache is not None:
+            cache.close()
+        lock.release()
 
 
 if __name__ == "__main__":